@@ -0,0 +1,68 @@
+"""Measures how long it takes to snapshot and restore a journaled order book.
+
+Run with:
+    python benchmarks/journal_restore.py [orders in snapshot] [orders in journal]
+"""
+import random
+import sys
+import tempfile
+import time
+
+from mbex.trading.book import OrderBook, Side
+from mbex.trading.journal import JournalSettings
+from mbex.trading.markets import Market
+
+USERS = 10_000
+PRICE_LEVELS = 1_000
+
+
+def place(book: OrderBook, orders: int, user_ids: list[str]) -> None:
+    for _ in range(orders):
+        side = random.choice((Side.bid, Side.ask))
+        offset = random.randrange(1, PRICE_LEVELS)
+        # bids below 100_000 ticks, asks above, so nothing matches
+        price = 100_000 - offset if side == Side.bid else 100_000 + offset
+        user_id = random.choice(user_ids)
+        book.place(side, price, random.randrange(1, 1_000_000), user_id)
+
+
+def main(snapshot_orders: int, journal_orders: int) -> None:
+    random.seed(0)
+    market = Market("ETH", "BTC")
+    user_ids = [f"user+{n}@enforcer.pl" for n in range(USERS)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        # snapshot only when asked for
+        settings = JournalSettings(
+            directory=directory,
+            fsync_interval=0.01,
+            snapshot_every=snapshot_orders + journal_orders + 1,
+        )
+        book = settings.open_book(market)
+        place(book, snapshot_orders, user_ids)
+        started_at = time.perf_counter()
+        book.journal.snapshot()
+        took = time.perf_counter() - started_at
+        print(f"Snapshot of {len(book)} orders: {took:.2f} s")
+
+        started_at = time.perf_counter()
+        place(book, journal_orders, user_ids)
+        took = time.perf_counter() - started_at
+        print(f"Placing and journaling {journal_orders} orders: {took:.2f} s")
+        book.journal.close(snapshot=False)
+
+        started_at = time.perf_counter()
+        restored = settings.open_book(market)
+        took = time.perf_counter() - started_at
+        print(
+            f"Restoring {snapshot_orders} orders from the snapshot"
+            f" and {journal_orders} from the journal: {took:.2f} s"
+        )
+        restored.journal.close(snapshot=False)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100_000,
+    )
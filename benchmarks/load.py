@@ -0,0 +1,237 @@
+"""Load generator reporting latency percentiles and throughput of the API.
+
+Examples:
+    # against a running server
+    python benchmarks/load.py --concurrency 50 --duration 30 --output run.json
+    # against create_app() in this process, without network in between
+    python benchmarks/load.py --in-process --compare run.json
+
+Redis has to be running in both cases.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+
+import httpx
+
+from mbex.api.app import create_app
+
+DEFAULT_MIX = "place=40,cancel=40,book=15,balance=5"
+PERCENTILES = {"p50": 50, "p99": 99, "p999": 99.9}
+
+
+class Trader:
+    def __init__(self, client: httpx.AsyncClient, token: str, market: str) -> None:
+        self._client = client
+        self._headers = {"Authorization": token}
+        self._market = market
+        self._open_orders: list[str] = []
+
+    async def place(self) -> httpx.Response:
+        side = random.choice(("bid", "ask"))
+        # around 1, so about half of the orders cross the book
+        price = Decimal(random.randint(9_900, 10_100)).scaleb(-4)
+        response = await self._client.post(
+            f"/trading/{self._market}/orders",
+            headers=self._headers,
+            json={"volume": "0.01", "price": str(price), "side": side},
+        )
+        if response.status_code == 202:
+            self._open_orders.append(response.json()["order_id"])
+        return response
+
+    async def cancel(self) -> httpx.Response:
+        if not self._open_orders:
+            return await self.place()
+        order_id = self._open_orders.pop(random.randrange(len(self._open_orders)))
+        # orders could have been filled already, so 404 counts as success too
+        return await self._client.delete(
+            f"/trading/{self._market}/orders/{order_id}", headers=self._headers
+        )
+
+    async def book(self) -> httpx.Response:
+        return await self._client.get(f"/trading/{self._market}/order_book")
+
+    async def balance(self) -> httpx.Response:
+        return await self._client.get("/wallets/balances/BTC", headers=self._headers)
+
+
+async def new_trader(client: httpx.AsyncClient, market: str) -> Trader:
+    creds = {"username": f"{uuid.uuid4()}@enforcer.pl", "password": "PASSWORD"}
+    (await client.post("/auth/registration", json=creds)).raise_for_status()
+    response = await client.post("/auth/login", json=creds)
+    response.raise_for_status()
+    token = response.json()["token"]
+    for currency in market.split("-"):
+        (
+            await client.post(
+                f"/wallets/balances/{currency}/deposit",
+                headers={"Authorization": token},
+                json={"amount": "1000000"},
+            )
+        ).raise_for_status()
+    return Trader(client, token, market)
+
+
+async def worker(
+    trader: Trader,
+    mix: dict[str, int],
+    deadline: float,
+    latencies: dict[str, list[float]],
+    errors: dict[str, int],
+) -> None:
+    operations = list(mix)
+    weights = list(mix.values())
+    while time.perf_counter() < deadline:
+        operation = random.choices(operations, weights)[0]
+        started_at = time.perf_counter()
+        try:
+            response = await getattr(trader, operation)()
+        except httpx.HTTPError:
+            errors[operation] += 1
+            continue
+        took = time.perf_counter() - started_at
+        if response.status_code >= 400 and response.status_code != 404:
+            errors[operation] += 1
+        else:
+            latencies[operation].append(took)
+
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    """Nearest-rank percentile."""
+    rank = max(0, int(round(percent / 100 * len(sorted_values))) - 1)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    summary = {"count": len(latencies), "errors": errors}
+    summary["throughput_rps"] = round(len(latencies) / elapsed, 1)
+    if latencies:
+        latencies = sorted(latencies)
+        for name, percent in PERCENTILES.items():
+            summary[f"{name}_ms"] = round(percentile(latencies, percent) * 1000, 3)
+        summary["max_ms"] = round(latencies[-1] * 1000, 3)
+    return summary
+
+
+async def run(args: argparse.Namespace) -> dict:
+    mix = {
+        name: int(weight)
+        for name, weight in (part.split("=") for part in args.mix.split(","))
+    }
+    if args.in_process:
+        app = create_app()
+        await app.router.startup()
+        client = httpx.AsyncClient(app=app, base_url="http://mbex")
+    else:
+        app = None
+        client = httpx.AsyncClient(
+            base_url=args.url,
+            limits=httpx.Limits(max_connections=args.concurrency),
+            timeout=args.timeout,
+        )
+
+    try:
+        traders = [await new_trader(client, args.market) for _ in range(args.traders)]
+        latencies: dict[str, list[float]] = defaultdict(list)
+        errors: dict[str, int] = defaultdict(int)
+        started_at = time.perf_counter()
+        await asyncio.gather(
+            *(
+                worker(
+                    traders[n % len(traders)],
+                    mix,
+                    started_at + args.duration,
+                    latencies,
+                    errors,
+                )
+                for n in range(args.concurrency)
+            )
+        )
+        elapsed = time.perf_counter() - started_at
+    finally:
+        await client.aclose()
+        if app is not None:
+            await app.router.shutdown()
+
+    all_latencies = [took for took_list in latencies.values() for took in took_list]
+    return {
+        "config": {
+            "mode": "in-process" if args.in_process else args.url,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "traders": args.traders,
+            "mix": mix,
+            "market": args.market,
+        },
+        "total": summarize(all_latencies, sum(errors.values()), elapsed),
+        "operations": {
+            operation: summarize(latencies[operation], errors[operation], elapsed)
+            for operation in mix
+        },
+    }
+
+
+def print_results(results: dict, baseline: dict | None) -> None:
+    columns = ["count", "errors", "throughput_rps", "p50_ms", "p99_ms", "p999_ms"]
+    columns.append("max_ms")
+    print(f"{'operation':<10}" + "".join(f"{column:>16}" for column in columns))
+    rows = {"total": results["total"], **results["operations"]}
+    for name, summary in rows.items():
+        cells = []
+        for column in columns:
+            cell = f"{summary.get(column, '-')}"
+            if baseline is not None:
+                before = (
+                    baseline["total"]
+                    if name == "total"
+                    else baseline["operations"].get(name, {})
+                ).get(column)
+                now = summary.get(column)
+                if before and now is not None:
+                    cell += f" ({(now - before) / before:+.0%})"
+            cells.append(f"{cell:>16}")
+        print(f"{name:<10}" + "".join(cells))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="drive create_app() directly instead of a server at --url",
+    )
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--traders", type=int, default=5, help="users placing orders")
+    parser.add_argument("--market", default="ETH-BTC")
+    parser.add_argument(
+        "--mix",
+        default=DEFAULT_MIX,
+        help=f"weights of operations, default: {DEFAULT_MIX}",
+    )
+    parser.add_argument("--timeout", type=float, default=10, help="per request [s]")
+    parser.add_argument("--output", help="save results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""Microbenchmarks of the matching core, without HTTP and Redis.
+
+Every scenario builds its book untimed, then times one batch of operations on
+it. Runs are appended to a history file together with the commit they ran on
+and compared against the previous run, so regressions show up as they land.
+
+Run with:
+    python benchmarks/matching.py [--scenario NAME ...] [--repeat 5]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Callable
+from unittest.mock import patch
+
+from mbex import trading, wallets
+from mbex.trading.book import OrderBook, Side
+from mbex.trading.engine import depth_snapshot
+from mbex.trading.markets import Market
+from mbex.wallets.ledger import MemoryLedger
+from mbex.wallets.storage import MemoryStorage
+
+HISTORY = Path(__file__).parent / "results" / "matching.jsonl"
+MARKET = Market("ETH", "BTC")
+MID_PRICE = 1_000_000
+USERS = [f"user+{n}@enforcer.pl" for n in range(1_000)]
+
+# (callable to time, number of operations it performs)
+Prepared = tuple[Callable[[], object], int]
+
+
+def _fill(book: OrderBook, orders: int, levels: int) -> list[tuple[str, int]]:
+    """Rests `orders` non-crossing orders over `levels` levels on both sides."""
+    placed = []
+    for _ in range(orders):
+        user_id = random.choice(USERS)
+        side = random.choice((Side.bid, Side.ask))
+        offset = random.randint(1, levels // 2)
+        price = MID_PRICE - offset if side == Side.bid else MID_PRICE + offset
+        order_id, _ = book.place(side, price, random.randint(1, 1_000), user_id)
+        placed.append((user_id, order_id))
+    return placed
+
+
+def place_deep_book() -> Prepared:
+    """Resting orders joining a book of 100k orders on 1k levels."""
+    book = OrderBook(MARKET)
+    _fill(book, 100_000, 1_000)
+    orders = [
+        (Side.bid, MID_PRICE - random.randint(1, 500), random.choice(USERS))
+        for _ in range(10_000)
+    ]
+
+    def run() -> None:
+        for side, price, user_id in orders:
+            book.place(side, price, 1, user_id)
+
+    return run, len(orders)
+
+
+def place_wide_range() -> Prepared:
+    """Resting orders opening new levels all over 1M ticks."""
+    book = OrderBook(MARKET)
+    orders = [
+        (Side.ask, MID_PRICE + random.randint(1, 1_000_000), random.choice(USERS))
+        for _ in range(10_000)
+    ]
+
+    def run() -> None:
+        for side, price, user_id in orders:
+            book.place(side, price, 1, user_id)
+
+    return run, len(orders)
+
+
+def sweep() -> Prepared:
+    """One aggressive order taking 20 levels of 5 orders each."""
+    book = OrderBook(MARKET)
+    for offset in range(1, 21):
+        for user_id in random.sample(USERS, 5):
+            book.place(Side.ask, MID_PRICE + offset, 10, user_id)
+
+    def run() -> None:
+        book.place(Side.bid, MID_PRICE + 1_000, 20 * 5 * 10, USERS[0])
+
+    return run, 1
+
+
+def cancel_storm() -> Prepared:
+    """Cancelling all 100k resting orders in random order."""
+    book = OrderBook(MARKET)
+    placed = _fill(book, 100_000, 1_000)
+    random.shuffle(placed)
+
+    def run() -> None:
+        for user_id, order_id in placed:
+            book.cancel(user_id, order_id)
+
+    return run, len(placed)
+
+
+def depth_full() -> Prepared:
+    """Serialising all 2k levels of a book of which every level changed."""
+    book = OrderBook(MARKET)
+    _fill(book, 20_000, 2_000)
+
+    def run() -> None:
+        for _ in range(10):
+            book.snapshots.clear()
+            book.level_snapshots.clear()
+            depth_snapshot(book)
+
+    return run, 10
+
+
+def depth_full_after_place() -> Prepared:
+    """Serialising all 2k levels of a book after an order joined one of them."""
+    book = OrderBook(MARKET)
+    _fill(book, 20_000, 2_000)
+    depth_snapshot(book)
+    orders = [
+        (MID_PRICE - random.randint(1, 1_000), random.choice(USERS)) for _ in range(100)
+    ]
+
+    def run() -> None:
+        for price, user_id in orders:
+            book.place(Side.bid, price, 1, user_id)
+            depth_snapshot(book)
+
+    return run, len(orders)
+
+
+def depth_top() -> Prepared:
+    """Serialising 10 best levels per side of a changed book of 2k levels."""
+    book = OrderBook(MARKET)
+    _fill(book, 20_000, 2_000)
+
+    def run() -> None:
+        for _ in range(1_000):
+            book.snapshots.clear()
+            book.level_snapshots.clear()
+            depth_snapshot(book, 10)
+
+    return run, 1_000
+
+
+def place_order_trading() -> Prepared:
+    """`trading.place_order` of crossing and resting orders, in-memory wallets."""
+    trading.clear()
+    orders = [
+        (
+            random.choice((Side.bid, Side.ask)),
+            MID_PRICE + random.randint(-100, 100),
+            random.choice(USERS),
+        )
+        for _ in range(2_000)
+    ]
+
+    async def place_all() -> None:
+        for side, price, user_id in orders:
+            await trading.place_order(MARKET, price, 1, side, user_id, tasks=None)
+
+    storage = MemoryStorage()
+    for user_id in USERS:
+        asyncio.run(storage.credit(user_id, MARKET.base, 10**18))
+        asyncio.run(storage.credit(user_id, MARKET.quote, 10**18))
+
+    def run() -> None:
+        # holds of the orders go away with the book
+        with patch.object(wallets, "ledger", new=MemoryLedger(storage)):
+            asyncio.run(place_all())
+        trading.clear()
+
+    return run, len(orders)
+
+
+SCENARIOS: dict[str, Callable[[], Prepared]] = {
+    "place_deep_book": place_deep_book,
+    "place_wide_range": place_wide_range,
+    "sweep": sweep,
+    "cancel_storm": cancel_storm,
+    "depth_full": depth_full,
+    "depth_full_after_place": depth_full_after_place,
+    "depth_top": depth_top,
+    "place_order_trading": place_order_trading,
+}
+
+
+def measure(scenario: Callable[[], Prepared], repeat: int) -> dict[str, float]:
+    """Microseconds per operation, best and median of `repeat` fresh runs."""
+    per_op = []
+    for n in range(repeat):
+        random.seed(n)
+        run, operations = scenario()
+        started_at = time.perf_counter()
+        run()
+        per_op.append((time.perf_counter() - started_at) / operations * 1e6)
+    return {
+        "best_us": round(min(per_op), 3),
+        "median_us": round(statistics.median(per_op), 3),
+    }
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _previous_results(history: Path) -> dict[str, dict[str, float]]:
+    """Latest recorded results of every scenario, runs may cover only some."""
+    results: dict[str, dict[str, float]] = {}
+    if history.exists():
+        for line in history.read_text().splitlines():
+            results.update(json.loads(line)["results"])
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenario", action="append", choices=SCENARIOS, help="default: all"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--history", type=Path, default=HISTORY)
+    parser.add_argument(
+        "--no-save", action="store_true", help="don't append this run to --history"
+    )
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=None,
+        help="exit with 1 if a median got slower than the previous run by more "
+        "than this fraction, e.g. 0.2",
+    )
+    args = parser.parse_args()
+
+    previous_results = _previous_results(args.history)
+    results = {}
+    regressed = []
+    print(f"{'scenario':<22}{'best [us/op]':>16}{'median [us/op]':>16}{'change':>10}")
+    for name in args.scenario or SCENARIOS:
+        results[name] = measure(SCENARIOS[name], args.repeat)
+        change = ""
+        before = previous_results.get(name, {}).get("median_us")
+        if before:
+            relative = results[name]["median_us"] / before - 1
+            change = f"{relative:+.0%}"
+            if args.max_regression is not None and relative > args.max_regression:
+                regressed.append(name)
+        print(
+            f"{name:<22}{results[name]['best_us']:>16}"
+            f"{results[name]['median_us']:>16}{change:>10}"
+        )
+
+    if not args.no_save:
+        args.history.parent.mkdir(parents=True, exist_ok=True)
+        with args.history.open("a") as file:
+            entry = {
+                "commit": _commit(),
+                "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "repeat": args.repeat,
+                "results": results,
+            }
+            file.write(json.dumps(entry) + "\n")
+
+    if regressed:
+        print(f"Regressed: {', '.join(regressed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
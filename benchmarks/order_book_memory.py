@@ -0,0 +1,43 @@
+"""Measures memory taken by resting orders.
+
+Run with:
+    python benchmarks/order_book_memory.py [number of orders]
+"""
+import gc
+import random
+import sys
+import tracemalloc
+
+from mbex.trading.book import OrderBook, Side
+from mbex.trading.markets import Market
+
+USERS = 10_000
+PRICE_LEVELS = 1_000
+
+
+def main(orders: int) -> None:
+    random.seed(0)
+    book = OrderBook(Market("ETH", "BTC"))
+    user_ids = [f"user+{n}@enforcer.pl" for n in range(USERS)]
+
+    gc.collect()
+    tracemalloc.start()
+    for _ in range(orders):
+        # a fresh string per order, like one decoded from each request's token
+        user_id = (random.choice(user_ids) + " ")[:-1]
+        side = random.choice((Side.bid, Side.ask))
+        offset = random.randrange(1, PRICE_LEVELS)
+        # bids below 100_000 ticks, asks above, so nothing matches
+        price = 100_000 - offset if side == Side.bid else 100_000 + offset
+        book.place(side, price, random.randrange(1, 1_000_000), user_id)
+    gc.collect()
+    used, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"Resting orders: {len(book)}")
+    print(f"Price levels: {len(book[Side.bid]) + len(book[Side.ask])}")
+    print(f"Memory: {used / 2**20:.1f} MiB, {used / len(book):.1f} bytes per order")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
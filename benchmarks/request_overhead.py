@@ -0,0 +1,183 @@
+"""Per-request overhead of order entry, the lean path against the pydantic one.
+
+Each scenario times the same work done both ways: the way `POST /orders` used
+to do it - an `Order` model validated by FastAPI, the user id looked up by a
+sync dependency in the threadpool and a new `Market` for every request - and
+the way it does it now. Wallets are kept in memory and orders don't cross, so
+neither Redis nor matching is timed.
+
+Run with:
+    python benchmarks/request_overhead.py [--scenario NAME ...] [--repeat 5]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Awaitable, Callable
+from unittest.mock import patch
+
+import jwt
+from fastapi import Depends, FastAPI, Header
+from fastapi.concurrency import run_in_threadpool
+
+from mbex import auth, trading, wallets
+from mbex.api.auth import current_user_id
+from mbex.api.responses import JSONResponse
+from mbex.api.trading import Order, _parse_order, trading_router, unknown_market
+from mbex.trading.markets import Market, market_from_str
+from mbex.wallets.ledger import MemoryLedger
+from mbex.wallets.storage import MemoryStorage
+
+MARKET = "ETH-BTC"
+USER_ID = "user@enforcer.pl"
+TOKEN = jwt.encode({"user_id": USER_ID}, auth.JWT_TOKEN_SECRET, algorithm="HS256")
+BODY = json.dumps({"volume": "0.01", "price": "0.5", "side": "bid"}).encode()
+
+# (the old way, the lean way) of one operation, and how many to time
+Pair = tuple[Callable[[], Awaitable[object]], Callable[[], Awaitable[object]]]
+Scenario = tuple[Pair, int]
+
+
+def market() -> Scenario:
+    """Market of the path parameter."""
+
+    async def old() -> object:
+        base, quote = MARKET.split("-")
+        return Market(base, quote)
+
+    async def lean() -> object:
+        return market_from_str(MARKET)
+
+    return (old, lean), 100_000
+
+
+def order_body() -> Scenario:
+    """Order from the JSON body."""
+
+    async def old() -> object:
+        return Order.parse_obj(json.loads(BODY))
+
+    async def lean() -> object:
+        return _parse_order(BODY)
+
+    return (old, lean), 100_000
+
+
+def user_id() -> Scenario:
+    """User id of a token already seen."""
+
+    async def old() -> object:
+        return await run_in_threadpool(auth.get_user_id_from_token, TOKEN)
+
+    async def lean() -> object:
+        return await current_user_id(TOKEN)
+
+    return (old, lean), 10_000
+
+
+def place_order_request() -> Scenario:
+    """Whole `POST /trading/ETH-BTC/orders` requests, straight to the ASGI app."""
+    lean_app = FastAPI()
+    lean_app.include_router(trading_router, prefix="/trading")
+    lean_app.add_exception_handler(trading.UnknownMarket, unknown_market)
+    return (_post(_old_app()), _post(lean_app)), 2_000
+
+
+def _post(app: FastAPI) -> Callable[[], Awaitable[object]]:
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": f"/trading/{MARKET}/orders",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [
+            (b"authorization", TOKEN.encode()),
+            (b"content-type", b"application/json"),
+        ],
+        "server": ("mbex", 80),
+        "client": ("benchmark", 1),
+    }
+
+    async def receive() -> dict:
+        return {"type": "http.request", "body": BODY, "more_body": False}
+
+    async def send(message: dict) -> None:
+        if message["type"] == "http.response.start":
+            assert message["status"] == 202, message
+
+    async def request() -> object:
+        return await app(dict(scope), receive, send)
+
+    return request
+
+
+def _old_app() -> FastAPI:
+    app = FastAPI()
+
+    def old_current_user_id(authorization: str = Header(None)) -> auth.UserId:
+        return auth.get_user_id_from_token(authorization)
+
+    @app.post("/trading/{market}/orders")
+    async def place_order(
+        order: Order, market: str, user_id: auth.UserId = Depends(old_current_user_id)
+    ) -> JSONResponse:
+        base, quote = market.split("-")
+        market = Market(base, quote)
+        order_id = await trading.place_order(
+            market=market,
+            price=market.to_ticks(order.price),
+            volume=market.to_lots(order.volume),
+            side=order.side,
+            user_id=user_id,
+            tasks=None,
+        )
+        return JSONResponse({"order_id": str(order_id)}, status_code=202)
+
+    return app
+
+
+SCENARIOS: dict[str, Callable[[], Scenario]] = {
+    "market": market,
+    "order_body": order_body,
+    "user_id": user_id,
+    "place_order_request": place_order_request,
+}
+
+
+async def measure(scenario: Callable[[], Scenario], repeat: int) -> list[float]:
+    """Median microseconds per operation of the old and the lean way."""
+    timings: list[list[float]] = [[], []]
+    storage = MemoryStorage()
+    await storage.credit(USER_ID, "BTC", 10**18)
+    for _ in range(repeat):
+        pair, operations = scenario()
+        for way, operation in enumerate(pair):
+            with patch.object(wallets, "ledger", new=MemoryLedger(storage)):
+                started_at = time.perf_counter()
+                for _ in range(operations):
+                    await operation()
+                timings[way].append((time.perf_counter() - started_at) / operations)
+            # holds of the orders go away with the book
+            trading.clear()
+    return [round(statistics.median(way) * 1e6, 3) for way in timings]
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenario", action="append", choices=SCENARIOS, help="default: all"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'scenario':<22}{'old [us/op]':>14}{'lean [us/op]':>14}{'change':>10}")
+    for name in args.scenario or SCENARIOS:
+        old, lean = await measure(SCENARIOS[name], args.repeat)
+        print(f"{name:<22}{old:>14.3f}{lean:>14.3f}{lean / old - 1:>+10.0%}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,3 +1,7 @@
+"""Needs a server trading markets other than the listed ones, run it like
+
+    MBEX_OPEN_MARKETS=1 python mbex/run_without_reload.py
+"""
 import statistics
 import time
 import uuid
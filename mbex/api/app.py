@@ -1,8 +1,11 @@
 from fastapi import FastAPI
 
+from mbex import auth, redis, trading
 from mbex.api.auth import auth_router
+from mbex.api.health import health_router
+from mbex.api.metrics import RequestMetrics, metrics_router
 from mbex.api.profiling import profiling_router
-from mbex.api.trading import trading_router
+from mbex.api.trading import engine_unavailable, trading_router, unknown_market
 from mbex.api.wallets import wallets_router
 
 
@@ -12,4 +15,16 @@ def create_app() -> FastAPI:
     app.include_router(wallets_router, prefix="/wallets")
     app.include_router(trading_router, prefix="/trading")
     app.include_router(profiling_router, prefix="/profiling")
+    app.include_router(health_router, prefix="/health")
+    app.include_router(metrics_router, prefix="/metrics")
+    app.add_exception_handler(trading.UnknownMarket, unknown_market)
+    app.add_exception_handler(trading.EngineTimeout, engine_unavailable)
+    app.add_exception_handler(trading.EngineUnavailable, engine_unavailable)
+    app.add_exception_handler(trading.EngineFailed, engine_unavailable)
+    app.add_middleware(RequestMetrics)
+    app.add_event_handler("startup", redis.startup)
+    app.add_event_handler("startup", trading.startup)
+    app.add_event_handler("shutdown", redis.shutdown)
+    app.add_event_handler("shutdown", trading.shutdown)
+    app.add_event_handler("shutdown", auth.password_hasher.shutdown)
     return app
@@ -1,8 +1,8 @@
 from fastapi import APIRouter, Header, HTTPException, Response
-from fastapi.responses import JSONResponse
 from pydantic import BaseModel, EmailStr
 
-from mbex import auth
+from mbex import auth, metrics
+from mbex.api.responses import JSONResponse
 
 auth_router = APIRouter()
 
@@ -32,7 +32,8 @@ async def login(payload: CredsPayload) -> Response:
     return JSONResponse({"token": token}, status_code=200)
 
 
-def current_user_id(authorization: str = Header(None)) -> auth.UserId:
+async def current_user_id(authorization: str = Header(None)) -> auth.UserId:
     if not authorization:
         raise HTTPException(401)
-    return auth.get_user_id_from_token(authorization)
+    with metrics.phase("auth"):
+        return auth.get_user_id_from_token(authorization)
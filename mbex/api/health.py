@@ -0,0 +1,15 @@
+from fastapi import APIRouter
+
+from mbex import redis
+from mbex.api.responses import JSONResponse
+
+health_router = APIRouter()
+
+
+@health_router.get("")
+async def health() -> JSONResponse:
+    redis_ok = await redis.is_healthy()
+    return JSONResponse(
+        {"redis": "ok" if redis_ok else "unavailable", "redis_pool": redis.stats()},
+        status_code=200 if redis_ok else 503,
+    )
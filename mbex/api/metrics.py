@@ -0,0 +1,99 @@
+import random
+from time import perf_counter
+
+from fastapi import APIRouter, Response
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from mbex import auth, config, metrics
+from mbex.api.responses import JSONResponse
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("")
+async def get_metrics() -> JSONResponse:
+    """Latencies of routes and of their phases since start or the last reset.
+
+    Also how busy the password hashing pool is right now, and how often tokens
+    were found among those already verified.
+    """
+    return JSONResponse(
+        {
+            **metrics.report(),
+            "password_hashing": auth.password_hasher.stats(),
+            "token_cache": auth.token_cache.stats(),
+        }
+    )
+
+
+@metrics_router.delete("")
+async def reset_metrics() -> Response:
+    metrics.clear()
+    return Response(status_code=204)
+
+
+class RequestMetrics:
+    """Times every HTTP request into the histogram of its route.
+
+    A plain ASGI middleware, as starlette's BaseHTTPMiddleware would run each
+    request in a task of its own.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self._app = app
+        self._sample_rate = config.SLOW_REQUEST_SAMPLE_RATE
+        self._slow_threshold = config.SLOW_REQUEST_THRESHOLD
+        # pyinstrument can't run two profilers in one thread
+        self._profiling = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self._app(scope, receive, send)
+            return
+
+        # routing fills the scope in, so the route is known only afterwards
+        with metrics.timed_request(route=lambda: _route(scope)):
+            if (
+                self._sample_rate
+                and not self._profiling
+                and random.random() < self._sample_rate
+            ):
+                await self._profiled(scope, receive, send)
+            else:
+                await self._app(scope, receive, send)
+
+    async def _profiled(self, scope: Scope, receive: Receive, send: Send) -> None:
+        from pyinstrument import Profiler
+
+        self._profiling = True
+        profiler = Profiler(interval=0.001, async_mode="enabled")
+        start = perf_counter()
+        profiler.start()
+        try:
+            await self._app(scope, receive, send)
+        finally:
+            profiler.stop()
+            self._profiling = False
+            duration = perf_counter() - start
+            if duration >= self._slow_threshold:
+                metrics.slow_requests.append(
+                    {
+                        "route": _route(scope),
+                        "path": scope["path"],
+                        "duration_ms": round(duration * 1000, 3),
+                        "profile": profiler.output_text(unicode=True, color=False),
+                    }
+                )
+
+
+def _route(scope: Scope) -> str:
+    """Method and path template of the route, e.g. "DELETE /orders/{order_id}"."""
+    if "endpoint" not in scope:
+        return f"{scope['method']} unmatched"
+
+    names = {str(value): name for name, value in scope["path_params"].items()}
+    template = "/".join(
+        f"{{{names[segment]}}}" if segment in names else segment
+        for segment in scope["path"].split("/")
+    )
+    return f"{scope['method']} {template}"
@@ -1,24 +1,189 @@
+"""Profiles of a running API process, returned as files to open elsewhere.
+
+yappi sees every function in all threads, coroutines included, timed with wall
+or CPU clock - `pstats` opens with snakeviz or `python -m pstats`, `callgrind`
+with KCachegrind. pyinstrument samples the stack instead, so it's cheaper on a
+loaded process, and its `speedscope` output is a flame graph for speedscope.app.
+
+Each process profiles only itself, the file name says which one that was.
+"""
+import asyncio
+import os
+import tempfile
+import time
+from enum import Enum
+from io import StringIO
+
 import yappi
-from fastapi import APIRouter
+from fastapi import APIRouter, Query, Response
+
+from mbex import metrics
+from mbex.api.responses import JSONResponse
 
 profiling_router = APIRouter()
 
+MAX_CAPTURE_SECONDS = 300
+
+
+class Profiler(str, Enum):
+    yappi = "yappi"
+    pyinstrument = "pyinstrument"
+
+
+class Clock(str, Enum):
+    wall = "wall"
+    cpu = "cpu"
+
+
+class Format(str, Enum):
+    pstats = "pstats"
+    callgrind = "callgrind"
+    speedscope = "speedscope"
+    html = "html"
+    text = "text"
+
+
+YAPPI_FORMATS = {Format.pstats, Format.callgrind, Format.text}
+PYINSTRUMENT_FORMATS = {Format.speedscope, Format.html, Format.text}
+MEDIA_TYPES = {
+    Format.pstats: "application/octet-stream",
+    Format.callgrind: "text/plain",
+    Format.speedscope: "application/json",
+    Format.html: "text/html",
+    Format.text: "text/plain",
+}
+
 
 @profiling_router.post("/enable")
-def enable():
-    yappi.set_clock_type("WALL")
-    yappi.start()
+def enable(clock: Clock = Clock.wall) -> Response:
+    """Starts yappi until `/disable`."""
+    if yappi.is_running():
+        return _conflict("yappi is already running")
+    _start_yappi(clock)
+    return Response(status_code=204)
 
 
 @profiling_router.post("/disable")
-def disable():
+def disable(format: Format = Format.pstats) -> Response:
+    """Stops yappi and returns what it collected since `/enable`."""
+    if format not in YAPPI_FORMATS:
+        return _unsupported(Profiler.yappi, format)
+    if not yappi.is_running():
+        return _conflict("yappi isn't running")
     yappi.stop()
-    yappi.get_func_stats().print_all(
-        columns={
-            0: ("name", 180),
-            1: ("ncall", 5),
-            2: ("tsub", 8),
-            3: ("ttot", 8),
-            4: ("tavg", 8),
-        }
+    return _profile_file(_yappi_output(format), format)
+
+
+@profiling_router.post("/capture")
+async def capture(
+    seconds: float = Query(..., gt=0, le=MAX_CAPTURE_SECONDS),
+    profiler: Profiler = Profiler.pyinstrument,
+    format: Format = Format.speedscope,
+    clock: Clock = Clock.wall,
+) -> Response:
+    """Profiles the whole process for `seconds`, whatever requests it handles."""
+    if profiler == Profiler.yappi:
+        if format not in YAPPI_FORMATS:
+            return _unsupported(profiler, format)
+        if yappi.is_running():
+            return _conflict("yappi is already running")
+        _start_yappi(clock)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            yappi.stop()
+        return _profile_file(_yappi_output(format), format)
+
+    if format not in PYINSTRUMENT_FORMATS:
+        return _unsupported(profiler, format)
+    if clock != Clock.wall:
+        return JSONResponse(
+            {"errors": ["pyinstrument measures wall clock time only"]},
+            status_code=400,
+        )
+    from pyinstrument import Profiler as Sampler
+    from pyinstrument.renderers import SpeedscopeRenderer
+
+    # not tied to the context of this request, sees all tasks of the loop
+    sampler = Sampler(interval=0.001, async_mode="disabled")
+    try:
+        sampler.start()
+    except RuntimeError as exc:
+        # e.g. a slow request is being profiled right now
+        return _conflict(str(exc))
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        sampler.stop()
+
+    if format == Format.speedscope:
+        output = sampler.output(SpeedscopeRenderer())
+    elif format == Format.html:
+        output = sampler.output_html()
+    else:
+        output = sampler.output_text(unicode=True, color=False)
+    return _profile_file(output.encode(), format)
+
+
+@profiling_router.get("/slow")
+async def slow_requests() -> JSONResponse:
+    """Profiles of sampled requests slower than MBEX_SLOW_REQUEST_THRESHOLD."""
+    return JSONResponse(list(metrics.slow_requests))
+
+
+def _start_yappi(clock: Clock) -> None:
+    yappi.clear_stats()
+    yappi.set_clock_type(clock.value)
+    yappi.start()
+
+
+def _yappi_output(format: Format) -> bytes:
+    stats = yappi.get_func_stats()
+    if format == Format.text:
+        output = StringIO()
+        stats.print_all(
+            out=output,
+            columns={
+                0: ("name", 180),
+                1: ("ncall", 5),
+                2: ("tsub", 8),
+                3: ("ttot", 8),
+                4: ("tavg", 8),
+            },
+        )
+        return output.getvalue().encode()
+
+    # yappi writes those formats only to files
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "profile")
+        stats.save(path, type="pstat" if format == Format.pstats else "callgrind")
+        with open(path, "rb") as file:
+            return file.read()
+
+
+def _profile_file(content: bytes, format: Format) -> Response:
+    stem = f"mbex-{os.getpid()}-{int(time.time())}"
+    name = {
+        Format.pstats: f"{stem}.pstats",
+        # the name KCachegrind looks for
+        Format.callgrind: f"callgrind.out.{stem}",
+        Format.speedscope: f"{stem}.speedscope.json",
+        Format.html: f"{stem}.html",
+        Format.text: f"{stem}.txt",
+    }[format]
+    return Response(
+        content,
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{name}"'},
+    )
+
+
+def _unsupported(profiler: Profiler, format: Format) -> JSONResponse:
+    return JSONResponse(
+        {"errors": [f"{profiler.value} can't output {format.value}"]},
+        status_code=400,
     )
+
+
+def _conflict(error: str) -> JSONResponse:
+    return JSONResponse({"errors": [error]}, status_code=409)
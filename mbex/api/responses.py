@@ -0,0 +1,22 @@
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse as StarletteJSONResponse
+
+
+class JSONResponse(StarletteJSONResponse):
+    """Serialised by orjson, several times faster than json of the stdlib.
+
+    Decimals are written as strings in plain notation, e.g. "0.00000100",
+    which is how amounts are sent to clients anyway.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default)
+
+
+def _default(value: Any) -> str:
+    if isinstance(value, Decimal):
+        return f"{value:f}"
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
@@ -1,17 +1,21 @@
-import os
-import time
+import asyncio
 from decimal import Decimal
 
-from fastapi import APIRouter, Depends, Response
+import orjson
+from fastapi import APIRouter, Depends, Query, Request, Response, WebSocket
 from fastapi.background import BackgroundTasks
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError, conlist
+from pydantic.error_wrappers import ErrorWrapper
 
-from mbex import auth, trading
+from mbex import auth, config, trading, wallets
 from mbex.api.auth import current_user_id
+from mbex.api.responses import JSONResponse
 
 trading_router = APIRouter()
 
+NOT_ENOUGH_FUNDS = "Not enough funds"
+
 
 class Order(BaseModel):
     volume: Decimal
@@ -19,6 +23,17 @@ class Order(BaseModel):
     side: trading.Side
 
 
+class OrderBatch(BaseModel):
+    orders: conlist(Order, min_items=1, max_items=config.BATCH_MAX_ORDERS)
+
+
+class OrderIdBatch(BaseModel):
+    order_ids: conlist(str, min_items=1, max_items=config.BATCH_MAX_ORDERS)
+
+
+_SIDES = {side.value: side for side in trading.Side}
+
+
 @trading_router.delete("/{market}/orders/{order_id}")
 async def cancel_order(
     market: str,
@@ -31,56 +46,223 @@ async def cancel_order(
         await trading.cancel_order(
             market=market,
             user_id=user_id,
-            order_id=order_id,
+            order_id=int(order_id),
             tasks=tasks,
         )
-    except trading.NoSuchOrder:
+    except (ValueError, trading.NoSuchOrder):
         return Response(status_code=404)
 
     return Response(status_code=202, background=tasks)
 
 
-@trading_router.post("/{market}/orders")
+@trading_router.post(
+    "/{market}/orders",
+    # the body is parsed by the handler, see `_parse_order`
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "application/json": {"schema": {"$ref": "#/components/schemas/Order"}}
+            },
+            "required": True,
+        }
+    },
+)
 async def place_order(
-    order: Order,
+    request: Request,
     market: str,
     user_id: auth.UserId = Depends(current_user_id),
 ) -> Response:
     market = _market_from_str(market)
-    order_id = f"{user_id}-{time.time()}-{os.getpid()}"
+    order = _parse_order(await request.body())
+    try:
+        price = market.to_ticks(order.price)
+        volume = market.to_lots(order.volume)
+    except trading.InvalidOrder as exc:
+        return JSONResponse({"errors": [str(exc)]}, status_code=400)
+
     tasks = BackgroundTasks()
-    await trading.place_order(
-        market=market,
-        price=order.price,
-        volume=order.volume,
-        side=order.side,
-        user_id=user_id,
-        order_id=order_id,
-        tasks=tasks,
+    try:
+        order_id = await trading.place_order(
+            market=market,
+            price=price,
+            volume=volume,
+            side=order.side,
+            user_id=user_id,
+            tasks=tasks,
+        )
+    except wallets.NotEnough:
+        return JSONResponse({"errors": [NOT_ENOUGH_FUNDS]}, status_code=400)
+
+    # ids are ints, but clients keep treating them as opaque strings
+    return JSONResponse({"order_id": str(order_id)}, status_code=202, background=tasks)
+
+
+@trading_router.post("/{market}/orders/batch")
+async def place_orders(
+    batch: OrderBatch,
+    market: str,
+    user_id: auth.UserId = Depends(current_user_id),
+) -> Response:
+    """Places all orders or none of them."""
+    market = _market_from_str(market)
+    orders = []
+    errors = []
+    for n, order in enumerate(batch.orders):
+        try:
+            orders.append(
+                (order.side, market.to_ticks(order.price), market.to_lots(order.volume))
+            )
+        except trading.InvalidOrder as exc:
+            errors.append(f"orders[{n}]: {exc}")
+    if errors:
+        return JSONResponse({"errors": errors}, status_code=400)
+
+    tasks = BackgroundTasks()
+    try:
+        order_ids = await trading.place_orders(
+            market=market, orders=orders, user_id=user_id, tasks=tasks
+        )
+    except wallets.NotEnough:
+        return JSONResponse({"errors": [NOT_ENOUGH_FUNDS]}, status_code=400)
+
+    return JSONResponse(
+        {"order_ids": [str(order_id) for order_id in order_ids]},
+        status_code=202,
+        background=tasks,
     )
 
-    return JSONResponse({"order_id": order_id}, status_code=202, background=tasks)
 
+@trading_router.post("/{market}/orders/batch/cancel")
+async def cancel_orders(
+    batch: OrderIdBatch,
+    market: str,
+    user_id: auth.UserId = Depends(current_user_id),
+) -> Response:
+    """Cancels those of the orders that can be cancelled, lists them."""
+    market = _market_from_str(market)
+    # unknown ids, malformed ones included, are just not cancelled
+    order_ids = [int(order_id) for order_id in batch.order_ids if order_id.isdecimal()]
 
-@trading_router.get("/{market}/order_book")
-async def order_book(market: str) -> JSONResponse:
-    asks_volume_by_price, bids_volume_by_price = trading.order_book(
-        _market_from_str(market)
+    tasks = BackgroundTasks()
+    cancelled = await trading.cancel_orders(
+        market=market, user_id=user_id, order_ids=order_ids, tasks=tasks
     )
 
     return JSONResponse(
-        {
-            "asks": [
-                {"price": str(price), "volume": str(volume)}
-                for price, volume in asks_volume_by_price.items()
-            ],
-            "bids": [
-                {"price": str(price), "volume": str(volume)}
-                for price, volume in bids_volume_by_price.items()
-            ],
-        }
+        {"cancelled": [str(order_id) for order_id in cancelled]},
+        status_code=202,
+        background=tasks,
     )
 
 
+@trading_router.delete("/{market}/orders")
+async def cancel_all_orders(
+    market: str,
+    user_id: auth.UserId = Depends(current_user_id),
+) -> Response:
+    market = _market_from_str(market)
+    tasks = BackgroundTasks()
+    cancelled = await trading.cancel_all_orders(
+        market=market, user_id=user_id, tasks=tasks
+    )
+
+    return JSONResponse(
+        {"cancelled": [str(order_id) for order_id in cancelled]},
+        status_code=202,
+        background=tasks,
+    )
+
+
+@trading_router.get("/{market}/order_book")
+async def order_book(market: str, depth: int | None = Query(None, ge=1)) -> Response:
+    snapshot = await trading.order_book(_market_from_str(market), depth=depth)
+    return Response(snapshot, media_type="application/json")
+
+
+@trading_router.websocket("/{market}/stream")
+async def stream(websocket: WebSocket, market: str) -> None:
+    try:
+        market = _market_from_str(market)
+    except trading.UnknownMarket:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    messages = trading.market_data(market)
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(websocket))
+    next_message: asyncio.Future | None = None
+    try:
+        while True:
+            next_message = asyncio.ensure_future(messages.__anext__())
+            await asyncio.wait(
+                {next_message, disconnected}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if disconnected.done():
+                return
+            await websocket.send_text(next_message.result())
+    except trading.SubscriberTooSlow:
+        # client has to reconnect and start over from a new snapshot
+        await websocket.close(code=1013)
+    finally:
+        disconnected.cancel()
+        if next_message is not None and not next_message.done():
+            next_message.cancel()
+            # the generator can't be closed while the task is still running it
+            await asyncio.gather(next_message, return_exceptions=True)
+        await messages.aclose()
+
+
+async def _wait_for_disconnect(websocket: WebSocket) -> None:
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
+
+
 def _market_from_str(market_str) -> trading.Market:
-    return trading.Market(*market_str.split("-"))
+    """Raises UnknownMarket, which `unknown_market` turns into a 404."""
+    return trading.market_from_str(market_str)
+
+
+async def unknown_market(request: Request, exc: trading.UnknownMarket) -> Response:
+    return JSONResponse({"errors": [str(exc)]}, status_code=404)
+
+
+async def engine_unavailable(
+    request: Request,
+    exc: trading.EngineTimeout | trading.EngineUnavailable | trading.EngineFailed,
+) -> Response:
+    return JSONResponse({"errors": [str(exc)]}, status_code=503)
+
+
+def _parse_order(body: bytes) -> Order:
+    """`Order` of a request body, without pydantic for well-formed ones.
+
+    Those have prices and volumes as strings, which need no more checks than
+    Decimal does. Any other body goes through the model, so it's accepted
+    or rejected with 422 just like when FastAPI parses it.
+    """
+    try:
+        fields = orjson.loads(body)
+    except orjson.JSONDecodeError as exc:
+        raise RequestValidationError(
+            [ErrorWrapper(exc, ("body", exc.pos))], body=body
+        ) from None
+
+    try:
+        volume, price = fields["volume"], fields["price"]
+        if type(volume) is str and type(price) is str:
+            order = Order.construct(
+                volume=Decimal(volume),
+                price=Decimal(price),
+                side=_SIDES[fields["side"]],
+            )
+            if order.volume.is_finite() and order.price.is_finite():
+                return order
+    except (TypeError, KeyError, ArithmeticError):
+        pass
+
+    try:
+        return Order.parse_obj(fields)
+    except ValidationError as exc:
+        raise RequestValidationError(
+            [ErrorWrapper(exc, ("body",))], body=fields
+        ) from None
@@ -1,11 +1,11 @@
 from decimal import Decimal
 
 from fastapi import APIRouter, Depends, Response
-from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 
 from mbex import auth, wallets
 from mbex.api.auth import current_user_id
+from mbex.api.responses import JSONResponse
 
 wallets_router = APIRouter()
 
@@ -14,8 +14,8 @@ wallets_router = APIRouter()
 async def get_balance(
     currency: wallets.CurrencyCode, user_id: auth.UserId = Depends(current_user_id)
 ) -> JSONResponse:
-    balance = await wallets.balance(user_id, currency)
-    return JSONResponse({"balance": f"{balance:f}"})
+    balance = wallets.from_units(await wallets.balance(user_id, currency))
+    return JSONResponse({"balance": balance})
 
 
 class Deposit(BaseModel):
@@ -28,5 +28,10 @@ async def deposit(
     payload: Deposit,
     user_id: auth.UserId = Depends(current_user_id),
 ) -> JSONResponse:
-    await wallets.credit(user_id, currency, payload.amount)
+    try:
+        amount = wallets.to_units(payload.amount)
+    except wallets.InvalidAmount as exc:
+        return JSONResponse({"errors": [str(exc)]}, status_code=400)
+
+    await wallets.credit(user_id, currency, amount)
     return JSONResponse(status_code=202)
@@ -1,7 +1,8 @@
-import bcrypt
 import jwt
 
-from mbex import redis
+from mbex import config, redis
+from mbex.auth.hashing import PasswordHasher
+from mbex.auth.token_cache import TokenCache
 
 USERS = {}
 JWT_TOKEN_SECRET = "TestSecretYo"
@@ -10,6 +11,14 @@ REDIS_KEY = "users"
 JwtToken = str
 UserId = str
 
+password_hasher = PasswordHasher(
+    executor_kind=config.PASSWORD_HASHING_EXECUTOR,
+    workers=config.PASSWORD_HASHING_WORKERS,
+)
+token_cache: TokenCache[UserId] = TokenCache(
+    max_size=config.TOKEN_CACHE_SIZE, ttl=config.TOKEN_CACHE_TTL
+)
+
 
 async def clear():
     async with redis.conn() as c:
@@ -39,8 +48,10 @@ async def register(username: str, password: str) -> None:
         if stored_pw is not None:
             raise UsernameTaken
         else:
-            hashed_pw = bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=13))
-            await c.hset(REDIS_KEY, username, hashed_pw)
+            hashed_pw = await password_hasher.hash(password)
+            # someone could have registered the same name while hashing
+            if not await c.hsetnx(REDIS_KEY, username, hashed_pw):
+                raise UsernameTaken
 
 
 async def check_credentials(username: str, password: str) -> JwtToken:
@@ -50,7 +61,7 @@ async def check_credentials(username: str, password: str) -> JwtToken:
     if stored_pw is None:
         raise NoSuchUser
     else:
-        password_ok = bcrypt.checkpw(password.encode(), stored_pw)
+        password_ok = await password_hasher.check(password, stored_pw)
         if password_ok:
             return jwt.encode(
                 {"user_id": username}, JWT_TOKEN_SECRET, algorithm="HS256"
@@ -60,5 +71,9 @@ async def check_credentials(username: str, password: str) -> JwtToken:
 
 
 def get_user_id_from_token(token: JwtToken) -> UserId:
-    decoded = jwt.decode(token, JWT_TOKEN_SECRET, algorithms=["HS256"])
-    return decoded["user_id"]
+    user_id = token_cache.get(token)
+    if user_id is None:
+        decoded = jwt.decode(token, JWT_TOKEN_SECRET, algorithms=["HS256"])
+        user_id = decoded["user_id"]
+        token_cache.put(token, user_id, exp=decoded.get("exp"))
+    return user_id
@@ -0,0 +1,73 @@
+"""Password hashing off the event loop.
+
+bcrypt takes hundreds of milliseconds by design. It runs in a pool whose size
+caps how many hashes are computed at once; requests over the cap wait in the
+pool's queue without blocking the event loop.
+"""
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable
+
+import bcrypt
+
+BCRYPT_ROUNDS = 13
+
+
+def hash_password(password: bytes) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
+
+
+def check_password(password: bytes, hashed_password: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed_password)
+
+
+class PasswordHasher:
+    def __init__(self, executor_kind: str, workers: int) -> None:
+        if executor_kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind: {executor_kind}")
+        self._executor_kind = executor_kind
+        self._workers = workers
+        self._executor: Executor | None = None
+        self._pending = 0
+        self._completed = 0
+
+    async def hash(self, password: str) -> bytes:
+        return await self._run(hash_password, password.encode())
+
+    async def check(self, password: str, hashed_password: bytes) -> bool:
+        return await self._run(check_password, password.encode(), hashed_password)
+
+    def stats(self) -> dict[str, int]:
+        in_progress = min(self._pending, self._workers)
+        return {
+            "workers": self._workers,
+            "in_progress": in_progress,
+            "queued": self._pending - in_progress,
+            "completed": self._completed,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        self._pending += 1
+        try:
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self._pending -= 1
+            self._completed += 1
+
+    def _get_executor(self) -> Executor:
+        # created lazily, so importing the module doesn't spawn processes
+        if self._executor is None:
+            if self._executor_kind == "thread":
+                # bcrypt releases the GIL, so threads hash in parallel just fine
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._workers, thread_name_prefix="bcrypt"
+                )
+            else:
+                self._executor = ProcessPoolExecutor(max_workers=self._workers)
+        return self._executor
@@ -0,0 +1,53 @@
+import time
+from collections import OrderedDict
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class TokenCache(Generic[T]):
+    """LRU of already verified tokens, each entry valid for at most `ttl` seconds.
+
+    Entries never outlive the `exp` claim of their token.
+    """
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries: OrderedDict[str, tuple[T, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> T | None:
+        try:
+            value, expires_at = self._entries[token]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        if expires_at <= time.time():
+            del self._entries[token]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return value
+
+    def put(self, token: str, value: T, exp: float | None = None) -> None:
+        if self._max_size <= 0:
+            return
+
+        expires_at = time.time() + self._ttl
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        self._entries[token] = value, expires_at
+        self._entries.move_to_end(token)
+        if len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,79 @@
+"""Runtime settings, read once from MBEX_* environment variables."""
+import os
+from decimal import Decimal
+
+# JSON like {"ETH-BTC": {"tick_size": "0.00001", "lot_size": "0.001"}} of markets
+# traded, sizes left out are the defaults
+MARKETS = os.environ.get("MBEX_MARKETS", '{"ETH-BTC": {}}')
+DEFAULT_TICK_SIZE = Decimal(os.environ.get("MBEX_DEFAULT_TICK_SIZE", "0.0001"))
+DEFAULT_LOT_SIZE = Decimal(os.environ.get("MBEX_DEFAULT_LOT_SIZE", "0.0001"))
+# "1" makes any other BASE-QUOTE pair a market too, with default sizes
+OPEN_MARKETS = os.environ.get("MBEX_OPEN_MARKETS", "0") == "1"
+
+# "local" matches orders inside the API process' event loop,
+# "zmq" keeps every market's book in a dedicated engine process,
+# "sharded" in one of ENGINE_SHARDS processes shared by all API workers
+ENGINE_MODE = os.environ.get("MBEX_ENGINE_MODE", "local")
+ENGINE_SHARDS = int(os.environ.get("MBEX_ENGINE_SHARDS", "2"))
+# uvicorn worker processes, more than one needs "sharded" engine and "storage" holds
+API_WORKERS = int(os.environ.get("MBEX_API_WORKERS", "1"))
+# commands queued per market in "local" mode, senders of more wait for room
+ENGINE_MAX_QUEUED = int(os.environ.get("MBEX_ENGINE_MAX_QUEUED", "1000"))
+# where "local" mode matches: "loop" right in the event loop, "thread" in a thread
+# of each market, leaving the loop free for other requests while a book is matched
+ENGINE_EXECUTOR = os.environ.get("MBEX_ENGINE_EXECUTOR", "loop")
+# directory for ZeroMQ ipc:// endpoints of engine processes
+ENGINE_IPC_DIR = os.environ.get("MBEX_ENGINE_IPC_DIR", "/tmp")
+# [s] a request waits for its command, then gets 503 while the command goes on and
+# its funds are settled once it's done; in "zmq" and "sharded" modes a market whose
+# engine hasn't replied for that long rejects new commands until it does
+ENGINE_REPLY_TIMEOUT = float(os.environ.get("MBEX_ENGINE_REPLY_TIMEOUT", "30"))
+# market data updates buffered per stream subscriber before it's dropped as too slow
+FEED_MAX_PENDING = int(os.environ.get("MBEX_FEED_MAX_PENDING", "1000"))
+# orders per batch request, both placed and cancelled
+BATCH_MAX_ORDERS = int(os.environ.get("MBEX_BATCH_MAX_ORDERS", "100"))
+
+# directory where order books are persisted, empty keeps them in memory only
+JOURNAL_DIR = os.environ.get("MBEX_JOURNAL_DIR", "")
+# [s] between fsyncs of the journal, 0 to fsync every command before replying
+JOURNAL_FSYNC_INTERVAL = float(os.environ.get("MBEX_JOURNAL_FSYNC_INTERVAL", "0.01"))
+# journaled commands after which a book is snapshotted and its journal emptied
+JOURNAL_SNAPSHOT_EVERY = int(os.environ.get("MBEX_JOURNAL_SNAPSHOT_EVERY", "100000"))
+
+# fraction of requests run under pyinstrument, kept when slower than the threshold
+# [s]; 0 doesn't profile at all, only one request is profiled at a time
+SLOW_REQUEST_SAMPLE_RATE = float(os.environ.get("MBEX_SLOW_REQUEST_SAMPLE_RATE", "0"))
+SLOW_REQUEST_THRESHOLD = float(os.environ.get("MBEX_SLOW_REQUEST_THRESHOLD", "0.05"))
+# profiles of slow requests kept, older ones are dropped
+SLOW_REQUEST_PROFILES_KEPT = int(
+    os.environ.get("MBEX_SLOW_REQUEST_PROFILES_KEPT", "20")
+)
+
+# "thread" or "process" pool computing bcrypt hashes, and its size
+PASSWORD_HASHING_EXECUTOR = os.environ.get("MBEX_PASSWORD_HASHING_EXECUTOR", "thread")
+PASSWORD_HASHING_WORKERS = int(os.environ.get("MBEX_PASSWORD_HASHING_WORKERS", "4"))
+
+# how many verified JWT tokens to remember and for how long [s]
+TOKEN_CACHE_SIZE = int(os.environ.get("MBEX_TOKEN_CACHE_SIZE", "100000"))
+TOKEN_CACHE_TTL = float(os.environ.get("MBEX_TOKEN_CACHE_TTL", "300"))
+
+# "redis" keeps balances in Redis, "memory" in the API process - only for a single
+# worker, e.g. benchmarks, as balances are lost on restart
+WALLETS_STORAGE = os.environ.get("MBEX_WALLETS_STORAGE", "redis")
+
+# "memory" holds funds of resting orders in the API process, writing balances only
+# on deposits and trades; "storage" debits them in storage - one more write per place
+# and per cancel, but required with more than one API worker
+WALLETS_HOLDS = os.environ.get("MBEX_WALLETS_HOLDS", "memory")
+
+REDIS_URL = os.environ.get("MBEX_REDIS_URL", "redis://localhost")
+# per API process, so multiply by the number of workers to get Redis' side
+REDIS_MAX_CONNECTIONS = int(os.environ.get("MBEX_REDIS_MAX_CONNECTIONS", "32"))
+# [s] to wait for a free connection from the pool
+REDIS_POOL_TIMEOUT = float(os.environ.get("MBEX_REDIS_POOL_TIMEOUT", "5"))
+# [s] for connecting and for a single command
+REDIS_SOCKET_TIMEOUT = float(os.environ.get("MBEX_REDIS_SOCKET_TIMEOUT", "5"))
+# [s] of idleness after which a connection is pinged before use
+REDIS_HEALTH_CHECK_INTERVAL = int(
+    os.environ.get("MBEX_REDIS_HEALTH_CHECK_INTERVAL", "30")
+)
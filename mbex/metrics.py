@@ -0,0 +1,171 @@
+"""Latency histograms of requests and of their phases, kept in the API process.
+
+Every request is timed as a whole and by phases - auth (tokens), wallets
+(balances and their storage) and matching (waiting for the engine) - of which
+`phase` measures the time spent inside. What's left of the request is
+reported as "other", e.g. parsing and serialization.
+
+Histograms have log-linear buckets, like HdrHistogram: values below
+2 * SUB_BUCKETS are exact, larger ones fall into SUB_BUCKETS buckets per power
+of two, so percentiles are off by at most 1 / SUB_BUCKETS while recording costs
+a couple of integer operations, whatever the value.
+"""
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter_ns
+from typing import Callable, Iterator
+
+from mbex import config
+
+SUB_BUCKETS = 16
+# bit length of the smallest value that doesn't get its own bucket
+_EXACT_BITS = (2 * SUB_BUCKETS).bit_length()
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class Histogram:
+    def __init__(self) -> None:
+        self.clear()
+
+    def clear(self) -> None:
+        self._counts: list[int] = []
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value: int) -> None:
+        if value < 2 * SUB_BUCKETS:
+            bucket = value
+        else:
+            shift = value.bit_length() - _EXACT_BITS + 1
+            bucket = shift * SUB_BUCKETS + (value >> shift)
+        if bucket >= len(self._counts):
+            self._counts.extend([0] * (bucket + 1 - len(self._counts)))
+        self._counts[bucket] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent: float) -> int:
+        """Highest value of the bucket the percentile falls into."""
+        if not self.count:
+            return 0
+        rank = max(1, round(self.count * percent / 100))
+        seen = 0
+        for bucket, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                return min(_bucket_top(bucket), self.max)
+        return self.max
+
+    def summary(self, unit: str = "us", per_unit: int = 1000) -> dict[str, int]:
+        """Count and values in `unit`s, by default µs of recorded ns."""
+        suffix = f"_{unit}" if unit else ""
+        summary = {
+            "count": self.count,
+            f"mean{suffix}": self.total // self.count // per_unit if self.count else 0,
+        }
+        for percent in PERCENTILES:
+            summary[f"p{percent:g}{suffix}"] = self.percentile(percent) // per_unit
+        summary[f"max{suffix}"] = self.max // per_unit
+        return summary
+
+
+def _bucket_top(bucket: int) -> int:
+    if bucket < 2 * SUB_BUCKETS:
+        return bucket
+    shift, sub_bucket = divmod(bucket, SUB_BUCKETS)
+    shift -= 1
+    return ((SUB_BUCKETS + sub_bucket + 1) << shift) - 1
+
+
+# [ns] by route, e.g. "POST /trading/{market}/orders"
+requests: defaultdict[str, Histogram] = defaultdict(Histogram)
+# [ns] by route and phase
+phases: defaultdict[str, defaultdict[str, Histogram]] = defaultdict(
+    lambda: defaultdict(Histogram)
+)
+
+
+class QueueMetrics:
+    def __init__(self) -> None:
+        # [ns] from queueing a command until it starts
+        self.wait = Histogram()
+        # commands already queued, seen by each new one
+        self.depth = Histogram()
+
+
+# by market
+engine_queues: defaultdict[str, QueueMetrics] = defaultdict(QueueMetrics)
+# pyinstrument reports of sampled requests that took too long, newest last
+slow_requests: deque[dict] = deque(maxlen=config.SLOW_REQUEST_PROFILES_KEPT)
+
+# [ns] spent in each phase by the request being handled, if any
+_request_phases: ContextVar[dict[str, int] | None] = ContextVar(
+    "request_phases", default=None
+)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Adds the time spent inside to the `name` phase of the current request."""
+    start = perf_counter_ns()
+    try:
+        yield
+    finally:
+        timings = _request_phases.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0) + perf_counter_ns() - start
+
+
+@contextmanager
+def timed_request(route: Callable[[], str]) -> Iterator[None]:
+    """Times the request and its phases, `route` is asked for only at the end."""
+    start = perf_counter_ns()
+    timings: dict[str, int] = {}
+    token = _request_phases.set(timings)
+    try:
+        yield
+    finally:
+        _request_phases.reset(token)
+        duration = perf_counter_ns() - start
+        name = route()
+        requests[name].record(duration)
+        route_phases = phases[name]
+        for phase_name, spent in timings.items():
+            route_phases[phase_name].record(spent)
+        route_phases["other"].record(max(0, duration - sum(timings.values())))
+
+
+def report() -> dict[str, dict]:
+    return {
+        "requests": {
+            route: {
+                **histogram.summary(),
+                "phases": {
+                    name: phase_histogram.summary()
+                    for name, phase_histogram in sorted(phases[route].items())
+                },
+            }
+            for route, histogram in sorted(requests.items())
+        },
+        "engine_queues": {
+            market: {
+                "wait": queue.wait.summary(),
+                "depth": queue.depth.summary(unit="", per_unit=1),
+            }
+            for market, queue in sorted(engine_queues.items())
+        },
+    }
+
+
+def clear() -> None:
+    requests.clear()
+    phases.clear()
+    # not dropped, actors keep recording into theirs
+    for queue in engine_queues.values():
+        queue.wait.clear()
+        queue.depth.clear()
+    slow_requests.clear()
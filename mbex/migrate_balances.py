@@ -0,0 +1,81 @@
+"""Converts balances kept in Redis by older versions to wallet units, once.
+
+Those saved them as decimal strings of whole coins, e.g. "1.5", which INCRBY and
+DECRBY can't change and `RedisStorage` would read as units. A balance like "2"
+is no different from 2 units, so every balance is converted and the run is
+remembered - run it once, with the API stopped:
+
+    python mbex/migrate_balances.py
+"""
+import asyncio
+from decimal import Decimal
+
+from mbex import redis
+from mbex.wallets import DECIMAL_PLACES
+from mbex.wallets.storage import REDIS_KEY_TPL
+
+# set when all balances are in units, makes further runs do nothing
+DONE_KEY = "wallets_units_migrated"
+# balances converted so far, so an interrupted run doesn't convert them again
+CONVERTED_KEY = "wallets_units_converted"
+
+# Sets the balance in units, unless it was converted already. Returns 1 when
+# converted, 0 when it was before and -1 if the balance changed since read.
+CONVERT_SCRIPT = """
+if redis.call('SISMEMBER', KEYS[2], KEYS[1]) == 1 then
+    return 0
+end
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return -1
+end
+redis.call('SET', KEYS[1], ARGV[2])
+redis.call('SADD', KEYS[2], KEYS[1])
+return 1
+"""
+
+
+class BalanceChanged(Exception):
+    pass
+
+
+async def migrate() -> int:
+    """Converts all balances, returns how many, 0 if they were converted before."""
+    converted = 0
+    async with redis.conn() as conn:
+        if await conn.exists(DONE_KEY):
+            return 0
+
+        convert_script = conn.register_script(CONVERT_SCRIPT)
+        pattern = REDIS_KEY_TPL.format(user_id="*", currency_code="*")
+        async for key in conn.scan_iter(match=pattern):
+            if key.endswith(b"_LOCK"):
+                # taken by older versions while changing a balance
+                continue
+            raw = await conn.get(key)
+            if raw is None:
+                continue
+            result = await convert_script(
+                keys=[key, CONVERTED_KEY], args=[raw, _to_units(key, raw)]
+            )
+            if result == -1:
+                raise BalanceChanged(f"{key.decode()} changed, stop the API first")
+            converted += result
+
+        async with conn.pipeline(transaction=True) as pipe:
+            pipe.set(DONE_KEY, 1)
+            pipe.delete(CONVERTED_KEY)
+            await pipe.execute()
+    return converted
+
+
+def _to_units(key: bytes, raw: bytes) -> int:
+    units = Decimal(raw.decode()).scaleb(DECIMAL_PLACES)
+    if units != units.to_integral_value():
+        raise ValueError(
+            f"{key.decode()} balance {raw.decode()} is more precise than a unit"
+        )
+    return int(units)
+
+
+if __name__ == "__main__":
+    print(f"Converted {asyncio.run(migrate())} balances")
@@ -1,27 +1,77 @@
-import sys
+"""Redis connection pool shared by the whole API process.
+
+The pool is created in `startup` and closed in `shutdown`, both hooked into
+the application lifecycle. Code running without them (e.g. tests using
+TestClient without a `with` block, scripts) gets a one-off client per `conn()`.
+"""
 from contextlib import asynccontextmanager
-from typing import Iterator
+from typing import AsyncIterator
 
 import aioredis
-from aioredis import Redis
+from aioredis import BlockingConnectionPool, Redis
+
+from mbex import config
+
+_client: Redis | None = None
+
+
+def _create_pool() -> BlockingConnectionPool:
+    return BlockingConnectionPool.from_url(
+        config.REDIS_URL,
+        max_connections=config.REDIS_MAX_CONNECTIONS,
+        # how long to wait for a free connection when all are in use
+        timeout=config.REDIS_POOL_TIMEOUT,
+        socket_timeout=config.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=config.REDIS_SOCKET_TIMEOUT,
+        health_check_interval=config.REDIS_HEALTH_CHECK_INTERVAL,
+    )
 
-if "pytest" in sys.modules:
 
-    @asynccontextmanager
-    async def conn() -> Iterator[Redis]:
-        client = aioredis.from_url("redis://localhost")
-        async with client.client() as connection:
-            yield connection
+async def startup() -> None:
+    global _client
+    _client = Redis(connection_pool=_create_pool())
+    # fail fast if Redis is unreachable
+    await _client.ping()
 
+
+async def shutdown() -> None:
+    global _client
+    if _client is not None:
+        await _client.close()
+        await _client.connection_pool.disconnect()
+        _client = None
+
+
+@asynccontextmanager
+async def conn() -> AsyncIterator[Redis]:
+    if _client is not None:
+        yield _client
+        return
+
+    client = aioredis.from_url(config.REDIS_URL)
+    try:
+        yield client
+    finally:
         await client.close()
         await client.connection_pool.disconnect()
 
 
-else:
-    client = aioredis.from_url("redis://localhost")
+async def is_healthy() -> bool:
+    try:
+        async with conn() as c:
+            return await c.ping()
+    except aioredis.RedisError:
+        return False
+
 
-    @asynccontextmanager
-    async def conn() -> Iterator[Redis]:
+def stats() -> dict[str, int]:
+    if _client is None:
+        return {}
 
-        async with client.client() as connection:
-            yield connection
+    pool: BlockingConnectionPool = _client.connection_pool
+    idle_or_not_created = pool.pool.qsize()
+    return {
+        "max_connections": pool.max_connections,
+        "created": len(pool._connections),
+        "in_use": pool.max_connections - idle_or_not_created,
+    }
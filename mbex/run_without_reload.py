@@ -1,7 +1,37 @@
 import uvicorn
 
+from mbex import config, trading
 from mbex.main import initialize
+from mbex.trading import shards
+
+
+def _check_workers() -> None:
+    if config.API_WORKERS == 1:
+        return
+    if config.ENGINE_MODE != "sharded":
+        raise SystemExit("More API workers need MBEX_ENGINE_MODE=sharded")
+    if config.WALLETS_STORAGE != "redis" or config.WALLETS_HOLDS != "storage":
+        raise SystemExit(
+            "More API workers need MBEX_WALLETS_STORAGE=redis "
+            "and MBEX_WALLETS_HOLDS=storage"
+        )
+
 
 if __name__ == "__main__":
+    _check_workers()
+    if config.ENGINE_MODE == "sharded":
+        processes = shards.start(
+            config.ENGINE_IPC_DIR, config.ENGINE_SHARDS, trading.journal
+        )
     app = initialize()
-    uvicorn.run(app="mbex.main:initialize", host="127.0.0.1", port=8000, reload=False)
+    try:
+        uvicorn.run(
+            app="mbex.main:initialize",
+            host="127.0.0.1",
+            port=8000,
+            reload=False,
+            workers=config.API_WORKERS,
+        )
+    finally:
+        if config.ENGINE_MODE == "sharded":
+            shards.stop(config.ENGINE_IPC_DIR, processes)
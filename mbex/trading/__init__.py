@@ -1,212 +1,298 @@
-import abc
 import asyncio
-import time
-from collections import defaultdict, deque
-from decimal import Decimal
-from enum import Enum
-from typing import Any, Callable, Protocol, Tuple, Type
+import functools
+import logging
+from collections import defaultdict
+from typing import Any, AsyncIterator, Awaitable, Callable, ParamSpec, Protocol, TypeVar
+
+from mbex import auth, config, metrics, wallets
+from mbex.trading.book import NewOrder, Order, OrderBook, OrderId, Side, Trade
+from mbex.trading.engine import EngineUnavailable  # noqa: F401
+from mbex.trading.engine import LocalEngine  # noqa: F401
+from mbex.trading.engine import Engine, EngineFailed, EngineTimeout  # noqa: F401
+from mbex.trading.feed import SubscriberTooSlow  # noqa: F401
+from mbex.trading.feed import Feed, serialize_snapshot
+from mbex.trading.journal import JournalSettings
+from mbex.trading.markets import market_from_str  # noqa: F401
+from mbex.trading.markets import InvalidOrder, Market, UnknownMarket  # noqa: F401
+
+MARKETS: dict[Market, OrderBook] = {}
+# wallet units by user and currency
+Amounts = dict[tuple[auth.UserId, wallets.CurrencyCode], wallets.Units]
+feed = Feed(max_pending=config.FEED_MAX_PENDING)
+logger = logging.getLogger(__name__)
+
+
+journal = (
+    JournalSettings(
+        directory=config.JOURNAL_DIR,
+        fsync_interval=config.JOURNAL_FSYNC_INTERVAL,
+        snapshot_every=config.JOURNAL_SNAPSHOT_EVERY,
+    )
+    if config.JOURNAL_DIR
+    else None
+)
+
+
+def _create_engine(mode: str) -> Engine:
+    if mode == "local":
+        return LocalEngine(
+            MARKETS,
+            feed,
+            journal=journal,
+            max_queued=config.ENGINE_MAX_QUEUED,
+            executor=config.ENGINE_EXECUTOR,
+        )
+    elif mode == "zmq":
+        from mbex.trading.zmq_engine import ZmqEngine
+
+        return ZmqEngine(
+            ipc_dir=config.ENGINE_IPC_DIR,
+            feed=feed,
+            journal=journal,
+            timeout=config.ENGINE_REPLY_TIMEOUT,
+        )
+    elif mode == "sharded":
+        from mbex.trading.shards import ShardedEngine
+
+        return ShardedEngine(
+            ipc_dir=config.ENGINE_IPC_DIR,
+            shards=config.ENGINE_SHARDS,
+            feed=feed,
+            journal=journal,
+            timeout=config.ENGINE_REPLY_TIMEOUT,
+        )
+    else:
+        raise ValueError(f"Unknown engine mode: {mode}")
 
-from attr import define
 
-from mbex import auth, wallets
+engine = _create_engine(config.ENGINE_MODE)
 
 
-class Side(Enum):
-    ask = "ask"
-    bid = "bid"
+async def startup() -> None:
+    """Loads persisted books up front, not on the first request to each.
 
+    Funds of orders resting in them are held again, if holds live in memory.
+    Books of markets no longer listed are left on disk, not loaded.
+    """
+    await engine.start()
+    if journal is not None:
+        for name in journal.markets():
+            try:
+                market = market_from_str(name)
+            except UnknownMarket:
+                logger.warning("Not loading the book of %s, it isn't listed", name)
+                continue
+            await engine.open(market)
+            held: Amounts = defaultdict(int)
+            for (user_id, side), total in (await engine.resting(market)).items():
+                if side == Side.bid:
+                    held[(user_id, market.quote)] += market.quote_units(total, 1)
+                else:
+                    held[(user_id, market.base)] += market.base_units(total)
+            wallets.restore_holds(held)
 
-MARKETS = defaultdict(lambda: {Side.bid: [], Side.ask: []})
 
+async def shutdown() -> None:
+    await engine.close()
 
-@define
-class LimitOrder(abc.ABC):
-    price: Decimal
-    volume: Decimal
-    timestamp: int
-    user_id: auth.UserId
-    order_id: str
 
-    @abc.abstractmethod
-    def matches(self, other: "LimitOrder") -> bool:
-        raise NotImplementedError
+def clear() -> None:
+    engine.clear()
 
 
-class Ask(LimitOrder):
-    def matches(self, other: "LimitOrder") -> bool:
-        assert isinstance(other, Bid)
-        return self.price <= other.price
+class TasksScheduler(Protocol):
+    def add_task(self, func: Callable, *args: Any, **kwargs: Any) -> None:
+        ...
 
 
-class Bid(LimitOrder):
-    def matches(self, other: "LimitOrder") -> bool:
-        assert isinstance(other, Ask)
-        return self.price >= other.price
+P = ParamSpec("P")
+T = TypeVar("T")
 
 
-@define(frozen=True)
-class Trade:
-    price: Decimal
-    volume: Decimal
-    bid_user_id: auth.UserId
-    ask_user_id: auth.UserId
-    bid_price: Decimal
+def _completed(func: Callable[P, Awaitable[T]]) -> Callable[P, Awaitable[T]]:
+    """Runs the call to the end even if its caller is cancelled or gives up.
 
+    The engine carries on with a command whose caller has gone away, so funds
+    have to be settled or released after it no matter what, or they'd stay
+    held by orders that traded or were cancelled. A caller waits for
+    MBEX_ENGINE_REPLY_TIMEOUT at most, then gets EngineTimeout while the call
+    goes on.
+    """
 
-@define(frozen=True)
-class Market:
-    base: wallets.CurrencyCode
-    quote: wallets.CurrencyCode
+    @functools.wraps(func)
+    async def shielded(*args: P.args, **kwargs: P.kwargs) -> T:
+        call = asyncio.shield(func(*args, **kwargs))
+        try:
+            return await asyncio.wait_for(call, config.ENGINE_REPLY_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise EngineTimeout(
+                "Not done yet, funds are settled once the engine is done"
+            ) from None
 
-    def __str__(self) -> str:
-        return f"{self.base}-{self.quote}"
+    return shielded
 
 
-def clear() -> None:
-    MARKETS.clear()
+@_completed
+async def place_order(
+    market: Market,
+    price: int,
+    volume: int,
+    side: Side,
+    user_id: auth.UserId,
+    tasks: TasksScheduler,
+) -> OrderId:
+    """Places an order for `volume` lots at `price` ticks of the market."""
+    currency, value = _cost(market, side, price, volume)
+    held = {(user_id, currency): value}
+    await wallets.hold(held)
 
+    try:
+        with metrics.phase("matching"):
+            order_id, trades = await engine.place(market, side, price, volume, user_id)
+    except EngineUnavailable:
+        # the order never reached the book
+        await wallets.release(held)
+        raise
 
-class TasksScheduler(Protocol):
-    def add_task(self, func: Callable, *args: Any, **kwargs: Any) -> None:
-        ...
+    await _settle(market, trades)
+    return order_id
 
 
-async def place_order(
+@_completed
+async def place_orders(
     market: Market,
-    price: Decimal,
-    volume: Decimal,
-    side: Side,
+    orders: list[NewOrder],
     user_id: auth.UserId,
-    order_id: str,
     tasks: TasksScheduler,
-) -> None:
-    order_cls: Type[LimitOrder]
+) -> list[OrderId]:
+    """Places all orders or, if the user can't afford them all, none of them.
+
+    Costs are summed up per currency and held at once, and the book takes all
+    orders in one go.
+    """
+    costs: Amounts = defaultdict(int)
+    for side, price, volume in orders:
+        currency, value = _cost(market, side, price, volume)
+        costs[(user_id, currency)] += value
+    await wallets.hold(costs)
+
+    try:
+        with metrics.phase("matching"):
+            order_ids, trades = await engine.place_many(market, orders, user_id)
+    except EngineUnavailable:
+        # the orders never reached the book
+        await wallets.release(costs)
+        raise
+
+    await _settle(market, trades)
+    return order_ids
+
+
+def _cost(
+    market: Market, side: Side, price: int, volume: int
+) -> tuple[wallets.CurrencyCode, wallets.Units]:
+    """What an order locks: quote currency for bids, base currency for asks."""
     if side == Side.bid:
-        currency = market.quote
-        value = price * volume
-        other_side = Side.ask
-        order_cls = Bid
+        return market.quote, market.quote_units(price, volume)
     else:
-        currency = market.base
-        value = volume
-        other_side = Side.bid
-        order_cls = Ask
-
-    await wallets.debit(user_id, currency, value)
-
-    new_order = order_cls(
-        price=price,
-        timestamp=time.time(),
-        volume=volume,
-        user_id=user_id,
-        order_id=order_id,
-    )
+        return market.base, market.base_units(volume)
 
-    trades = deque([])
-    other_side_orders = MARKETS[market][other_side]
-    while (
-        len(other_side_orders) > 0
-        and new_order.matches(other_side_orders[0])
-        and new_order.volume > 0
-    ):
-        time.sleep(0.001)  # simulate it's actually CPU-intensive
-        other_order: LimitOrder = other_side_orders[0]
-        matched_vol = min(other_order.volume, new_order.volume)
-        other_order.volume -= matched_vol
-        new_order.volume -= matched_vol
-        # remove order present in order book if it was filled completely
-        if other_order.volume == 0:
-            other_side_orders.remove(other_order)
-
-        if side == side.bid:
-            bid_price = new_order.price
-            bid_user_id = new_order.user_id
-            ask_user_id = other_order.user_id
-        else:
-            bid_price = other_order.price
-            bid_user_id = other_order.user_id
-            ask_user_id = new_order.user_id
-
-        trades.append(
-            Trade(
-                price=new_order.price,
-                volume=matched_vol,
-                bid_user_id=bid_user_id,
-                ask_user_id=ask_user_id,
-                bid_price=bid_price,
-            )
-        )
 
-    # add new order to the order book if hasn't been filled yet
-    if new_order.volume > 0:
-        MARKETS[market][side].append(new_order)
-        multiplier = -1 if side == side.bid else 1
-        MARKETS[market][side].sort(
-            key=lambda order: (order.price * multiplier, order.timestamp)
-        )
+async def _settle(market: Market, trades: list[Trade]) -> None:
+    """Pays out all trades of one matching pass with a single storage write.
 
+    What traded is taken from the funds held by both orders, the rest of the
+    bid's hold above the trade price is just released.
+    """
+    if not trades:
+        return
+
+    taken: Amounts = defaultdict(int)
+    credits: Amounts = defaultdict(int)
+    released: Amounts = defaultdict(int)
     for trade in trades:
-        await wallets.credit(
-            user_id=trade.bid_user_id, currency_code=market.base, amount=trade.volume
-        )
-        await wallets.credit(
-            user_id=trade.ask_user_id,
-            currency_code=market.quote,
-            amount=trade.volume * trade.price,
-        )
+        base = market.base_units(trade.volume)
+        quote = market.quote_units(trade.price, trade.volume)
+        taken[(trade.bid_user_id, market.quote)] += quote
+        taken[(trade.ask_user_id, market.base)] += base
+        credits[(trade.bid_user_id, market.base)] += base
+        credits[(trade.ask_user_id, market.quote)] += quote
         price_diff = trade.bid_price - trade.price
         if price_diff > 0:
-            await wallets.credit(
-                user_id=trade.bid_user_id,
-                currency_code=market.quote,
-                amount=trade.volume * price_diff,
+            released[(trade.bid_user_id, market.quote)] += market.quote_units(
+                price_diff, trade.volume
             )
 
+    await wallets.settle(taken, released, credits)
+
 
 class NoSuchOrder(Exception):
     pass
 
 
+@_completed
 async def cancel_order(
-    market: Market, user_id: auth.UserId, order_id: str, tasks: TasksScheduler
+    market: Market, user_id: auth.UserId, order_id: OrderId, tasks: TasksScheduler
 ) -> None:
     try:
-        order = [
-            o
-            for o in MARKETS[market][Side.bid]
-            if (o.order_id, o.user_id) == (order_id, user_id)
-        ].pop()
-        side = Side.bid
-        currency_to_credit = market.quote
-        volume_to_credit = order.price * order.volume
-    except IndexError:
-        try:
-            order = [
-                o
-                for o in MARKETS[market][Side.ask]
-                if (o.order_id, o.user_id) == (order_id, user_id)
-            ].pop()
-        except IndexError:
-            raise NoSuchOrder
-
-        side = Side.ask
-        currency_to_credit = market.base
-        volume_to_credit = order.volume
-
-    MARKETS[market][side].remove(order)
-
-    await wallets.credit(
-        user_id=user_id, currency_code=currency_to_credit, amount=volume_to_credit
-    )
-
+        with metrics.phase("matching"):
+            order = await engine.cancel(market, user_id, order_id)
+    except KeyError:
+        raise NoSuchOrder
 
-def order_book(market: Market) -> Tuple[dict[Decimal, Decimal], dict[Decimal, Decimal]]:
-    asks_volume_by_price = defaultdict(Decimal)
-    for ask in MARKETS[market][Side.ask]:
-        asks_volume_by_price[ask.price] += ask.volume
+    currency, value = _cost(market, order.side, order.price, order.volume)
+    await wallets.release({(user_id, currency): value})
 
-    bids_volume_by_price = defaultdict(Decimal)
-    for bid in MARKETS[market][Side.bid]:
-        bids_volume_by_price[bid.price] += bid.volume
 
-    return asks_volume_by_price, bids_volume_by_price
+@_completed
+async def cancel_orders(
+    market: Market,
+    user_id: auth.UserId,
+    order_ids: list[OrderId],
+    tasks: TasksScheduler,
+) -> list[OrderId]:
+    """Cancels those of the orders that the user has, returns their ids."""
+    with metrics.phase("matching"):
+        orders = await engine.cancel_many(market, user_id, order_ids)
+    await _release(market, user_id, orders)
+    return [order.order_id for order in orders]
+
+
+@_completed
+async def cancel_all_orders(
+    market: Market, user_id: auth.UserId, tasks: TasksScheduler
+) -> list[OrderId]:
+    with metrics.phase("matching"):
+        orders = await engine.cancel_all(market, user_id)
+    await _release(market, user_id, orders)
+    return [order.order_id for order in orders]
+
+
+async def _release(market: Market, user_id: auth.UserId, orders: list[Order]) -> None:
+    """Releases what's left held by cancelled orders."""
+    held: Amounts = defaultdict(int)
+    for order in orders:
+        currency, value = _cost(market, order.side, order.price, order.volume)
+        held[(user_id, currency)] += value
+    await wallets.release(held)
+
+
+async def order_book(market: Market, depth: int | None = None) -> bytes:
+    """Aggregated volume per price level as JSON, `depth` best levels per side."""
+    with metrics.phase("matching"):
+        return await engine.depth(market, depth)
+
+
+async def market_data(market: Market) -> AsyncIterator[str]:
+    """JSON snapshot of the book, then its updates as they happen.
+
+    Raises SubscriberTooSlow when the consumer doesn't keep up with updates.
+    """
+    with feed.subscribe(market) as subscription:
+        sequence, snapshot = await engine.sequenced_depth(market)
+        yield serialize_snapshot(sequence, snapshot)
+        while True:
+            update_sequence, message = await subscription.get()
+            # updates queued while the snapshot was taken are already in it
+            if update_sequence > sequence:
+                yield message
@@ -0,0 +1,434 @@
+import sys
+import time
+from bisect import bisect_left, insort
+from enum import Enum
+from typing import TYPE_CHECKING, Iterator
+
+from attr import define
+
+from mbex import auth
+from mbex.trading.markets import Market
+
+if TYPE_CHECKING:
+    from mbex.trading.journal import Journal
+
+
+class Side(Enum):
+    ask = "ask"
+    bid = "bid"
+
+
+OrderId = int
+# side, price and volume of an order to place
+NewOrder = tuple[Side, int, int]
+
+
+class Order:
+    """Resting limit order, with price in ticks and volume in lots of the market.
+
+    Books hold millions of these, so there are no per-instance dicts, no
+    per-order timestamps (time priority is the position within the level) and
+    no string ids.
+    """
+
+    __slots__ = ("order_id", "side", "price", "volume", "user_id", "prev", "next")
+
+    def __init__(
+        self,
+        order_id: OrderId,
+        side: Side,
+        price: int,
+        volume: int,
+        user_id: auth.UserId,
+    ) -> None:
+        self.order_id = order_id
+        self.side = side
+        self.price = price
+        self.volume = volume
+        self.user_id = user_id
+        # neighbours within a price level, maintained by `PriceLevel`
+        self.prev: Order | None = None
+        self.next: Order | None = None
+
+    def __repr__(self) -> str:
+        return (
+            f"Order(order_id={self.order_id}, side={self.side}, price={self.price},"
+            f" volume={self.volume}, user_id={self.user_id!r})"
+        )
+
+    def __reduce__(self) -> tuple:
+        # links are meaningless outside of the book, don't drag neighbours along
+        return Order, (self.order_id, self.side, self.price, self.volume, self.user_id)
+
+
+@define(frozen=True)
+class Trade:
+    price: int
+    volume: int
+    bid_user_id: auth.UserId
+    ask_user_id: auth.UserId
+    bid_price: int
+
+
+@define(frozen=True)
+class BookUpdate:
+    """What one command changed in the book."""
+
+    sequence: int
+    # (side, price, volume now resting there), 0 volume means the level is gone
+    levels: list[tuple[Side, int, int]]
+    trades: list[Trade]
+
+
+class PriceLevel:
+    """All resting orders at one price, oldest first.
+
+    Orders form a doubly-linked list through their `prev`/`next` fields, so an
+    order can be unlinked in O(1) once it is known, without scanning the level.
+    """
+
+    __slots__ = ("price", "volume", "count", "first", "last")
+
+    def __init__(self, price: int) -> None:
+        self.price = price
+        self.volume = 0
+        self.count = 0
+        self.first: Order | None = None
+        self.last: Order | None = None
+
+    def __iter__(self) -> Iterator[Order]:
+        order = self.first
+        while order is not None:
+            yield order
+            order = order.next
+
+    def append(self, order: Order) -> None:
+        order.prev = self.last
+        order.next = None
+        if self.last is None:
+            self.first = order
+        else:
+            self.last.next = order
+        self.last = order
+        self.count += 1
+        self.volume += order.volume
+
+    def unlink(self, order: Order) -> None:
+        """Takes `order` out of the level, its remaining volume included."""
+        if order.prev is None:
+            self.first = order.next
+        else:
+            order.prev.next = order.next
+        if order.next is None:
+            self.last = order.prev
+        else:
+            order.next.prev = order.prev
+        order.prev = order.next = None
+        self.count -= 1
+        self.volume -= order.volume
+
+
+class BookSide:
+    """Price levels of one side of the book.
+
+    Levels are kept in a dict for O(1) lookup by price and their keys in a list
+    sorted so that the best price is always the last element. That makes
+    best-price lookup and removal of an exhausted best level O(1), while adding
+    a new level costs a binary search.
+    """
+
+    def __init__(self, side: Side) -> None:
+        self.side = side
+        self._levels: dict[int, PriceLevel] = {}
+        self._prices: list[int] = []
+        # bids: highest price is best, asks: lowest price is best
+        self._sort_key = (
+            (lambda price: price) if side == Side.bid else (lambda price: -price)
+        )
+
+    def __len__(self) -> int:
+        return len(self._prices)
+
+    def best(self) -> PriceLevel | None:
+        if not self._prices:
+            return None
+        return self._levels[self._prices[-1]]
+
+    def levels(self) -> Iterator[PriceLevel]:
+        """Iterates over levels from the best price to the worst one."""
+        for price in reversed(self._prices):
+            yield self._levels[price]
+
+    def volume_at(self, price: int) -> int:
+        level = self._levels.get(price)
+        return 0 if level is None else level.volume
+
+    def add(self, order: Order) -> None:
+        level = self._levels.get(order.price)
+        if level is None:
+            level = self._levels[order.price] = PriceLevel(order.price)
+            insort(self._prices, order.price, key=self._sort_key)
+        # share the level's int object instead of keeping a copy per order
+        order.price = level.price
+        level.append(order)
+
+    def remove(self, order: Order) -> None:
+        level = self._levels[order.price]
+        level.unlink(order)
+        if level.count == 0:
+            self.drop_level(level)
+
+    def restore(self, levels: list[PriceLevel]) -> None:
+        """Replaces all levels with `levels`, given from the best to the worst."""
+        self._levels = {level.price: level for level in levels}
+        self._prices = [level.price for level in reversed(levels)]
+
+    def drop_level(self, level: PriceLevel) -> None:
+        del self._levels[level.price]
+        if self._prices[-1] == level.price:
+            self._prices.pop()
+        else:
+            key = self._sort_key(level.price)
+            del self._prices[bisect_left(self._prices, key, key=self._sort_key)]
+
+
+# next order id, sequence, (side, price, [(order id, volume, user id)]) per level
+BookState = tuple[
+    OrderId, int, list[tuple[Side, int, list[tuple[OrderId, int, auth.UserId]]]]
+]
+
+
+class OrderBook:
+    def __init__(self, market: Market) -> None:
+        self.market = market
+        self.sides = {Side.bid: BookSide(Side.bid), Side.ask: BookSide(Side.ask)}
+        # resting orders by id, kept in sync by matching and cancel
+        self._index: dict[OrderId, Order] = {}
+        # ids of resting orders by user, in order of placing, kept in sync as above
+        self._user_orders: dict[auth.UserId, dict[OrderId, None]] = {}
+        self._next_order_id = 1
+        # serialised depth snapshots by number of levels, dropped on every change
+        self.snapshots: dict[int | None, bytes] = {}
+        # serialised levels by side and price, with the volume they were built for
+        self.level_snapshots: dict[tuple[Side, int], tuple[int, bytes]] = {}
+        # bumped by every change, lets market data consumers order updates
+        self.sequence = 0
+        self.last_update: BookUpdate | None = None
+        self._touched_levels: dict[tuple[Side, int], None] = {}
+        # gets every accepted command, when the book is persisted
+        self.journal: "Journal | None" = None
+
+    def __getitem__(self, side: Side) -> BookSide:
+        return self.sides[side]
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def place(
+        self, side: Side, price: int, volume: int, user_id: auth.UserId
+    ) -> tuple[OrderId, list[Trade]]:
+        """Executes a new limit order against the opposite side.
+
+        Whatever is left of the order after matching rests in the book.
+        """
+        trades: list[Trade] = []
+        order_id = self._place(side, price, volume, user_id, trades)
+        self._changed(trades)
+        if self.journal is not None:
+            self.journal.placed(order_id, side, price, volume, user_id)
+        return order_id, trades
+
+    def place_many(
+        self, orders: list[NewOrder], user_id: auth.UserId
+    ) -> tuple[list[OrderId], list[Trade]]:
+        """Places orders of one user one after another, as a single change."""
+        if not orders:
+            return [], []
+
+        trades: list[Trade] = []
+        order_ids = [
+            self._place(side, price, volume, user_id, trades)
+            for side, price, volume in orders
+        ]
+        self._changed(trades)
+        if self.journal is not None:
+            self.journal.placed_many(order_ids, orders, user_id)
+        return order_ids, trades
+
+    def _place(
+        self,
+        side: Side,
+        price: int,
+        volume: int,
+        user_id: auth.UserId,
+        trades: list[Trade],
+    ) -> OrderId:
+        order_id = self._next_order_id
+        self._next_order_id += 1
+        # all orders of a user share one string instead of a copy per request
+        new_order = Order(order_id, side, price, volume, sys.intern(user_id))
+
+        is_bid = side == Side.bid
+        other_side = self.sides[Side.ask if is_bid else Side.bid]
+        while new_order.volume > 0:
+            level = other_side.best()
+            # comparing ints of the best level, once per level
+            if level is None or (
+                level.price > price if is_bid else level.price < price
+            ):
+                break
+
+            self._touched_levels[(other_side.side, level.price)] = None
+            while new_order.volume > 0 and level.count > 0:
+                time.sleep(0.001)  # simulate it's actually CPU-intensive
+                other_order = level.first
+                matched_vol = min(other_order.volume, new_order.volume)
+                # remove order present in order book if it was filled completely
+                if other_order.volume == matched_vol:
+                    level.unlink(other_order)
+                    del self._index[other_order.order_id]
+                    self._forget(other_order)
+                else:
+                    level.volume -= matched_vol
+                    other_order.volume -= matched_vol
+                new_order.volume -= matched_vol
+
+                if is_bid:
+                    trades.append(
+                        Trade(
+                            price=price,
+                            volume=matched_vol,
+                            bid_user_id=new_order.user_id,
+                            ask_user_id=other_order.user_id,
+                            bid_price=price,
+                        )
+                    )
+                else:
+                    trades.append(
+                        Trade(
+                            price=price,
+                            volume=matched_vol,
+                            bid_user_id=other_order.user_id,
+                            ask_user_id=new_order.user_id,
+                            bid_price=level.price,
+                        )
+                    )
+
+            if level.count == 0:
+                other_side.drop_level(level)
+
+        # add new order to the order book if hasn't been filled yet
+        if new_order.volume > 0:
+            self.sides[side].add(new_order)
+            self._index[order_id] = new_order
+            self._user_orders.setdefault(new_order.user_id, {})[order_id] = None
+            self._touched_levels[(side, price)] = None
+
+        return order_id
+
+    def cancel(self, user_id: auth.UserId, order_id: OrderId) -> Order:
+        """Removes a resting order from the book.
+
+        Raises KeyError if the user has no such order in this book.
+        """
+        order = self._index.get(order_id)
+        if order is None or order.user_id != user_id:
+            raise KeyError(order_id)
+
+        self._cancel(order)
+        self._changed([])
+        if self.journal is not None:
+            self.journal.cancelled(user_id, order_id)
+        return order
+
+    def cancel_many(
+        self, user_id: auth.UserId, order_ids: list[OrderId]
+    ) -> list[Order]:
+        """Removes those of the orders that the user has in the book, as one change.
+
+        Returns the removed orders, ids that aren't there are skipped.
+        """
+        cancelled = []
+        for order_id in order_ids:
+            order = self._index.get(order_id)
+            if order is not None and order.user_id == user_id:
+                self._cancel(order)
+                cancelled.append(order)
+
+        if cancelled:
+            self._changed([])
+            if self.journal is not None:
+                self.journal.cancelled_many(
+                    user_id, [order.order_id for order in cancelled]
+                )
+        return cancelled
+
+    def cancel_all(self, user_id: auth.UserId) -> list[Order]:
+        """Removes all orders of the user, found without looking at others'."""
+        return self.cancel_many(user_id, list(self._user_orders.get(user_id, ())))
+
+    def _cancel(self, order: Order) -> None:
+        del self._index[order.order_id]
+        self._forget(order)
+        self.sides[order.side].remove(order)
+        self._touched_levels[(order.side, order.price)] = None
+
+    def _forget(self, order: Order) -> None:
+        """Drops the order from orders of its user, and the user without any."""
+        orders = self._user_orders[order.user_id]
+        del orders[order.order_id]
+        if not orders:
+            del self._user_orders[order.user_id]
+
+    def dump(self) -> BookState:
+        """Everything `restore` needs to rebuild the book, in plain tuples."""
+        return (
+            self._next_order_id,
+            self.sequence,
+            [
+                (
+                    side,
+                    level.price,
+                    [(order.order_id, order.volume, order.user_id) for order in level],
+                )
+                for side, book_side in self.sides.items()
+                for level in book_side.levels()
+            ],
+        )
+
+    @classmethod
+    def restore(cls, market: Market, state: BookState) -> "OrderBook":
+        """Rebuilds a dumped book without matching, levels already come sorted."""
+        next_order_id, sequence, dumped_levels = state
+        book = cls(market)
+        book._next_order_id = next_order_id
+        book.sequence = sequence
+        index = book._index
+        levels: dict[Side, list[PriceLevel]] = {Side.bid: [], Side.ask: []}
+        for side, price, orders in dumped_levels:
+            level = PriceLevel(price)
+            for order_id, volume, user_id in orders:
+                order = Order(order_id, side, price, volume, sys.intern(user_id))
+                level.append(order)
+                index[order_id] = order
+            levels[side].append(level)
+        # levels come by price, orders of users are kept in order of placing
+        user_orders = book._user_orders
+        for order_id in sorted(index):
+            user_orders.setdefault(index[order_id].user_id, {})[order_id] = None
+        for side, side_levels in levels.items():
+            book.sides[side].restore(side_levels)
+        return book
+
+    def _changed(self, trades: list[Trade]) -> None:
+        self.snapshots.clear()
+        self.sequence += 1
+        self.last_update = BookUpdate(
+            sequence=self.sequence,
+            levels=[
+                (side, price, self.sides[side].volume_at(price))
+                for side, price in self._touched_levels
+            ],
+            trades=trades,
+        )
+        self._touched_levels.clear()
@@ -0,0 +1,378 @@
+import asyncio
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from time import perf_counter_ns
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Iterator,
+    MutableMapping,
+    Protocol,
+    TypeVar,
+)
+
+from mbex import auth, metrics
+from mbex.trading.book import (
+    NewOrder,
+    Order,
+    OrderBook,
+    OrderId,
+    Side,
+    Trade,
+)
+from mbex.trading.feed import Feed
+from mbex.trading.journal import JournalSettings
+from mbex.trading.markets import format_decimal
+
+if TYPE_CHECKING:
+    from mbex.trading import Market
+
+# ticks * lots of bids, lots of asks, by user and side
+Resting = dict[tuple[auth.UserId, Side], int]
+T = TypeVar("T")
+
+
+class EngineTimeout(Exception):
+    """A command isn't done in time, it goes on and its funds settle when it is."""
+
+
+class EngineUnavailable(Exception):
+    """The command wasn't sent, as the engine of the market can't take it.
+
+    Either the engine has died or it hasn't replied to an earlier command for
+    longer than its timeout.
+    """
+
+
+class EngineFailed(Exception):
+    """The engine died while running the command, its book is gone with it."""
+
+
+class Engine(Protocol):
+    """Owner of order books. Every book has exactly one writer - the engine."""
+
+    async def place(
+        self,
+        market: "Market",
+        side: Side,
+        price: int,
+        volume: int,
+        user_id: auth.UserId,
+    ) -> tuple[OrderId, list[Trade]]:
+        ...
+
+    async def place_many(
+        self, market: "Market", orders: list[NewOrder], user_id: auth.UserId
+    ) -> tuple[list[OrderId], list[Trade]]:
+        """Places all orders in one go, see `OrderBook.place_many`."""
+
+    async def cancel(
+        self, market: "Market", user_id: auth.UserId, order_id: OrderId
+    ) -> Order:
+        """Raises KeyError if there is no such order."""
+
+    async def cancel_many(
+        self, market: "Market", user_id: auth.UserId, order_ids: list[OrderId]
+    ) -> list[Order]:
+        """Cancels those of the orders that exist, returns them."""
+
+    async def cancel_all(self, market: "Market", user_id: auth.UserId) -> list[Order]:
+        ...
+
+    async def depth(self, market: "Market", max_levels: int | None = None) -> bytes:
+        """JSON snapshot of the book, see `depth_snapshot`."""
+
+    async def sequenced_depth(self, market: "Market") -> tuple[int, bytes]:
+        """Full depth snapshot together with the sequence of the book it shows."""
+
+    async def resting(self, market: "Market") -> Resting:
+        """What resting orders of each user lock, see `resting_totals`."""
+
+    async def open(self, market: "Market") -> None:
+        """Loads the book of the market, if it isn't loaded yet."""
+
+    async def start(self) -> None:
+        """Prepares what has to run before requests, at startup of the API."""
+
+    async def close(self) -> None:
+        """Persists and closes all books, when they're journaled."""
+
+    def clear(self) -> None:
+        """Drops all books, persisted ones included."""
+
+
+class LocalEngine:
+    """Matches in the calling process, inside the event loop or next to it.
+
+    Commands for a market are queued for its actor and run in order of arrival,
+    while other markets keep going. With `executor="thread"` every market gets
+    a thread of its own to match in, so the event loop only awaits results.
+    """
+
+    def __init__(
+        self,
+        books: MutableMapping["Market", OrderBook],
+        feed: Feed,
+        journal: JournalSettings | None = None,
+        max_queued: int = 1000,
+        executor: str = "loop",
+    ) -> None:
+        if executor not in ("loop", "thread"):
+            raise ValueError(f"Unknown engine executor: {executor}")
+        self._books = books
+        self._feed = feed
+        self._journal = journal
+        self._max_queued = max_queued
+        self._executor = executor
+        self._actors: dict["Market", MarketActor] = {}
+
+    def _book(self, market: "Market") -> OrderBook:
+        book = self._books.get(market)
+        if book is None:
+            if self._journal is None:
+                book = OrderBook(market)
+            else:
+                book = self._journal.open_book(market)
+            self._books[market] = book
+        return book
+
+    async def _execute(
+        self, market: "Market", command: Callable[..., T], *args: Any
+    ) -> T:
+        actor = self._actors.get(market)
+        if actor is None:
+            actor = self._actors[market] = MarketActor(
+                self._book(market),
+                self._feed,
+                self._max_queued,
+                executor=(
+                    ThreadPoolExecutor(1, thread_name_prefix=f"mbex-{market}")
+                    if self._executor == "thread"
+                    else None
+                ),
+            )
+        return await actor.execute(command, *args)
+
+    async def place(
+        self,
+        market: "Market",
+        side: Side,
+        price: int,
+        volume: int,
+        user_id: auth.UserId,
+    ) -> tuple[OrderId, list[Trade]]:
+        return await self._execute(
+            market, OrderBook.place, side, price, volume, user_id
+        )
+
+    async def place_many(
+        self, market: "Market", orders: list[NewOrder], user_id: auth.UserId
+    ) -> tuple[list[OrderId], list[Trade]]:
+        return await self._execute(market, OrderBook.place_many, orders, user_id)
+
+    async def cancel(
+        self, market: "Market", user_id: auth.UserId, order_id: OrderId
+    ) -> Order:
+        return await self._execute(market, OrderBook.cancel, user_id, order_id)
+
+    async def cancel_many(
+        self, market: "Market", user_id: auth.UserId, order_ids: list[OrderId]
+    ) -> list[Order]:
+        return await self._execute(market, OrderBook.cancel_many, user_id, order_ids)
+
+    async def cancel_all(self, market: "Market", user_id: auth.UserId) -> list[Order]:
+        return await self._execute(market, OrderBook.cancel_all, user_id)
+
+    async def depth(self, market: "Market", max_levels: int | None = None) -> bytes:
+        # cached bytes show the book as of its latest command, so they can be
+        # served without queueing, even while the next command is being matched
+        snapshot = self._book(market).snapshots.get(max_levels)
+        if snapshot is not None:
+            return snapshot
+        return await self._execute(market, depth_snapshot, max_levels)
+
+    async def sequenced_depth(self, market: "Market") -> tuple[int, bytes]:
+        return await self._execute(market, sequenced_depth)
+
+    async def resting(self, market: "Market") -> Resting:
+        return await self._execute(market, resting_totals)
+
+    async def open(self, market: "Market") -> None:
+        self._book(market)
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        for actor in self._actors.values():
+            await actor.close()
+        self._actors.clear()
+        for book in self._books.values():
+            if book.journal is not None:
+                book.journal.close()
+        self._books.clear()
+
+    def clear(self) -> None:
+        for actor in self._actors.values():
+            actor.stop()
+        self._actors.clear()
+        for book in self._books.values():
+            if book.journal is not None:
+                book.journal.close(snapshot=False)
+        self._books.clear()
+        if self._journal is not None:
+            self._journal.clear()
+
+
+class MarketActor:
+    """The only one changing a book, running queued commands one after another.
+
+    Callers wait for room in the queue when it's full, so a flood of orders on
+    one market slows down its senders instead of piling up in memory.
+    """
+
+    def __init__(
+        self,
+        book: OrderBook,
+        feed: Feed,
+        max_queued: int,
+        executor: ThreadPoolExecutor | None = None,
+    ) -> None:
+        self._book = book
+        self._feed = feed
+        self._max_queued = max_queued
+        # runs commands instead of the event loop, when given
+        self._executor = executor
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._queue: asyncio.Queue[_Command]
+        self._task: asyncio.Task | None = None
+        self._metrics = metrics.engine_queues[str(book.market)]
+
+    async def execute(self, command: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # e.g. the first command, or TestClient running each request in a loop
+            # of its own; whatever was queued in the previous loop is gone with it
+            self._loop = loop
+            self._queue = asyncio.Queue(self._max_queued)
+            self._task = loop.create_task(self._run())
+
+        future = loop.create_future()
+        self._metrics.depth.record(self._queue.qsize())
+        await self._queue.put((command, args, future, perf_counter_ns()))
+        return await future
+
+    async def close(self) -> None:
+        """Waits for queued commands, then stops."""
+        if self._task is None:
+            return
+        await self._queue.join()
+        self.stop()
+
+    def stop(self) -> None:
+        """Stops right away, dropping queued commands."""
+        if self._task is not None and not self._loop.is_closed():
+            self._task.cancel()
+        self._task = None
+        self._loop = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    async def _run(self) -> None:
+        book = self._book
+        while True:
+            command, args, future, queued_at = await self._queue.get()
+            self._metrics.wait.record(perf_counter_ns() - queued_at)
+            # run even if the caller is gone, it may have held funds for it already
+            sequence = book.sequence
+            try:
+                if self._executor is None:
+                    result = command(book, *args)
+                else:
+                    result = await self._loop.run_in_executor(
+                        self._executor, command, book, *args
+                    )
+            except Exception as exc:
+                if not future.cancelled():
+                    future.set_exception(exc)
+            else:
+                if book.sequence != sequence:
+                    self._feed.publish(book.market, book.last_update)
+                if not future.cancelled():
+                    future.set_result(result)
+            self._queue.task_done()
+
+
+# command, its arguments after the book, future of its result, when it was queued
+_Command = tuple[Callable[..., Any], tuple, asyncio.Future, int]
+
+
+def depth_snapshot(book: OrderBook, max_levels: int | None = None) -> bytes:
+    """JSON with aggregated volume of up to `max_levels` best levels per side.
+
+    Levels keep their volume up to date, so this costs O(levels), not O(orders).
+    The result is cached in the book until the book changes.
+    """
+    if max_levels is not None and max_levels >= max(
+        len(book[Side.ask]), len(book[Side.bid])
+    ):
+        # not truncated anyway, share the snapshot with full-depth requests
+        max_levels = None
+
+    try:
+        return book.snapshots[max_levels]
+    except KeyError:
+        pass
+
+    levels = book.level_snapshots
+    if len(levels) > 2 * (len(book[Side.ask]) + len(book[Side.bid])) + 100:
+        # mostly levels that are gone by now
+        levels.clear()
+    snapshot = b"".join(
+        (
+            b'{"asks":[',
+            b",".join(_level_snapshots(book, Side.ask, max_levels)),
+            b'],"bids":[',
+            b",".join(_level_snapshots(book, Side.bid, max_levels)),
+            b"]}",
+        )
+    )
+    book.snapshots[max_levels] = snapshot
+    return snapshot
+
+
+def sequenced_depth(book: OrderBook) -> tuple[int, bytes]:
+    return book.sequence, depth_snapshot(book)
+
+
+def resting_totals(book: OrderBook) -> Resting:
+    """Sums of price * volume of bids and of volume of asks, per user."""
+    totals: Resting = defaultdict(int)
+    for level in book[Side.bid].levels():
+        for order in level:
+            totals[(order.user_id, Side.bid)] += level.price * order.volume
+    for level in book[Side.ask].levels():
+        for order in level:
+            totals[(order.user_id, Side.ask)] += order.volume
+    return dict(totals)
+
+
+def _level_snapshots(
+    book: OrderBook, side: Side, max_levels: int | None
+) -> Iterator[bytes]:
+    """JSON of each level, reused while its volume stays the same."""
+    levels = book.level_snapshots
+    for level in islice(book[side].levels(), max_levels):
+        key = (side, level.price)
+        cached = levels.get(key)
+        if cached is None or cached[0] != level.volume:
+            price = format_decimal(book.market.price(level.price))
+            volume = format_decimal(book.market.volume(level.volume))
+            # digits and a dot, nothing to escape
+            cached = levels[key] = (
+                level.volume,
+                f'{{"price":"{price}","volume":"{volume}"}}'.encode(),
+            )
+        yield cached[1]
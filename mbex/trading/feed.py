@@ -0,0 +1,108 @@
+"""Market data fan-out.
+
+Every book update is serialised once, no matter how many subscribers there are,
+and the same message is put on each subscriber's queue.
+"""
+import asyncio
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterator
+
+import orjson
+
+from mbex.trading.book import BookUpdate, Side
+from mbex.trading.markets import format_decimal
+
+if TYPE_CHECKING:
+    from mbex.trading import Market
+
+# (sequence, JSON message)
+Message = tuple[int, str]
+
+
+class SubscriberTooSlow(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, max_pending: int) -> None:
+        self._queue: asyncio.Queue[Message | None] = asyncio.Queue(max_pending)
+        self.overflown = False
+
+    def put(self, message: Message) -> None:
+        if self.overflown:
+            return
+
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # a subscriber that fell behind can't be fed deltas anymore, make room
+            # for None to wake it up, so it can start over with a fresh snapshot
+            self.overflown = True
+            self._queue.get_nowait()
+            self._queue.put_nowait(None)
+
+    async def get(self) -> Message:
+        message = await self._queue.get()
+        if message is None:
+            raise SubscriberTooSlow
+        return message
+
+
+class Feed:
+    def __init__(self, max_pending: int) -> None:
+        self._max_pending = max_pending
+        self._subscriptions: defaultdict["Market", set[Subscription]] = defaultdict(set)
+
+    @contextmanager
+    def subscribe(self, market: "Market") -> Iterator[Subscription]:
+        subscription = Subscription(self._max_pending)
+        self._subscriptions[market].add(subscription)
+        try:
+            yield subscription
+        finally:
+            self._subscriptions[market].discard(subscription)
+            if not self._subscriptions[market]:
+                del self._subscriptions[market]
+
+    def publish(self, market: "Market", update: BookUpdate) -> None:
+        subscriptions = self._subscriptions.get(market)
+        if not subscriptions:
+            return
+
+        message = update.sequence, serialize_update(market, update)
+        for subscription in subscriptions:
+            subscription.put(message)
+
+
+def serialize_update(market: "Market", update: BookUpdate) -> str:
+    levels: dict[Side, list[dict[str, str]]] = {Side.ask: [], Side.bid: []}
+    for side, price, volume in update.levels:
+        levels[side].append(
+            {
+                "price": format_decimal(market.price(price)),
+                "volume": format_decimal(market.volume(volume)),
+            }
+        )
+
+    return orjson.dumps(
+        {
+            "type": "update",
+            "sequence": update.sequence,
+            "asks": levels[Side.ask],
+            "bids": levels[Side.bid],
+            "trades": [
+                {
+                    "price": format_decimal(market.price(trade.price)),
+                    "volume": format_decimal(market.volume(trade.volume)),
+                }
+                for trade in update.trades
+            ],
+        }
+    ).decode()
+
+
+def serialize_snapshot(sequence: int, depth_snapshot: bytes) -> str:
+    """Turns JSON of the order book into the snapshot message of the stream."""
+    body = depth_snapshot.decode()
+    return f'{{"type":"snapshot","sequence":{sequence},{body[1:]}'
@@ -0,0 +1,430 @@
+"""Durable order books: a snapshot of each book plus a journal of commands since.
+
+The journal gets a line per accepted place/cancel or batch of them, written
+with a plain `os.write` - so it survives the process crashing right away - and
+fsynced by a background thread every `fsync_interval` seconds, one fsync for
+all lines written in between. Every `snapshot_every` lines the book is copied
+and the journal starts over in a new file, the same thread then saves the copy
+and removes the old journal. One such thread serves all books of a process.
+
+Lines carry the sequence of the book after the command, so a journal left over
+from before the latest snapshot is skipped on replay instead of applied twice.
+Prices and volumes are saved in ticks and lots, so both the snapshot and the
+first line of every journal record the tick and lot size they're in; a book is
+not loaded once those of its market have changed.
+"""
+import fcntl
+import functools
+import gc
+import logging
+import os
+import pickle
+import queue
+import threading
+import time
+from contextlib import contextmanager, suppress
+from decimal import Decimal
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Iterator
+
+from attr import define
+
+from mbex import auth
+from mbex.trading.book import BookState, NewOrder, OrderBook, OrderId, Side
+
+if TYPE_CHECKING:
+    from mbex.trading import Market
+
+JOURNAL_SUFFIX = ".journal"
+SNAPSHOT_SUFFIX = ".snapshot"
+# the journal up to a snapshot that's still being saved
+ROTATED_SUFFIX = ".rotated"
+# starts the first line of a journal, the one with tick and lot size
+HEADER_PREFIX = "#"
+
+logger = logging.getLogger(__name__)
+
+
+class JournalInUse(Exception):
+    pass
+
+
+class CorruptJournal(Exception):
+    pass
+
+
+class SizesChanged(Exception):
+    """Tick or lot size of the market differ from those the book was saved in."""
+
+
+@define(frozen=True)
+class JournalSettings:
+    directory: str
+    # [s] between fsyncs, 0 fsyncs every command before it's acknowledged
+    fsync_interval: float
+    # journal lines after which the book is snapshotted and the journal truncated
+    snapshot_every: int
+
+    def open_book(self, market: "Market") -> OrderBook:
+        """Loads the book from its snapshot and journal, then journals it."""
+        return Journal(self, market).load()
+
+    def markets(self) -> list[str]:
+        """Names of markets with anything persisted."""
+        return sorted({path.stem for path in self._files()})
+
+    def clear(self) -> None:
+        """Removes all persisted books, none of them may be open."""
+        for path in self._files():
+            path.unlink()
+
+    def _files(self) -> list[Path]:
+        directory = Path(self.directory)
+        if not directory.exists():
+            return []
+        return [
+            path
+            for path in directory.iterdir()
+            if path.suffix in (JOURNAL_SUFFIX, SNAPSHOT_SUFFIX, ROTATED_SUFFIX)
+        ]
+
+
+class Journal:
+    def __init__(self, settings: JournalSettings, market: "Market") -> None:
+        self._settings = settings
+        self._market = market
+        directory = Path(settings.directory)
+        self._journal_path = directory / f"{market}{JOURNAL_SUFFIX}"
+        self._snapshot_path = directory / f"{market}{SNAPSHOT_SUFFIX}"
+        self._rotated_path = directory / f"{market}{ROTATED_SUFFIX}"
+        self._book: OrderBook | None = None
+        self._fd: int | None = None
+        # the rotated journal, until the snapshot covering it is saved
+        self._rotated_fd: int | None = None
+        # lines since the latest snapshot
+        self._lines = 0
+        # incremented by the engine thread, compared by the writer one
+        self._written = 0
+        self._synced = 0
+        self._lock = threading.Lock()
+        # cleared while the writer saves a snapshot
+        self._saved = threading.Event()
+        self._saved.set()
+        self._writer = _shared_writer()
+        # tick and lot size the book is saved in
+        self._sizes = (market.tick_size, market.lot_size)
+
+    def load(self) -> OrderBook:
+        Path(self._settings.directory).mkdir(parents=True, exist_ok=True)
+        self._fd = self._open_journal()
+
+        with _gc_paused():
+            try:
+                with self._snapshot_path.open("rb") as file:
+                    sizes, state = pickle.load(file)
+                self._check_sizes(sizes, self._snapshot_path)
+                book = OrderBook.restore(self._market, state)
+            except FileNotFoundError:
+                book = OrderBook(self._market)
+            try:
+                rotated = self._rotated_path.read_bytes()
+            except FileNotFoundError:
+                rotated = None
+            else:
+                # the process stopped before the snapshot was saved
+                self._replay(book, rotated, self._rotated_path)
+            self._replay(book, self._read_journal(), self._journal_path)
+
+        book.journal = self
+        self._book = book
+        if rotated is not None:
+            self.snapshot()
+        if self._settings.fsync_interval > 0:
+            self._writer.add(self)
+        return book
+
+    def placed(
+        self,
+        order_id: OrderId,
+        side: Side,
+        price: int,
+        volume: int,
+        user_id: auth.UserId,
+    ) -> None:
+        self._append(
+            f"{self._book.sequence}\tp\t{order_id}\t{side.value}\t{price}\t{volume}"
+            f"\t{user_id}\n"
+        )
+
+    def placed_many(
+        self, order_ids: list[OrderId], orders: list[NewOrder], user_id: auth.UserId
+    ) -> None:
+        # ids of a batch are consecutive, the first one is enough
+        fields = "".join(
+            f"\t{side.value},{price},{volume}" for side, price, volume in orders
+        )
+        self._append(f"{self._book.sequence}\tP\t{order_ids[0]}\t{user_id}{fields}\n")
+
+    def cancelled(self, user_id: auth.UserId, order_id: OrderId) -> None:
+        self._append(f"{self._book.sequence}\tc\t{order_id}\t{user_id}\n")
+
+    def cancelled_many(self, user_id: auth.UserId, order_ids: list[OrderId]) -> None:
+        fields = "".join(f"\t{order_id}" for order_id in order_ids)
+        self._append(f"{self._book.sequence}\tC\t{user_id}{fields}\n")
+
+    def snapshot(self) -> None:
+        """Saves the whole book atomically, then empties the journal.
+
+        Blocks until done, as opposed to snapshots taken every `snapshot_every`
+        lines, which are saved in the background.
+        """
+        self._saved.wait()
+        self._save(self._book.dump())
+        with self._lock:
+            os.ftruncate(self._fd, 0)
+            self._write_header(self._fd)
+            os.fsync(self._fd)
+            self._synced = self._written
+        self._remove_rotated()
+        self._lines = 0
+
+    def close(self, snapshot: bool = True) -> None:
+        if self._fd is None:
+            return
+
+        self._writer.remove(self)
+        self._saved.wait()
+        if snapshot:
+            self.snapshot()
+        with self._lock:
+            if self._written != self._synced:
+                os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
+            if self._rotated_fd is not None:
+                # its snapshot failed, the rotated journal is replayed on load
+                os.close(self._rotated_fd)
+                self._rotated_fd = None
+        self._book.journal = None
+
+    def _append(self, line: str) -> None:
+        os.write(self._fd, line.encode())
+        self._written += 1
+        if self._settings.fsync_interval <= 0:
+            os.fsync(self._fd)
+            self._synced = self._written
+
+        self._lines += 1
+        if (
+            self._lines >= self._settings.snapshot_every
+            and self._rotated_fd is None
+            and self._saved.is_set()
+        ):
+            self._snapshot_in_background()
+
+    def _snapshot_in_background(self) -> None:
+        """Copies the book and starts a new journal, the writer saves the copy.
+
+        Only the copy is made by the engine thread, pickling and fsyncing
+        millions of orders don't hold up commands.
+        """
+        state = self._book.dump()
+        os.rename(self._journal_path, self._rotated_path)
+        fd = self._open_journal()
+        with self._lock:
+            self._rotated_fd, self._fd = self._fd, fd
+            # lines of the rotated journal are fsynced by the writer
+            self._synced = self._written
+        self._lines = 0
+        self._saved.clear()
+        self._writer.submit(functools.partial(self._save_rotated, state))
+
+    def _save_rotated(self, state: BookState) -> None:
+        try:
+            os.fsync(self._rotated_fd)
+            self._save(state)
+            self._remove_rotated()
+        finally:
+            self._saved.set()
+
+    def _save(self, state: BookState) -> None:
+        tmp_path = self._snapshot_path.with_suffix(".tmp")
+        with _gc_paused(), tmp_path.open("wb") as file:
+            pickle.dump((self._sizes, state), file, protocol=pickle.HIGHEST_PROTOCOL)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self._snapshot_path)
+        _fsync_directory(self._settings.directory)
+
+    def _remove_rotated(self) -> None:
+        with suppress(FileNotFoundError):
+            self._rotated_path.unlink()
+        with self._lock:
+            if self._rotated_fd is not None:
+                os.close(self._rotated_fd)
+                self._rotated_fd = None
+
+    def _sync(self) -> None:
+        with self._lock:
+            written = self._written
+            if written != self._synced and self._fd is not None:
+                os.fsync(self._fd)
+                self._synced = written
+
+    def _open_journal(self) -> int:
+        fd = os.open(self._journal_path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            raise JournalInUse(f"{self._journal_path} is open in another process")
+        if os.fstat(fd).st_size == 0:
+            self._write_header(fd)
+        return fd
+
+    def _write_header(self, fd: int) -> None:
+        tick_size, lot_size = self._sizes
+        os.write(fd, f"{HEADER_PREFIX}\t{tick_size}\t{lot_size}\n".encode())
+
+    def _check_sizes(self, sizes: tuple[Decimal, Decimal], path: Path) -> None:
+        if sizes != self._sizes:
+            tick_size, lot_size = sizes
+            raise SizesChanged(
+                f"{path} is in tick size {tick_size} and lot size {lot_size}, "
+                f"{self._market} has {self._sizes[0]} and {self._sizes[1]}"
+            )
+
+    def _read_journal(self) -> bytes:
+        with open(self._fd, "rb", closefd=False) as file:
+            file.seek(0)
+            data = file.read()
+
+        complete = data.rfind(b"\n") + 1
+        if complete != len(data):
+            # the process died in the middle of writing the last line
+            os.ftruncate(self._fd, complete)
+        return data[:complete]
+
+    def _replay(self, book: OrderBook, data: bytes, path: Path) -> None:
+        lines = data.decode().splitlines()
+        if not lines:
+            return
+        prefix, *sizes = lines[0].split("\t")
+        if prefix != HEADER_PREFIX or len(sizes) != 2:
+            raise CorruptJournal(f"{path} starts with {lines[0]!r}, not sizes")
+        self._check_sizes((Decimal(sizes[0]), Decimal(sizes[1])), path)
+
+        for line in lines[1:]:
+            sequence, command, *fields = line.split("\t")
+            if int(sequence) <= book.sequence:
+                # already in the snapshot
+                continue
+
+            if command == "p":
+                order_id, side, price, volume, user_id = fields
+                placed_id, _trades = book.place(
+                    Side(side), int(price), int(volume), user_id
+                )
+            elif command == "P":
+                order_id, user_id, *orders = fields
+                new_orders = []
+                for order in orders:
+                    side, price, volume = order.split(",")
+                    new_orders.append((Side(side), int(price), int(volume)))
+                placed_ids, _trades = book.place_many(new_orders, user_id)
+                placed_id = placed_ids[0]
+            elif command == "c":
+                order_id, user_id = fields
+                book.cancel(user_id, int(order_id))
+            else:
+                user_id, *order_ids = fields
+                book.cancel_many(user_id, [int(order_id) for order_id in order_ids])
+
+            if command in ("p", "P") and placed_id != int(order_id):
+                raise CorruptJournal(f"{line!r} replayed as order {placed_id}")
+            if book.sequence != int(sequence):
+                raise CorruptJournal(f"{line!r} replayed at sequence {book.sequence}")
+            self._lines += 1
+
+
+class _Writer:
+    """The thread fsyncing journals and saving snapshots of all books."""
+
+    def __init__(self) -> None:
+        self._tasks: queue.SimpleQueue[Callable[[], None] | None] = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        # journals fsynced periodically, by when they're due
+        self._due: dict[Journal, float] = {}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, journal: Journal) -> None:
+        with self._lock:
+            self._due[journal] = time.monotonic() + journal._settings.fsync_interval
+        # wakes the thread up to wait for the new journal too
+        self._tasks.put(None)
+
+    def remove(self, journal: Journal) -> None:
+        with self._lock:
+            self._due.pop(journal, None)
+
+    def submit(self, task: Callable[[], None]) -> None:
+        self._tasks.put(task)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                next_due = min(self._due.values(), default=None)
+            timeout = None if next_due is None else max(next_due - time.monotonic(), 0)
+            try:
+                task = self._tasks.get(timeout=timeout)
+            except queue.Empty:
+                task = None
+            if task is not None:
+                try:
+                    task()
+                except Exception:
+                    logger.exception("Saving a snapshot failed")
+
+            now = time.monotonic()
+            with self._lock:
+                due = [journal for journal, at in self._due.items() if at <= now]
+                for journal in due:
+                    self._due[journal] = now + journal._settings.fsync_interval
+            for journal in due:
+                journal._sync()
+
+
+_writer: _Writer | None = None
+_writer_lock = threading.Lock()
+
+
+def _shared_writer() -> _Writer:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = _Writer()
+        return _writer
+
+
+@contextmanager
+def _gc_paused() -> Iterator[None]:
+    """For creating millions of objects in a row, none of them garbage yet.
+
+    Otherwise they would trigger many collections that free nothing.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def _fsync_directory(directory: str) -> None:
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,124 @@
+"""Markets and their tick/lot sizes.
+
+Inside the engine prices are integer numbers of ticks and volumes integer
+numbers of lots, so matching compares and adds plain ints. Decimals are
+converted at the API boundary with `Market.to_ticks`/`Market.to_lots`.
+"""
+import json
+from decimal import Decimal, InvalidOperation
+
+from attr import define, field
+
+from mbex import config, wallets
+
+
+class InvalidOrder(ValueError):
+    pass
+
+
+class UnknownMarket(ValueError):
+    pass
+
+
+def _units_per(size: Decimal) -> int:
+    units, remainder = divmod(size, wallets.UNIT)
+    if remainder or units <= 0:
+        raise ValueError(f"{size} is not a positive multiple of {wallets.UNIT}")
+    return int(units)
+
+
+@define(frozen=True)
+class Market:
+    base: wallets.CurrencyCode
+    quote: wallets.CurrencyCode
+    tick_size: Decimal = field(default=config.DEFAULT_TICK_SIZE, eq=False)
+    lot_size: Decimal = field(default=config.DEFAULT_LOT_SIZE, eq=False)
+    # wallet units of base currency in one lot
+    _base_units_per_lot: int = field(init=False, eq=False, repr=False)
+    # wallet units of quote currency paid for one lot at the price of one tick
+    _quote_units_per_tick_lot: int = field(init=False, eq=False, repr=False)
+
+    def __attrs_post_init__(self) -> None:
+        object.__setattr__(self, "_base_units_per_lot", _units_per(self.lot_size))
+        object.__setattr__(
+            self,
+            "_quote_units_per_tick_lot",
+            _units_per(self.tick_size * self.lot_size),
+        )
+
+    def __str__(self) -> str:
+        return f"{self.base}-{self.quote}"
+
+    def to_ticks(self, price: Decimal) -> int:
+        return _to_multiple(price, self.tick_size, "Price", "tick size")
+
+    def to_lots(self, volume: Decimal) -> int:
+        return _to_multiple(volume, self.lot_size, "Volume", "lot size")
+
+    def price(self, ticks: int) -> Decimal:
+        return ticks * self.tick_size
+
+    def volume(self, lots: int) -> Decimal:
+        return lots * self.lot_size
+
+    def base_units(self, lots: int) -> int:
+        return lots * self._base_units_per_lot
+
+    def quote_units(self, ticks: int, lots: int) -> int:
+        return ticks * lots * self._quote_units_per_tick_lot
+
+
+def _to_multiple(amount: Decimal, size: Decimal, what: str, size_name: str) -> int:
+    try:
+        multiple, remainder = divmod(amount, size)
+    except InvalidOperation:
+        # the quotient has more digits than the decimal context's precision
+        raise InvalidOrder(f"{what} is too large") from None
+    if remainder:
+        raise InvalidOrder(f"{what} must be a multiple of {size_name} {size}")
+    if multiple <= 0:
+        raise InvalidOrder(f"{what} must be positive")
+    return int(multiple)
+
+
+def format_decimal(value: Decimal) -> str:
+    """Plain notation without trailing zeros, e.g. 1.5000 -> 1.5, 1E+2 -> 100."""
+    return f"{value.normalize():f}"
+
+
+def _load_specs(raw: str) -> dict[str, tuple[Decimal, Decimal]]:
+    return {
+        name: (
+            Decimal(spec.get("tick_size", config.DEFAULT_TICK_SIZE)),
+            Decimal(spec.get("lot_size", config.DEFAULT_LOT_SIZE)),
+        )
+        for name, spec in json.loads(raw).items()
+    }
+
+
+# tick and lot size by name of every listed market
+SPECS = _load_specs(config.MARKETS)
+# every market by name, created once and then shared by all requests for it
+_markets = {
+    name: Market(*name.split("-"), tick_size=tick_size, lot_size=lot_size)
+    for name, (tick_size, lot_size) in SPECS.items()
+}
+
+
+def market_from_str(name: str) -> Market:
+    """The market named like "ETH-BTC", raises UnknownMarket for other names.
+
+    Only markets listed in MBEX_MARKETS are known, unless MBEX_OPEN_MARKETS is
+    set - then any pair of currencies is a market, with default tick and lot
+    size, kept for the lifetime of the process once asked for.
+    """
+    try:
+        return _markets[name]
+    except KeyError:
+        pass
+
+    base, _, quote = name.partition("-")
+    if not config.OPEN_MARKETS or not base or not quote or "-" in quote:
+        raise UnknownMarket(f"Unknown market {name}")
+    market = _markets[name] = Market(base, quote)
+    return market
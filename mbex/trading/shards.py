@@ -0,0 +1,229 @@
+"""Engine shards shared by all API workers of a host.
+
+A fixed number of shard processes, started once next to the API workers, own
+the order books. Each market belongs to the shard picked by consistent hashing
+of its name, so every worker sends its orders to the same single writer of the
+book, over ZeroMQ ipc:// sockets.
+
+Market data is published by the shards themselves, each worker subscribes to
+all of them and fans updates out to its own stream subscribers.
+"""
+import asyncio
+import bisect
+import hashlib
+import multiprocessing
+import pickle
+import time
+from typing import TYPE_CHECKING
+
+import zmq
+import zmq.asyncio
+
+from mbex.trading.book import OrderBook
+from mbex.trading.engine import EngineUnavailable
+from mbex.trading.feed import Feed
+from mbex.trading.journal import JournalSettings
+from mbex.trading.zmq_engine import COMMANDS, ZmqClient
+
+if TYPE_CHECKING:
+    from mbex.trading import Market
+
+# points of every shard on the ring, more spread markets more evenly
+REPLICAS = 64
+# what a shard publishes to a subscriber that has just connected
+SUBSCRIBED = b"subscribed"
+
+
+class HashRing:
+    """Consistent hashing, adding a shard moves only ~1/shards of markets."""
+
+    def __init__(self, shards: int) -> None:
+        points = sorted(
+            (_hash(f"shard-{shard}-{replica}"), shard)
+            for shard in range(shards)
+            for replica in range(REPLICAS)
+        )
+        self._hashes = [point for point, _shard in points]
+        self._shards = [shard for _point, shard in points]
+
+    def owner(self, key: str) -> int:
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._shards[index]
+
+
+def _hash(key: str) -> int:
+    # the same in every process, unlike hash() of str
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+def _address(ipc_dir: str, shard: int) -> str:
+    return f"ipc://{ipc_dir}/mbex-shard-{shard}"
+
+
+def _feed_address(ipc_dir: str, shard: int) -> str:
+    return f"ipc://{ipc_dir}/mbex-shard-{shard}-feed"
+
+
+def serve(ipc_dir: str, shard: int, journal: JournalSettings | None) -> None:
+    """Main loop of a shard process, serving requests of all API workers."""
+    books: dict["Market", OrderBook] = {}
+    context = zmq.Context()
+    socket = context.socket(zmq.REP)
+    socket.bind(_address(ipc_dir, shard))
+    publisher = context.socket(zmq.XPUB)
+    # tells every new subscriber that it's subscribed, see `ShardedEngine.start`
+    publisher.setsockopt(zmq.XPUB_WELCOME_MSG, SUBSCRIBED)
+    publisher.bind(_feed_address(ipc_dir, shard))
+    poller = zmq.Poller()
+    poller.register(socket, zmq.POLLIN)
+    poller.register(publisher, zmq.POLLIN)
+    while True:
+        ready = dict(poller.poll())
+        if publisher in ready:
+            # a (un)subscription, the welcome message goes out while it's handled
+            publisher.recv()
+        if socket not in ready:
+            continue
+
+        market, command, args = socket.recv_pyobj()
+        if command in ("close", "clear"):
+            for book in books.values():
+                if book.journal is not None:
+                    book.journal.close(snapshot=command == "close")
+            books.clear()
+            socket.send_pyobj((True, None, None))
+            if command == "close":
+                # updates for gone subscribers would keep the process alive
+                context.destroy(linger=0)
+                return
+            continue
+
+        book = books.get(market)
+        if book is None:
+            book = OrderBook(market) if journal is None else journal.open_book(market)
+            books[market] = book
+
+        sequence = book.sequence
+        try:
+            result = COMMANDS[command](book, *args)
+        except Exception as exc:
+            socket.send_pyobj((False, exc, None))
+        else:
+            # updates are published to all workers below, not in the reply
+            socket.send_pyobj((True, result, None))
+            if book.sequence != sequence:
+                publisher.send_pyobj((market, book.last_update))
+
+
+def start(
+    ipc_dir: str, shards: int, journal: JournalSettings | None
+) -> list[multiprocessing.Process]:
+    """Starts shard processes, to be done once, before API workers."""
+    processes = []
+    for shard in range(shards):
+        process = multiprocessing.get_context("spawn").Process(
+            target=serve, args=(ipc_dir, shard, journal), daemon=True
+        )
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def stop(ipc_dir: str, processes: list[multiprocessing.Process]) -> None:
+    """Snapshots journaled books of all shards and stops them."""
+    context = zmq.Context()
+    for shard, process in enumerate(processes):
+        socket = context.socket(zmq.REQ)
+        socket.connect(_address(ipc_dir, shard))
+        socket.send_pyobj((None, "close", ()))
+        socket.recv_pyobj()
+        socket.close(linger=0)
+        process.join()
+    context.term()
+
+
+class ShardedEngine(ZmqClient):
+    """Client of shard processes, one in every API worker.
+
+    Shards aren't processes of the worker, so one that hasn't replied for
+    `timeout` is taken as dead - until it replies again, e.g. started anew.
+    """
+
+    def __init__(
+        self,
+        ipc_dir: str,
+        shards: int,
+        feed: Feed,
+        journal: JournalSettings | None = None,
+        timeout: float = 30,
+    ) -> None:
+        super().__init__(feed, timeout)
+        self._ipc_dir = ipc_dir
+        self._shards = shards
+        self._ring = HashRing(shards)
+        self._journal = journal
+        self._updates: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        """Subscribes to updates of all shards, waits until they're running.
+
+        Updates published before a subscription reaches a shard aren't sent
+        to it, so no stream can start before all subscriptions are in place.
+        """
+        if self._updates is not None:
+            return
+
+        subscriber = self._context.socket(zmq.SUB)
+        subscriber.setsockopt(zmq.SUBSCRIBE, b"")
+        for shard in range(self._shards):
+            subscriber.connect(_feed_address(self._ipc_dir, shard))
+        deadline = time.monotonic() + self._timeout
+        for _shard in range(self._shards):
+            if not await subscriber.poll(max(deadline - time.monotonic(), 0) * 1000):
+                subscriber.close(linger=0)
+                raise EngineUnavailable(
+                    f"Not all {self._shards} shards in {self._ipc_dir} are running"
+                )
+            await subscriber.recv()
+        self._updates = asyncio.create_task(self._receive_updates(subscriber))
+
+    async def close(self) -> None:
+        """Disconnects, shards keep running for other workers."""
+        if self._updates is not None:
+            self._updates.cancel()
+            self._updates = None
+        self._disconnect()
+
+    def clear(self) -> None:
+        context = zmq.Context()
+        for shard in range(self._shards):
+            socket = context.socket(zmq.REQ)
+            socket.connect(_address(self._ipc_dir, shard))
+            socket.send_pyobj((None, "clear", ()))
+            socket.recv_pyobj()
+            socket.close(linger=0)
+        context.term()
+        if self._journal is not None:
+            self._journal.clear()
+
+    def _endpoint(self, market: "Market") -> str:
+        return _address(self._ipc_dir, self._ring.owner(str(market)))
+
+    def _message(self, market: "Market", command: str, args: tuple) -> tuple:
+        return market, command, args
+
+    def _alive(self, market: "Market") -> bool:
+        sent_at = self._sent_at.get(market)
+        return sent_at is None or time.monotonic() - sent_at <= self._timeout
+
+    async def _receive_updates(self, subscriber: zmq.asyncio.Socket) -> None:
+        try:
+            while True:
+                message = await subscriber.recv()
+                if message == SUBSCRIBED:
+                    # a restarted shard
+                    continue
+                market, update = pickle.loads(message)
+                self._feed.publish(market, update)
+        finally:
+            subscriber.close(linger=0)
@@ -0,0 +1,267 @@
+"""Engine running every market in its own process, talking REQ/REP over ZeroMQ.
+
+Each engine process is the single writer of one order book, so matching on one
+market never delays another one and markets spread over all available cores.
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from typing import TYPE_CHECKING, Any, Callable
+
+import zmq
+import zmq.asyncio
+
+from mbex import auth
+from mbex.trading.book import NewOrder, Order, OrderBook, OrderId, Side, Trade
+from mbex.trading.engine import (
+    EngineFailed,
+    EngineUnavailable,
+    Resting,
+    depth_snapshot,
+    resting_totals,
+    sequenced_depth,
+)
+from mbex.trading.feed import Feed
+from mbex.trading.journal import JournalSettings
+
+if TYPE_CHECKING:
+    from mbex.trading import Market
+
+# [s] between checks that an engine running a command is still alive
+ALIVE_CHECK_INTERVAL = 0.5
+
+
+def _loaded(book: OrderBook) -> None:
+    """Replies as soon as the process has loaded its book."""
+
+
+COMMANDS: dict[str, Callable[..., Any]] = {
+    "place": OrderBook.place,
+    "place_many": OrderBook.place_many,
+    "cancel": OrderBook.cancel,
+    "cancel_many": OrderBook.cancel_many,
+    "cancel_all": OrderBook.cancel_all,
+    "depth": depth_snapshot,
+    "sequenced_depth": sequenced_depth,
+    "resting": resting_totals,
+    "open": _loaded,
+}
+
+
+def serve(address: str, market: "Market", journal: JournalSettings | None) -> None:
+    """Main loop of an engine process."""
+    book = OrderBook(market) if journal is None else journal.open_book(market)
+
+    context = zmq.Context()
+    socket = context.socket(zmq.REP)
+    socket.bind(address)
+    while True:
+        command, args = socket.recv_pyobj()
+        if command == "close":
+            if book.journal is not None:
+                book.journal.close()
+            socket.send_pyobj((True, None, None))
+            return
+
+        sequence = book.sequence
+        try:
+            result = COMMANDS[command](book, *args)
+        except Exception as exc:
+            socket.send_pyobj((False, exc, None))
+        else:
+            # market data is published by the API process, ship what has changed
+            update = book.last_update if book.sequence != sequence else None
+            socket.send_pyobj((True, result, update))
+
+
+class ZmqClient:
+    """Engine whose books live in other processes, asked over ZeroMQ REQ sockets.
+
+    Subclasses tell where the book of a market is and whether its process is
+    still alive.
+    """
+
+    def __init__(self, feed: Feed, timeout: float) -> None:
+        self._feed = feed
+        self._timeout = timeout
+        self._context = zmq.asyncio.Context()
+        # REQ sockets allow only one request in flight, hence a socket and a lock
+        # per market, so markets don't wait for each other
+        self._sockets: dict["Market", zmq.asyncio.Socket] = {}
+        self._locks: defaultdict["Market", asyncio.Lock] = defaultdict(asyncio.Lock)
+        # when the command waiting for a reply was sent, by market
+        self._sent_at: dict["Market", float] = {}
+
+    async def place(
+        self,
+        market: "Market",
+        side: Side,
+        price: int,
+        volume: int,
+        user_id: auth.UserId,
+    ) -> tuple[OrderId, list[Trade]]:
+        return await self._request(market, "place", side, price, volume, user_id)
+
+    async def place_many(
+        self, market: "Market", orders: list[NewOrder], user_id: auth.UserId
+    ) -> tuple[list[OrderId], list[Trade]]:
+        return await self._request(market, "place_many", orders, user_id)
+
+    async def cancel(
+        self, market: "Market", user_id: auth.UserId, order_id: OrderId
+    ) -> Order:
+        return await self._request(market, "cancel", user_id, order_id)
+
+    async def cancel_many(
+        self, market: "Market", user_id: auth.UserId, order_ids: list[OrderId]
+    ) -> list[Order]:
+        return await self._request(market, "cancel_many", user_id, order_ids)
+
+    async def cancel_all(self, market: "Market", user_id: auth.UserId) -> list[Order]:
+        return await self._request(market, "cancel_all", user_id)
+
+    async def depth(self, market: "Market", max_levels: int | None = None) -> bytes:
+        return await self._request(market, "depth", max_levels)
+
+    async def sequenced_depth(self, market: "Market") -> tuple[int, bytes]:
+        return await self._request(market, "sequenced_depth")
+
+    async def resting(self, market: "Market") -> Resting:
+        return await self._request(market, "resting")
+
+    async def open(self, market: "Market") -> None:
+        await self._request(market, "open")
+
+    def _endpoint(self, market: "Market") -> str:
+        """Address of the process with the book of the market."""
+        raise NotImplementedError
+
+    def _message(self, market: "Market", command: str, args: tuple) -> tuple:
+        return command, args
+
+    def _alive(self, market: "Market") -> bool:
+        """Whether the process with the book of the market is still running."""
+        raise NotImplementedError
+
+    def _disconnect(self) -> None:
+        for socket in self._sockets.values():
+            socket.close(linger=0)
+        self._sockets.clear()
+        self._locks.clear()
+        self._sent_at.clear()
+
+    async def _request(self, market: "Market", command: str, *args: Any) -> Any:
+        # a caller cancelled between send and receive would leave the REQ socket
+        # waiting for a reply nobody reads, unable to send anything else
+        ok, result = await asyncio.shield(
+            self._exchange(market, self._message(market, command, args))
+        )
+        if not ok:
+            raise result
+        return result
+
+    async def _exchange(self, market: "Market", message: tuple) -> tuple[bool, Any]:
+        sent_at = self._sent_at.get(market)
+        if sent_at is not None and time.monotonic() - sent_at > self._timeout:
+            # rather than queueing up behind a command that may never finish
+            raise EngineUnavailable(f"The engine of {market} is not responding")
+
+        async with self._locks[market]:
+            if not self._alive(market):
+                raise EngineUnavailable(f"The engine of {market} has stopped")
+            socket = self._socket(market)
+            await socket.send_pyobj(message)
+            self._sent_at[market] = time.monotonic()
+            try:
+                # the command has been sent, so its reply is waited for however
+                # long it takes, unless the engine dies - then it's lost
+                while not await socket.poll(ALIVE_CHECK_INTERVAL * 1000):
+                    if not self._alive(market):
+                        # a late reply would be read as the one to the next command
+                        socket.close(linger=0)
+                        del self._sockets[market]
+                        raise EngineFailed(
+                            f"The engine of {market} has stopped running a command"
+                        )
+            finally:
+                del self._sent_at[market]
+            ok, result, update = await socket.recv_pyobj()
+
+        if update is not None:
+            self._feed.publish(market, update)
+        return ok, result
+
+    def _socket(self, market: "Market") -> zmq.asyncio.Socket:
+        try:
+            return self._sockets[market]
+        except KeyError:
+            pass
+
+        socket = self._sockets[market] = self._context.socket(zmq.REQ)
+        socket.connect(self._endpoint(market))
+        return socket
+
+
+class ZmqEngine(ZmqClient):
+    def __init__(
+        self,
+        ipc_dir: str,
+        feed: Feed,
+        journal: JournalSettings | None = None,
+        timeout: float = 30,
+    ) -> None:
+        super().__init__(feed, timeout)
+        self._ipc_dir = ipc_dir
+        self._journal = journal
+        self._processes: dict["Market", multiprocessing.Process] = {}
+        # markets whose engine died, a new one wouldn't know their resting orders
+        self._failed: set["Market"] = set()
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        for market, process in list(self._processes.items()):
+            if process.is_alive():
+                await self._request(market, "close")
+        for process in self._processes.values():
+            process.join()
+        self._stop()
+
+    def clear(self) -> None:
+        for process in self._processes.values():
+            process.terminate()
+            process.join()
+        self._stop()
+        if self._journal is not None:
+            self._journal.clear()
+
+    def _stop(self) -> None:
+        self._disconnect()
+        self._processes.clear()
+        self._failed.clear()
+
+    def _endpoint(self, market: "Market") -> str:
+        # engines are private to this API process, hence pid in the endpoint
+        address = f"ipc://{self._ipc_dir}/mbex-engine-{os.getpid()}-{market}"
+        if market not in self._processes:
+            process = multiprocessing.get_context("spawn").Process(
+                target=serve, args=(address, market, self._journal), daemon=True
+            )
+            process.start()
+            self._processes[market] = process
+        return address
+
+    def _alive(self, market: "Market") -> bool:
+        """False for good once the engine of the market has died.
+
+        It isn't started again: funds stay held for orders of its book, which
+        a new engine wouldn't have, so the market is out of service instead.
+        """
+        process = self._processes.get(market)
+        if market in self._failed or (process is not None and not process.is_alive()):
+            self._failed.add(market)
+            return False
+        return True
@@ -1,62 +1,106 @@
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
+from typing import Mapping
 
-from mbex import redis
+from mbex import config, metrics
 from mbex.auth import UserId
+from mbex.wallets.ledger import Ledger, MemoryLedger, StorageLedger
+from mbex.wallets.storage import (  # noqa: F401
+    CurrencyCode,
+    MemoryStorage,
+    NotEnough,
+    RedisStorage,
+    Storage,
+    Units,
+)
+
+# Balances are integer numbers of the smallest unit, so storage can change them
+# atomically, e.g. Redis with INCRBY/DECRBY. Decimals are used only at the API
+# boundary. Funds of resting orders are held by the ledger.
+DECIMAL_PLACES = 8
+UNIT = Decimal(1).scaleb(-DECIMAL_PLACES)
+
+
+class InvalidAmount(ValueError):
+    pass
 
-CurrencyCode = str
-REDIS_KEY_TPL = "balance_{user_id}_{currency_code}"
 
+def to_units(amount: Decimal) -> Units:
+    try:
+        units, remainder = divmod(amount, UNIT)
+    except InvalidOperation:
+        # the quotient has more digits than the decimal context's precision
+        raise InvalidAmount("Amount is too large") from None
+    if remainder:
+        raise InvalidAmount(f"Amount can't be more precise than {UNIT:f}")
+    if units <= 0:
+        raise InvalidAmount("Amount must be positive")
+    return int(units)
 
-async def clear() -> None:
-    async with redis.conn() as conn:
-        keys = await conn.keys("balance_*")
-        if keys:
-            await conn.delete(*keys)
 
+def from_units(units: Units) -> Decimal:
+    return Decimal(units).scaleb(-DECIMAL_PLACES).normalize()
 
-async def balance(user_id: UserId, currency_code: CurrencyCode) -> Decimal:
-    key = REDIS_KEY_TPL.format(user_id=user_id, currency_code=currency_code)
-    async with redis.conn() as conn:
-        raw = await conn.get(key)
 
-    if raw:
-        return Decimal(raw.decode())
+def _create_storage(kind: str) -> Storage:
+    if kind == "redis":
+        return RedisStorage()
+    elif kind == "memory":
+        return MemoryStorage()
     else:
-        return Decimal("0")
+        raise ValueError(f"Unknown wallets storage: {kind}")
 
 
-async def credit(user_id: UserId, currency_code: CurrencyCode, amount: Decimal) -> None:
-    key = REDIS_KEY_TPL.format(user_id=user_id, currency_code=currency_code)
-    async with redis.conn() as conn:
-        async with conn.lock(key + "_LOCK"):
-            raw = await conn.get(key)
+def _create_ledger(kind: str, storage: Storage) -> Ledger:
+    if kind == "memory":
+        return MemoryLedger(storage)
+    elif kind == "storage":
+        return StorageLedger(storage)
+    else:
+        raise ValueError(f"Unknown wallets holds: {kind}")
 
-            if raw:
-                balance = Decimal(raw.decode())
-            else:
-                balance = Decimal("0")
 
-            new_balance = balance + amount
-            await conn.set(key, str(new_balance))
+storage = _create_storage(config.WALLETS_STORAGE)
+ledger = _create_ledger(config.WALLETS_HOLDS, storage)
 
+# (user, currency) -> units
+Amounts = Mapping[tuple[UserId, CurrencyCode], Units]
+
+
+async def clear() -> None:
+    await ledger.clear()
+
+
+async def balance(user_id: UserId, currency_code: CurrencyCode) -> Units:
+    """What's available, i.e. not held by resting orders."""
+    with metrics.phase("wallets"):
+        return await ledger.available(user_id, currency_code)
+
+
+async def credit(user_id: UserId, currency_code: CurrencyCode, amount: Units) -> None:
+    with metrics.phase("wallets"):
+        await ledger.credit(user_id, currency_code, amount)
+
+
+async def hold(amounts: Amounts) -> None:
+    """Holds all amounts for resting orders or, raising NotEnough, none of them."""
+    with metrics.phase("wallets"):
+        await ledger.hold(amounts)
+
+
+async def release(amounts: Amounts) -> None:
+    """Makes held amounts available again."""
+    with metrics.phase("wallets"):
+        await ledger.release(amounts)
 
-class NotEnough(Exception):
-    pass
 
+def restore_holds(amounts: Amounts) -> None:
+    ledger.restore_holds(amounts)
 
-async def debit(user_id: UserId, currency_code: CurrencyCode, amount: Decimal) -> None:
-    key = REDIS_KEY_TPL.format(user_id=user_id, currency_code=currency_code)
-    async with redis.conn() as conn:
-        async with conn.lock(key + "_LOCK"):
-            raw = await conn.get(key)
 
-            if raw:
-                balance = Decimal(raw.decode())
-            else:
-                balance = Decimal("0")
+async def settle(taken: Amounts, released: Amounts, credits: Amounts) -> None:
+    """Takes held amounts out of balances, releases others and credits the rest.
 
-            if amount > balance:
-                raise NotEnough
-            else:
-                new_balance = balance - amount
-                await conn.set(key, str(new_balance))
+    All in one transaction.
+    """
+    with metrics.phase("wallets"):
+        await ledger.settle(taken, released, credits)
@@ -0,0 +1,183 @@
+import asyncio
+from collections import defaultdict
+from typing import Iterable, Mapping, Protocol
+
+from mbex.auth import UserId
+from mbex.wallets.storage import CurrencyCode, NotEnough, Storage, Units
+
+Key = tuple[UserId, CurrencyCode]
+
+
+class Ledger(Protocol):
+    """Balances available to users, i.e. not held by their resting orders."""
+
+    async def available(self, user_id: UserId, currency_code: CurrencyCode) -> Units:
+        ...
+
+    async def credit(
+        self, user_id: UserId, currency_code: CurrencyCode, amount: Units
+    ) -> None:
+        ...
+
+    async def hold(self, amounts: Mapping[Key, Units]) -> None:
+        """Holds all amounts or, raising NotEnough, none of them."""
+
+    def restore_holds(self, amounts: Mapping[Key, Units]) -> None:
+        """Holds funds of orders already resting in books, without checking."""
+
+    async def release(self, amounts: Mapping[Key, Units]) -> None:
+        ...
+
+    async def settle(
+        self,
+        taken: Mapping[Key, Units],
+        released: Mapping[Key, Units],
+        credits: Mapping[Key, Units],
+    ) -> None:
+        """Takes and releases held amounts and credits others, in one write."""
+
+    async def clear(self) -> None:
+        ...
+
+
+class MemoryLedger:
+    """Balances as kept in storage, minus funds held by resting orders.
+
+    Holds live only here, in memory. Storage sees deposits and what actually
+    trades, at settlement, so placing and cancelling an order that doesn't
+    trade never waits for it - once the balance has been read.
+
+    Each balance is read from storage once and then kept up to date by writes
+    of this ledger, so all changes of balances have to go through one ledger,
+    i.e. one API process.
+    """
+
+    def __init__(self, storage: Storage) -> None:
+        self._storage = storage
+        self._totals: dict[Key, Units] = {}
+        self._held: defaultdict[Key, Units] = defaultdict(int)
+        # reads of totals in flight, shared by everyone waiting for the same one
+        self._loading: dict[Key, asyncio.Future] = {}
+
+    async def available(self, user_id: UserId, currency_code: CurrencyCode) -> Units:
+        key = (user_id, currency_code)
+        await self._load([key])
+        return self._totals[key] - self._held.get(key, 0)
+
+    async def credit(
+        self, user_id: UserId, currency_code: CurrencyCode, amount: Units
+    ) -> None:
+        key = (user_id, currency_code)
+        await self._load([key])
+        await self._storage.credit(user_id, currency_code, amount)
+        self._totals[key] += amount
+
+    async def hold(self, amounts: Mapping[Key, Units]) -> None:
+        await self._load(amounts)
+        for key, amount in amounts.items():
+            if self._totals[key] - self._held.get(key, 0) < amount:
+                raise NotEnough
+        for key, amount in amounts.items():
+            self._held[key] += amount
+
+    def restore_holds(self, amounts: Mapping[Key, Units]) -> None:
+        for key, amount in amounts.items():
+            self._held[key] += amount
+
+    async def release(self, amounts: Mapping[Key, Units]) -> None:
+        self._release(amounts)
+
+    async def settle(
+        self,
+        taken: Mapping[Key, Units],
+        released: Mapping[Key, Units],
+        credits: Mapping[Key, Units],
+    ) -> None:
+        self._release(released)
+        deltas: defaultdict[Key, Units] = defaultdict(int)
+        for key, amount in credits.items():
+            deltas[key] += amount
+        for key, amount in taken.items():
+            deltas[key] -= amount
+        if not deltas:
+            return
+
+        await self._load(deltas)
+        await self._storage.credit_many(deltas)
+        for key, delta in deltas.items():
+            self._totals[key] += delta
+        self._release(taken)
+
+    async def clear(self) -> None:
+        self._totals.clear()
+        self._held.clear()
+        await self._storage.clear()
+
+    def _release(self, amounts: Mapping[Key, Units]) -> None:
+        for key, amount in amounts.items():
+            self._held[key] -= amount
+            if not self._held[key]:
+                del self._held[key]
+
+    async def _load(self, keys: Iterable[Key]) -> None:
+        for key in keys:
+            if key in self._totals:
+                continue
+
+            loading = self._loading.get(key)
+            if loading is None:
+                loading = self._loading[key] = asyncio.ensure_future(
+                    self._storage.balance(*key)
+                )
+            try:
+                total = await loading
+            finally:
+                if self._loading.get(key) is loading:
+                    del self._loading[key]
+            # whoever got it first may have already changed it
+            self._totals.setdefault(key, total)
+
+
+class StorageLedger:
+    """Holds are taken out of balances in storage, visible to all API processes.
+
+    Costs a storage write per place and per cancel, but nothing is kept in
+    memory, so any number of API processes can share the storage.
+    """
+
+    def __init__(self, storage: Storage) -> None:
+        self._storage = storage
+
+    async def available(self, user_id: UserId, currency_code: CurrencyCode) -> Units:
+        return await self._storage.balance(user_id, currency_code)
+
+    async def credit(
+        self, user_id: UserId, currency_code: CurrencyCode, amount: Units
+    ) -> None:
+        await self._storage.credit(user_id, currency_code, amount)
+
+    async def hold(self, amounts: Mapping[Key, Units]) -> None:
+        await self._storage.debit_many(amounts)
+
+    def restore_holds(self, amounts: Mapping[Key, Units]) -> None:
+        # still debited in storage
+        pass
+
+    async def release(self, amounts: Mapping[Key, Units]) -> None:
+        await self._storage.credit_many(amounts)
+
+    async def settle(
+        self,
+        taken: Mapping[Key, Units],
+        released: Mapping[Key, Units],
+        credits: Mapping[Key, Units],
+    ) -> None:
+        # taken amounts were debited already, when they were held
+        deltas: defaultdict[Key, Units] = defaultdict(int)
+        for amounts in (released, credits):
+            for key, amount in amounts.items():
+                deltas[key] += amount
+        await self._storage.credit_many(deltas)
+
+    async def clear(self) -> None:
+        await self._storage.clear()
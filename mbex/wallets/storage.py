@@ -0,0 +1,185 @@
+from collections import defaultdict
+from typing import Mapping, Protocol
+
+from mbex import redis
+from mbex.auth import UserId
+
+CurrencyCode = str
+Units = int
+
+REDIS_KEY_TPL = "balance_{user_id}_{currency_code}"
+
+# Takes the amount only if it doesn't make the balance negative.
+# Returns 1 when debited, 0 otherwise.
+DEBIT_SCRIPT = """
+local balance = redis.call('DECRBY', KEYS[1], ARGV[1])
+if balance < 0 then
+    redis.call('INCRBY', KEYS[1], ARGV[1])
+    return 0
+end
+return 1
+"""
+
+# Like DEBIT_SCRIPT, but takes ARGV[i] from KEYS[i] for every i, or nothing at all.
+DEBIT_MANY_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    if tonumber(redis.call('GET', key) or '0') < tonumber(ARGV[i]) then
+        return 0
+    end
+end
+for i, key in ipairs(KEYS) do
+    redis.call('DECRBY', key, ARGV[i])
+end
+return 1
+"""
+
+
+class NotEnough(Exception):
+    pass
+
+
+class Storage(Protocol):
+    """Keeps balances. Every change of a single balance is atomic."""
+
+    async def balance(self, user_id: UserId, currency_code: CurrencyCode) -> Units:
+        ...
+
+    async def credit(
+        self, user_id: UserId, currency_code: CurrencyCode, amount: Units
+    ) -> None:
+        ...
+
+    async def credit_many(
+        self, amounts: Mapping[tuple[UserId, CurrencyCode], Units]
+    ) -> None:
+        """Credits many balances at once, all or none of them."""
+
+    async def debit(
+        self, user_id: UserId, currency_code: CurrencyCode, amount: Units
+    ) -> None:
+        """Raises NotEnough, leaving the balance untouched, if it's below amount."""
+
+    async def debit_many(
+        self, amounts: Mapping[tuple[UserId, CurrencyCode], Units]
+    ) -> None:
+        """Debits all balances or, raising NotEnough, none of them."""
+
+    async def clear(self) -> None:
+        ...
+
+
+class RedisStorage:
+    """Balances shared by all API processes, one Redis key per balance."""
+
+    async def balance(self, user_id: UserId, currency_code: CurrencyCode) -> Units:
+        key = REDIS_KEY_TPL.format(user_id=user_id, currency_code=currency_code)
+        async with redis.conn() as conn:
+            raw = await conn.get(key)
+
+        if raw:
+            return int(raw)
+        else:
+            return 0
+
+    async def credit(
+        self, user_id: UserId, currency_code: CurrencyCode, amount: Units
+    ) -> None:
+        key = REDIS_KEY_TPL.format(user_id=user_id, currency_code=currency_code)
+        async with redis.conn() as conn:
+            await conn.incrby(key, amount)
+
+    async def credit_many(
+        self, amounts: Mapping[tuple[UserId, CurrencyCode], Units]
+    ) -> None:
+        # one transaction and one round-trip
+        if not amounts:
+            return
+
+        async with redis.conn() as conn:
+            async with conn.pipeline(transaction=True) as pipe:
+                for (user_id, currency_code), amount in amounts.items():
+                    key = REDIS_KEY_TPL.format(
+                        user_id=user_id, currency_code=currency_code
+                    )
+                    pipe.incrby(key, amount)
+                await pipe.execute()
+
+    async def debit(
+        self, user_id: UserId, currency_code: CurrencyCode, amount: Units
+    ) -> None:
+        key = REDIS_KEY_TPL.format(user_id=user_id, currency_code=currency_code)
+        async with redis.conn() as conn:
+            debit_script = conn.register_script(DEBIT_SCRIPT)
+            debited = await debit_script(keys=[key], args=[amount])
+
+        if not debited:
+            raise NotEnough
+
+    async def debit_many(
+        self, amounts: Mapping[tuple[UserId, CurrencyCode], Units]
+    ) -> None:
+        if not amounts:
+            return
+
+        keys = [
+            REDIS_KEY_TPL.format(user_id=user_id, currency_code=currency_code)
+            for user_id, currency_code in amounts
+        ]
+        async with redis.conn() as conn:
+            debit_script = conn.register_script(DEBIT_MANY_SCRIPT)
+            debited = await debit_script(keys=keys, args=list(amounts.values()))
+
+        if not debited:
+            raise NotEnough
+
+    async def clear(self) -> None:
+        async with redis.conn() as conn:
+            keys = await conn.keys("balance_*")
+            if keys:
+                await conn.delete(*keys)
+
+
+class MemoryStorage:
+    """Balances in a dict of this process, lost on restart.
+
+    Methods never await, so each runs to completion without another coroutine
+    of the event loop in between - that's what makes them atomic, no locks.
+    Only for a single API process, every worker would have its own balances.
+    """
+
+    def __init__(self) -> None:
+        self._balances: dict[tuple[UserId, CurrencyCode], Units] = defaultdict(int)
+
+    async def balance(self, user_id: UserId, currency_code: CurrencyCode) -> Units:
+        return self._balances.get((user_id, currency_code), 0)
+
+    async def credit(
+        self, user_id: UserId, currency_code: CurrencyCode, amount: Units
+    ) -> None:
+        self._balances[(user_id, currency_code)] += amount
+
+    async def credit_many(
+        self, amounts: Mapping[tuple[UserId, CurrencyCode], Units]
+    ) -> None:
+        for key, amount in amounts.items():
+            self._balances[key] += amount
+
+    async def debit(
+        self, user_id: UserId, currency_code: CurrencyCode, amount: Units
+    ) -> None:
+        key = (user_id, currency_code)
+        if self._balances.get(key, 0) < amount:
+            raise NotEnough
+        self._balances[key] -= amount
+
+    async def debit_many(
+        self, amounts: Mapping[tuple[UserId, CurrencyCode], Units]
+    ) -> None:
+        for key, amount in amounts.items():
+            if self._balances.get(key, 0) < amount:
+                raise NotEnough
+        for key, amount in amounts.items():
+            self._balances[key] -= amount
+
+    async def clear(self) -> None:
+        self._balances.clear()
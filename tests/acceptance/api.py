@@ -67,6 +67,33 @@ class Api:
         assert response.status_code == 202
         return response.json()["order_id"]
 
+    def place_orders(self, orders: list[dict], market="ETH-BTC") -> list[OrderId]:
+        response = self._client.post(
+            f"trading/{market}/orders/batch",
+            headers=self._auth_header,
+            json={"orders": orders},
+        )
+        assert response.status_code == 202
+        return response.json()["order_ids"]
+
+    def cancel_orders(
+        self, order_ids: list[OrderId], market="ETH-BTC"
+    ) -> list[OrderId]:
+        response = self._client.post(
+            f"trading/{market}/orders/batch/cancel",
+            headers=self._auth_header,
+            json={"order_ids": order_ids},
+        )
+        assert response.status_code == 202
+        return response.json()["cancelled"]
+
+    def cancel_all_orders(self, market="ETH-BTC") -> list[OrderId]:
+        response = self._client.delete(
+            f"trading/{market}/orders", headers=self._auth_header
+        )
+        assert response.status_code == 202
+        return response.json()["cancelled"]
+
     def cancel_order(self, order_id: OrderId, market="ETH-BTC") -> None:
         response = self._client.delete(
             f"trading/{market}/orders/{order_id}",
@@ -75,7 +102,8 @@ class Api:
         response.raise_for_status()
         assert response.status_code == 202
 
-    def order_book(self, market="ETH-BTC") -> dict:
-        response = self._client.get(f"trading/{market}/order_book")
+    def order_book(self, market="ETH-BTC", depth: int | None = None) -> dict:
+        params = {} if depth is None else {"depth": depth}
+        response = self._client.get(f"trading/{market}/order_book", params=params)
         assert response.status_code == 200
         return response.json()
@@ -1,6 +1,12 @@
+import asyncio
+
 import pytest
 from fastapi.testclient import TestClient
 
+from mbex import migrate_balances, redis
+from mbex.wallets import RedisStorage
+from mbex.wallets.storage import REDIS_KEY_TPL
+
 pytestmark = pytest.mark.usefixtures("disable_password_hashing", "clear_all")
 
 
@@ -32,3 +38,54 @@ def test_balance_increases_after_depositing_some_crypto(
     )
     assert balance_response.status_code == 200
     assert balance_response.json() == {"balance": "1.00000001"}
+
+
+def test_cannot_deposit_less_than_smallest_unit(token: str, client: TestClient) -> None:
+    response = client.post(
+        "/wallets/balances/BTC/deposit",
+        headers={"Authorization": token},
+        json={"amount": "0.000000001"},
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {
+        "errors": ["Amount can't be more precise than 0.00000001"]
+    }
+
+
+@pytest.mark.parametrize("amount", ["1e25", "1e30"])
+def test_cannot_deposit_amount_too_large_for_decimal_precision(
+    token: str, client: TestClient, amount: str
+) -> None:
+    response = client.post(
+        "/wallets/balances/BTC/deposit",
+        headers={"Authorization": token},
+        json={"amount": amount},
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {"errors": ["Amount is too large"]}
+
+
+def test_balances_of_older_versions_are_converted_to_units_once() -> None:
+    async def migrate_twice() -> tuple[int, int, int, int]:
+        async with redis.conn() as conn:
+            for currency_code, raw in [("BTC", "1.5"), ("ETH", "2")]:
+                key = REDIS_KEY_TPL.format(user_id="old", currency_code=currency_code)
+                await conn.set(key, raw)
+            try:
+                migrated = await migrate_balances.migrate()
+                migrated_again = await migrate_balances.migrate()
+            finally:
+                await conn.delete(migrate_balances.DONE_KEY)
+
+        storage = RedisStorage()
+        await storage.credit("old", "ETH", 1)
+        return (
+            migrated,
+            migrated_again,
+            await storage.balance("old", "BTC"),
+            await storage.balance("old", "ETH"),
+        )
+
+    assert asyncio.run(migrate_twice()) == (2, 0, 150_000_000, 200_000_001)
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from mbex import metrics
+from mbex.trading import Market, Side, market_from_str
+from mbex.trading.engine import LocalEngine
+from mbex.trading.feed import Feed
+from tests.conftest import StartSweep
+
+
+def test_commands_for_market_run_in_order_of_arrival_with_bounded_queue() -> None:
+    market = market_from_str("ETH-BTC")
+    engine = LocalEngine({}, Feed(max_pending=10), max_queued=2)
+    metrics.clear()
+
+    async def place_concurrently() -> list[int]:
+        results = await asyncio.gather(
+            *(engine.place(market, Side.bid, price, 1, "user") for price in range(50))
+        )
+        await engine.close()
+        return [order_id for order_id, _trades in results]
+
+    assert asyncio.run(place_concurrently()) == list(range(1, 51))
+    queue = metrics.engine_queues["ETH-BTC"]
+    assert queue.wait.count == 50
+    assert queue.depth.max <= 2
+
+
+@pytest.mark.parametrize("executor, responsive", [("loop", False), ("thread", True)])
+def test_event_loop_stays_responsive_while_matching_in_thread(
+    start_sweep: StartSweep, executor: str, responsive: bool
+) -> None:
+    market, other_market = market_from_str("ETH-BTC"), Market("LTC", "BTC")
+    engine = LocalEngine({}, Feed(max_pending=10), executor=executor)
+
+    async def other_market_answers_during_sweep() -> bool:
+        sweep = await start_sweep(market, engine)
+        await asyncio.sleep(0.01)
+        await engine.depth(other_market)
+        answered_first = not sweep.done()
+        await sweep
+        await engine.close()
+        return answered_first
+
+    assert asyncio.run(other_market_answers_during_sweep()) is responsive
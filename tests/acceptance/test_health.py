@@ -0,0 +1,14 @@
+from fastapi.testclient import TestClient
+
+from mbex.main import initialize
+
+
+def test_health_reports_redis_pool_of_running_app() -> None:
+    with TestClient(initialize()) as client:
+        response = client.get("/health")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["redis"] == "ok"
+    assert body["redis_pool"]["max_connections"] > 0
+    assert body["redis_pool"]["created"] >= 1
@@ -0,0 +1,194 @@
+import asyncio
+import os
+from decimal import Decimal
+from pathlib import Path
+from typing import Callable, Iterator
+
+import pytest
+
+from mbex import trading, wallets
+from mbex.trading import Market, OrderBook, Side, market_from_str
+from mbex.trading.engine import LocalEngine
+from mbex.trading.journal import JournalSettings, SizesChanged
+from mbex.wallets.ledger import MemoryLedger
+from tests.acceptance.api import Api
+
+pytestmark = pytest.mark.usefixtures("disable_password_hashing", "clear_all")
+
+Restart = Callable[..., None]
+
+
+@pytest.fixture()
+def restart(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[Restart]:
+    """Replaces the engine with a journaled one, again on every call.
+
+    Holds of resting orders are forgotten too, as they would be by a new process.
+    """
+    # snapshot every 3 commands, so restarts need both snapshot and journal
+    journal = JournalSettings(
+        directory=str(tmp_path), fsync_interval=0, snapshot_every=3
+    )
+    engines: list[LocalEngine] = []
+
+    def start(crash: bool = False) -> None:
+        if engines and crash:
+            # files are left as they are, without a final snapshot
+            for book in engines[-1]._books.values():
+                book.journal.close(snapshot=False)
+        elif engines:
+            asyncio.run(engines[-1].close())
+        engines.append(LocalEngine({}, trading.feed, journal=journal))
+        monkeypatch.setattr(trading, "engine", engines[-1])
+        monkeypatch.setattr(trading, "journal", journal)
+        monkeypatch.setattr(wallets, "ledger", MemoryLedger(wallets.storage))
+        asyncio.run(trading.startup())
+
+    start()
+    yield start
+    engines[-1].clear()
+
+
+@pytest.mark.parametrize("crash", [False, True])
+def test_order_book_survives_restart(api: Api, restart: Restart, crash: bool) -> None:
+    api.deposit(currency="BTC", amount=Decimal("10"))
+    api.deposit(currency="ETH", amount=Decimal("10"))
+    bid_id = api.bid(volume=Decimal("1"), price=Decimal("1"))
+    api.bid(volume=Decimal("2"), price=Decimal("2"))
+    api.ask(volume=Decimal("1"), price=Decimal("2"))
+    ask_id = api.ask(volume=Decimal("3"), price=Decimal("4"))
+    api.cancel_order(ask_id)
+    api.ask(volume=Decimal("0.5"), price=Decimal("3"))
+    batch_ids = api.place_orders(
+        [
+            {"volume": "1", "price": "0.5", "side": "bid"},
+            {"volume": "1", "price": "0.6", "side": "bid"},
+        ]
+    )
+    api.cancel_orders([batch_ids[0]])
+    order_book = api.order_book()
+    balances = api.balance(currency="BTC"), api.balance(currency="ETH")
+
+    restart(crash=crash)
+
+    assert api.order_book() == order_book
+    assert (api.balance(currency="BTC"), api.balance(currency="ETH")) == balances
+    api.cancel_order(bid_id)
+    new_bid_id = api.bid(volume=Decimal("1"), price=Decimal("1"))
+    assert int(new_bid_id) > int(batch_ids[-1])
+    assert api.order_book() == {
+        "asks": [{"price": "3", "volume": "0.5"}],
+        "bids": [
+            {"price": "2", "volume": "1"},
+            {"price": "1", "volume": "1"},
+            {"price": "0.6", "volume": "1"},
+        ],
+    }
+
+
+def test_book_of_market_no_longer_listed_is_left_alone(
+    api: Api, restart: Restart, tmp_path: Path, caplog: pytest.LogCaptureFixture
+) -> None:
+    journal = JournalSettings(
+        directory=str(tmp_path), fsync_interval=0, snapshot_every=100
+    )
+    book = journal.open_book(Market("DOGE", "BTC"))
+    book.place(Side.bid, 1, 1, "user")
+    book.journal.close()
+
+    restart()
+
+    assert "DOGE-BTC" in caplog.text
+    assert (tmp_path / "DOGE-BTC.snapshot").exists()
+    api.deposit(currency="BTC", amount=Decimal("1"))
+    api.bid(volume=Decimal("1"), price=Decimal("1"))
+
+
+def test_partially_written_last_line_is_dropped(
+    api: Api, restart: Restart, tmp_path: Path
+) -> None:
+    api.deposit(currency="BTC", amount=Decimal("10"))
+    api.bid(volume=Decimal("1"), price=Decimal("1"))
+    order_book = api.order_book()
+    restart(crash=True)
+    with (tmp_path / "ETH-BTC.journal").open("a") as journal:
+        journal.write("2\tp\t2\tbid")
+
+    restart(crash=True)
+
+    assert api.order_book() == order_book
+    api.bid(volume=Decimal("1"), price=Decimal("1"))
+    restart(crash=True)
+    assert api.order_book() == {
+        "asks": [],
+        "bids": [{"price": "1", "volume": "2"}],
+    }
+
+
+def test_snapshot_is_saved_in_background_and_journal_started_over(
+    tmp_path: Path,
+) -> None:
+    journal = JournalSettings(
+        directory=str(tmp_path), fsync_interval=0.01, snapshot_every=2
+    )
+    book = journal.open_book(market_from_str("ETH-BTC"))
+    for price in range(1, 4):
+        book.place(Side.bid, price, 1, "user")
+    # waits for the background snapshot, doesn't take another one
+    book.journal.close(snapshot=False)
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "ETH-BTC.journal",
+        "ETH-BTC.snapshot",
+    ]
+    # the line with tick and lot size, then the one after the snapshot
+    assert (tmp_path / "ETH-BTC.journal").read_text().count("\n") == 2
+    restored = journal.open_book(market_from_str("ETH-BTC"))
+    assert restored.dump() == book.dump()
+    restored.journal.close(snapshot=False)
+
+
+def test_journal_rotated_before_its_snapshot_was_saved_is_replayed(
+    tmp_path: Path,
+) -> None:
+    journal = JournalSettings(
+        directory=str(tmp_path), fsync_interval=0, snapshot_every=100
+    )
+    book = journal.open_book(market_from_str("ETH-BTC"))
+    book.place(Side.bid, 1, 1, "user")
+    book.place(Side.ask, 2, 1, "user")
+    # the process died after rotating the journal, before saving the snapshot
+    os.rename(tmp_path / "ETH-BTC.journal", tmp_path / "ETH-BTC.rotated")
+    book.journal.close(snapshot=False)
+
+    restored = journal.open_book(market_from_str("ETH-BTC"))
+
+    assert restored.dump() == book.dump()
+    assert not (tmp_path / "ETH-BTC.rotated").exists()
+    restored.journal.close(snapshot=False)
+
+
+@pytest.mark.parametrize("snapshot", [False, True])
+def test_book_saved_in_other_tick_size_is_not_loaded(
+    tmp_path: Path, snapshot: bool
+) -> None:
+    journal = JournalSettings(
+        directory=str(tmp_path), fsync_interval=0, snapshot_every=100
+    )
+    book = journal.open_book(Market("ETH", "BTC", tick_size=Decimal("0.01")))
+    book.place(Side.bid, 150, 1, "user")
+    book.journal.close(snapshot=snapshot)
+
+    with pytest.raises(SizesChanged):
+        journal.open_book(Market("ETH", "BTC", tick_size=Decimal("0.1")))
+
+
+def test_restored_book_cancels_all_orders_of_user_in_order_of_placing() -> None:
+    market = market_from_str("ETH-BTC")
+    book = OrderBook(market)
+    for price in (1, 3, 2):
+        book.place(Side.bid, price, 1, "user")
+
+    restored = OrderBook.restore(market, book.dump())
+
+    cancelled = restored.cancel_all("user")
+    assert [order.order_id for order in cancelled] == [1, 2, 3]
@@ -0,0 +1,56 @@
+from decimal import Decimal
+
+import pytest
+from fastapi.testclient import TestClient
+
+from mbex import trading
+from mbex.main import initialize
+from tests.acceptance.api import Api
+
+pytestmark = pytest.mark.usefixtures("disable_password_hashing", "clear_all")
+
+
+@pytest.fixture()
+def client() -> TestClient:
+    # one event loop for the stream and the requests changing the book
+    with TestClient(initialize()) as client:
+        yield client
+
+
+def test_stream_starts_with_snapshot_followed_by_updates(
+    api: Api, client: TestClient
+) -> None:
+    api.deposit(currency="ETH", amount=Decimal("2"))
+    api.deposit(currency="BTC", amount=Decimal("2"))
+    api.ask(volume=Decimal("1"), price=Decimal("2"), market="ETH-BTC")
+
+    with client.websocket_connect("/trading/ETH-BTC/stream") as websocket:
+        snapshot = websocket.receive_json()
+        api.bid(volume=Decimal("0.5"), price=Decimal("2"), market="ETH-BTC")
+        update = websocket.receive_json()
+
+    assert snapshot == {
+        "type": "snapshot",
+        "sequence": snapshot["sequence"],
+        "asks": [{"price": "2", "volume": "1"}],
+        "bids": [],
+    }
+    assert update == {
+        "type": "update",
+        "sequence": snapshot["sequence"] + 1,
+        "asks": [{"price": "2", "volume": "0.5"}],
+        "bids": [],
+        "trades": [{"price": "2", "volume": "0.5"}],
+    }
+
+
+def test_disconnecting_from_stream_removes_subscription() -> None:
+    market = trading.market_from_str("ETH-BTC")
+    # without the client's own event loop, leaving the stream waits until it ends
+    client = TestClient(initialize())
+
+    with client.websocket_connect("/trading/ETH-BTC/stream") as websocket:
+        websocket.receive_json()
+        assert trading.feed._subscriptions[market]
+
+    assert market not in trading.feed._subscriptions
@@ -0,0 +1,90 @@
+from decimal import Decimal
+
+import pytest
+from fastapi.testclient import TestClient
+
+from mbex import auth, config
+from mbex.main import initialize
+from tests.acceptance.api import Api
+
+pytestmark = pytest.mark.usefixtures("disable_password_hashing", "clear_all")
+
+
+def test_latencies_are_reported_per_route_and_phase(
+    api: Api, client: TestClient
+) -> None:
+    assert client.delete("/metrics").status_code == 204
+    api.deposit(currency="BTC", amount=Decimal("1"))
+    order_id = api.bid(volume=Decimal("0.1"), price=Decimal(1))
+    api.bid(volume=Decimal("0.1"), price=Decimal(1))
+    api.cancel_order(order_id)
+    client.get("/no/such/route")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    routes = response.json()["requests"]
+    assert set(routes) >= {
+        "POST /wallets/balances/{currency}/deposit",
+        "POST /trading/{market}/orders",
+        "DELETE /trading/{market}/orders/{order_id}",
+        "GET unmatched",
+    }
+    place = routes["POST /trading/{market}/orders"]
+    assert place["count"] == 2
+    assert place["p50_us"] <= place["p99_us"] <= place["max_us"]
+    assert set(place["phases"]) == {"auth", "wallets", "matching", "other"}
+    assert place["phases"]["matching"]["count"] == 2
+
+
+def test_sampled_slow_requests_are_profiled(
+    token: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(config, "SLOW_REQUEST_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(config, "SLOW_REQUEST_THRESHOLD", 0.0)
+    api = Api(client=TestClient(initialize()), token=token)
+    api.deposit(currency="BTC", amount=Decimal("1"))
+
+    api.bid(volume=Decimal("0.1"), price=Decimal(1))
+    response = api._client.get("/profiling/slow")
+
+    assert response.status_code == 200
+    [profile] = [
+        profile
+        for profile in response.json()
+        if profile["route"] == "POST /trading/{market}/orders"
+    ]
+    assert profile["path"] == "/trading/ETH-BTC/orders"
+    assert "Duration" in profile["profile"]
+
+
+def test_password_hashing_pool_is_reported(client: TestClient) -> None:
+    before = client.get("/metrics").json()["password_hashing"]
+
+    client.post(
+        "/auth/registration",
+        json={"username": "hashed+user@enforcer.pl", "password": "123"},
+    )
+
+    after = client.get("/metrics").json()["password_hashing"]
+    assert after == {
+        "workers": config.PASSWORD_HASHING_WORKERS,
+        "in_progress": 0,
+        "queued": 0,
+        "completed": before["completed"] + 1,
+    }
+
+
+def test_token_cache_hits_and_misses_are_reported(api: Api, client: TestClient) -> None:
+    auth.token_cache.clear()
+    before = client.get("/metrics").json()["token_cache"]
+
+    api.balance(currency="BTC")
+    api.balance(currency="BTC")
+
+    after = client.get("/metrics").json()["token_cache"]
+    assert after == {
+        "size": 1,
+        "hits": before["hits"] + 1,
+        "misses": before["misses"] + 1,
+    }
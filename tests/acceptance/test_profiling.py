@@ -0,0 +1,45 @@
+import json
+import pstats
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+def test_yappi_profile_is_returned_as_pstats_file(client: TestClient, tmp_path) -> None:
+    assert client.post("/profiling/enable", params={"clock": "cpu"}).status_code == 204
+    client.get("/trading/ETH-BTC/order_book")
+
+    response = client.post("/profiling/disable", params={"format": "pstats"})
+
+    assert response.status_code == 200
+    assert response.headers["content-disposition"].endswith('.pstats"')
+    path = tmp_path / "profile.pstats"
+    path.write_bytes(response.content)
+    assert pstats.Stats(str(path)).total_calls > 0
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"profiler": "yappi", "format": "callgrind"},
+        {"profiler": "pyinstrument", "format": "speedscope"},
+    ],
+)
+def test_capture_profiles_for_given_duration(client: TestClient, params: dict) -> None:
+    response = client.post("/profiling/capture", params={"seconds": 0.05, **params})
+
+    assert response.status_code == 200
+    if params["format"] == "speedscope":
+        assert "speedscope" in json.loads(response.content)["$schema"]
+    else:
+        assert response.content.startswith(b"version: 1")
+
+
+def test_format_the_profiler_cannot_output_is_rejected(client: TestClient) -> None:
+    response = client.post(
+        "/profiling/capture",
+        params={"seconds": 0.05, "profiler": "pyinstrument", "format": "pstats"},
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {"errors": ["pyinstrument can't output pstats"]}
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import multiprocessing
+from contextlib import suppress
+from decimal import Decimal
+from pathlib import Path
+from typing import Callable, Iterator
+
+import pytest
+from fastapi.testclient import TestClient
+
+from mbex import trading
+from mbex.trading import EngineFailed, EngineUnavailable, Side, market_from_str, shards
+from mbex.trading.feed import Feed
+from mbex.trading.shards import HashRing, ShardedEngine
+from tests.acceptance.api import Api
+from tests.conftest import StartSweep
+
+pytestmark = pytest.mark.usefixtures("disable_password_hashing", "clear_all")
+
+SHARDS = 2
+Worker = Callable[[], ShardedEngine]
+
+
+@pytest.fixture()
+def worker(tmp_path: Path) -> Iterator[Worker]:
+    """Runs shards and makes clients of them, like every API worker has one."""
+    ipc_dir = str(tmp_path)
+    processes = shards.start(ipc_dir, SHARDS, journal=None)
+
+    def connect() -> ShardedEngine:
+        return ShardedEngine(ipc_dir, SHARDS, feed=Feed(max_pending=10))
+
+    yield connect
+    shards.stop(ipc_dir, processes)
+
+
+def test_orders_placed_through_different_workers_are_matched(
+    client: TestClient,
+    token: str,
+    other_token: str,
+    worker: Worker,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    seller = Api(client=client, token=token)
+    buyer = Api(client=client, token=other_token)
+    seller.deposit(currency="ETH", amount=Decimal("1"))
+    buyer.deposit(currency="BTC", amount=Decimal("2"))
+
+    monkeypatch.setattr(trading, "engine", worker())
+    seller.ask(volume=Decimal("1"), price=Decimal("2"))
+    monkeypatch.setattr(trading, "engine", worker())
+    buyer.bid(volume=Decimal("1"), price=Decimal("2"))
+
+    assert buyer.balance(currency="ETH") == Decimal("1")
+    assert seller.balance(currency="BTC") == Decimal("2")
+    assert seller.order_book() == {"asks": [], "bids": []}
+
+
+def test_workers_stream_updates_made_through_other_workers(worker: Worker) -> None:
+    market = market_from_str("ETH-BTC")
+    placing, streaming = worker(), worker()
+
+    async def stream_one_update() -> int:
+        await streaming.start()
+        with streaming._feed.subscribe(market) as subscription:
+            sequence, _snapshot = await streaming.sequenced_depth(market)
+            await placing.place(market, Side.bid, 1, 1, "user")
+            update_sequence, _message = await asyncio.wait_for(
+                subscription.get(), timeout=5
+            )
+        await streaming.close()
+        await placing.close()
+        return update_sequence - sequence
+
+    assert asyncio.run(stream_one_update()) == 1
+
+
+def test_request_cancelled_while_matching_still_completes(
+    worker: Worker, start_sweep: StartSweep
+) -> None:
+    market = market_from_str("ETH-BTC")
+    engine = worker()
+
+    async def cancel_sweep() -> dict:
+        sweep = await start_sweep(market, engine)
+        await asyncio.sleep(0.05)
+        sweep.cancel()
+        with suppress(asyncio.CancelledError):
+            await sweep
+        depth = json.loads(await engine.depth(market))
+        await engine.close()
+        return depth
+
+    assert asyncio.run(cancel_sweep()) == {"asks": [], "bids": []}
+
+
+def test_shard_that_died_fails_commands_until_it_is_started_again(
+    tmp_path: Path,
+) -> None:
+    market = market_from_str("ETH-BTC")
+    ipc_dir = str(tmp_path)
+    processes = shards.start(ipc_dir, SHARDS, journal=None)
+    engine = ShardedEngine(ipc_dir, SHARDS, feed=Feed(max_pending=10), timeout=5)
+    owner = HashRing(SHARDS).owner(str(market))
+
+    async def kill_shard() -> dict:
+        await engine.place(market, Side.bid, 1, 1, "buyer")
+        processes[owner].kill()
+        processes[owner].join()
+        with pytest.raises(EngineFailed):
+            await engine.depth(market)
+        processes[owner] = multiprocessing.get_context("spawn").Process(
+            target=shards.serve, args=(ipc_dir, owner, None), daemon=True
+        )
+        processes[owner].start()
+        depth = json.loads(await engine.depth(market))
+        await engine.close()
+        return depth
+
+    try:
+        # the book wasn't journaled, so it's gone with the shard
+        assert asyncio.run(kill_shard()) == {"asks": [], "bids": []}
+    finally:
+        shards.stop(ipc_dir, processes)
+
+
+def test_worker_doesnt_wait_forever_for_shards_that_arent_running(
+    tmp_path: Path,
+) -> None:
+    engine = ShardedEngine(
+        str(tmp_path), SHARDS, feed=Feed(max_pending=10), timeout=0.1
+    )
+
+    with pytest.raises(EngineUnavailable):
+        asyncio.run(engine.start())
+
+
+def test_adding_shard_moves_only_part_of_markets() -> None:
+    markets = [f"COIN{n}-BTC" for n in range(1000)]
+    before = {market: HashRing(4).owner(market) for market in markets}
+    after = {market: HashRing(5).owner(market) for market in markets}
+
+    assert set(before.values()) == set(range(4))
+    moved = [market for market in markets if before[market] != after[market]]
+    assert all(after[market] == 4 for market in moved)
+    assert 100 < len(moved) < 300
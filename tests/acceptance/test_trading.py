@@ -1,19 +1,23 @@
+import asyncio
+from contextlib import suppress
 from decimal import Decimal
+from unittest.mock import DEFAULT, patch
 
 import pytest
 from fastapi.testclient import TestClient
 from requests import HTTPError
 
+from mbex import config, trading, wallets
+from mbex.trading import LocalEngine, Market, market_from_str, markets
+from mbex.trading.feed import Feed
+from mbex.wallets.ledger import MemoryLedger
+from mbex.wallets.storage import MemoryStorage
 from tests.acceptance.api import Api
+from tests.conftest import StartSweep
 
 pytestmark = pytest.mark.usefixtures("disable_password_hashing", "clear_all")
 
 
-@pytest.fixture()
-def api(token: str, client: TestClient) -> Api:
-    return Api(client=client, token=token)
-
-
 def test_placing_bid_lowers_balance_and_makes_order_visible_in_order_book(
     api: Api,
 ) -> None:
@@ -140,3 +144,387 @@ def test_cant_cancel_not_existing_order(api: Api) -> None:
         assert exc.response.status_code == 404
     else:
         pytest.fail("Expected 404")
+
+
+def test_order_book_lists_levels_from_best_price(api: Api) -> None:
+    api.deposit(currency="ETH", amount=Decimal("5"))
+    api.deposit(currency="BTC", amount=Decimal("5"))
+    api.bid(volume=Decimal("0.2"), price=Decimal(1), market="ETH-BTC")
+    api.bid(volume=Decimal("0.2"), price=Decimal(2), market="ETH-BTC")
+    api.bid(volume=Decimal("0.1"), price=Decimal(2), market="ETH-BTC")
+    api.ask(volume=Decimal("0.2"), price=Decimal(4), market="ETH-BTC")
+    api.ask(volume=Decimal("0.2"), price=Decimal(3), market="ETH-BTC")
+
+    assert api.order_book(market="ETH-BTC") == {
+        "asks": [
+            {"price": "3", "volume": "0.2"},
+            {"price": "4", "volume": "0.2"},
+        ],
+        "bids": [
+            {"price": "2", "volume": "0.3"},
+            {"price": "1", "volume": "0.2"},
+        ],
+    }
+
+
+def test_order_book_shows_levels_changed_since_it_was_last_read(api: Api) -> None:
+    api.deposit(currency="BTC", amount=Decimal("5"))
+    api.bid(volume=Decimal("0.2"), price=Decimal(1), market="ETH-BTC")
+    api.bid(volume=Decimal("0.2"), price=Decimal(2), market="ETH-BTC")
+    api.order_book(market="ETH-BTC")
+
+    order_id = api.bid(volume=Decimal("0.1"), price=Decimal(2), market="ETH-BTC")
+    assert api.order_book(market="ETH-BTC")["bids"] == [
+        {"price": "2", "volume": "0.3"},
+        {"price": "1", "volume": "0.2"},
+    ]
+    api.cancel_order(order_id)
+    assert api.order_book(market="ETH-BTC")["bids"] == [
+        {"price": "2", "volume": "0.2"},
+        {"price": "1", "volume": "0.2"},
+    ]
+
+
+def test_cancelling_order_from_the_middle_of_a_price_level(api: Api) -> None:
+    api.deposit(currency="ETH", amount=Decimal("3"))
+    api.ask(volume=Decimal("1"), price=Decimal("2"), market="ETH-BTC")
+    order_id = api.ask(volume=Decimal("1"), price=Decimal("2"), market="ETH-BTC")
+    api.ask(volume=Decimal("1"), price=Decimal("2"), market="ETH-BTC")
+
+    api.cancel_order(order_id)
+
+    assert api.balance(currency="ETH") == Decimal("1")
+    assert api.order_book(market="ETH-BTC") == {
+        "asks": [{"price": "2", "volume": "2"}],
+        "bids": [],
+    }
+    with pytest.raises(HTTPError):
+        api.cancel_order(order_id)
+
+
+def test_order_exceeding_balance_is_rejected_without_touching_funds(
+    api: Api, client: TestClient
+) -> None:
+    api.deposit(currency="BTC", amount=Decimal("0.5"))
+
+    response = client.post(
+        "trading/ETH-BTC/orders",
+        headers={"Authorization": api._token},
+        json={"volume": "1", "price": "1", "side": "bid"},
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {"errors": ["Not enough funds"]}
+    assert api.balance(currency="BTC") == Decimal("0.5")
+    assert api.order_book(market="ETH-BTC") == {"asks": [], "bids": []}
+
+
+def test_in_memory_wallets_reject_order_exceeding_balance_the_same_way(
+    api: Api, client: TestClient
+) -> None:
+    with patch.object(wallets, "ledger", new=MemoryLedger(MemoryStorage())):
+        api.deposit(currency="BTC", amount=Decimal("0.5"))
+
+        response = client.post(
+            "trading/ETH-BTC/orders",
+            headers={"Authorization": api._token},
+            json={"volume": "1", "price": "1", "side": "bid"},
+        )
+        assert response.status_code == 400
+        assert response.json() == {"errors": ["Not enough funds"]}
+        api.bid(volume=Decimal("0.5"), price=Decimal(1), market="ETH-BTC")
+
+        assert api.balance(currency="BTC") == Decimal("0")
+        assert api.order_book(market="ETH-BTC") == {
+            "asks": [],
+            "bids": [{"price": "1", "volume": "0.5"}],
+        }
+
+
+def test_placing_and_cancelling_orders_does_not_touch_wallets_storage(
+    api: Api,
+) -> None:
+    storage = MemoryStorage()
+    with patch.object(wallets, "ledger", new=MemoryLedger(storage)):
+        api.deposit(currency="BTC", amount=Decimal("1"))
+        api.balance(currency="BTC")
+
+        with patch.multiple(
+            storage, balance=DEFAULT, credit=DEFAULT, credit_many=DEFAULT
+        ) as calls:
+            order_id = api.bid(volume=Decimal("0.5"), price=Decimal(1))
+            assert api.balance(currency="BTC") == Decimal("0.5")
+            api.cancel_order(order_id)
+            api.place_orders(
+                [
+                    {"volume": "0.2", "price": "1", "side": "bid"},
+                    {"volume": "0.3", "price": "2", "side": "bid"},
+                ]
+            )
+            assert api.balance(currency="BTC") == Decimal("0.2")
+            api.cancel_all_orders()
+
+        assert api.balance(currency="BTC") == Decimal("1")
+        for mock in calls.values():
+            mock.assert_not_called()
+
+
+def test_order_book_can_be_limited_to_best_levels(api: Api) -> None:
+    api.deposit(currency="BTC", amount=Decimal("5"))
+    api.bid(volume=Decimal("0.2"), price=Decimal(1), market="ETH-BTC")
+    api.bid(volume=Decimal("0.2"), price=Decimal(3), market="ETH-BTC")
+    api.bid(volume=Decimal("0.2"), price=Decimal(2), market="ETH-BTC")
+
+    assert api.order_book(market="ETH-BTC", depth=2) == {
+        "asks": [],
+        "bids": [
+            {"price": "3", "volume": "0.2"},
+            {"price": "2", "volume": "0.2"},
+        ],
+    }
+    assert len(api.order_book(market="ETH-BTC")["bids"]) == 3
+
+
+def test_order_off_the_tick_size_is_rejected(api: Api, client: TestClient) -> None:
+    api.deposit(currency="BTC", amount=Decimal("1"))
+
+    response = client.post(
+        "trading/ETH-BTC/orders",
+        headers={"Authorization": api._token},
+        json={"volume": "1", "price": "0.00001", "side": "bid"},
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {
+        "errors": ["Price must be a multiple of tick size 0.0001"]
+    }
+    assert api.balance(currency="BTC") == Decimal("1")
+
+
+@pytest.mark.parametrize(
+    "volume, price, error",
+    [
+        ("1", "1e30", "Price is too large"),
+        ("1e30", "1", "Volume is too large"),
+    ],
+)
+def test_order_too_large_for_decimal_precision_is_rejected(
+    api: Api, client: TestClient, volume: str, price: str, error: str
+) -> None:
+    response = client.post(
+        "trading/ETH-BTC/orders",
+        headers={"Authorization": api._token},
+        json={"volume": volume, "price": price, "side": "bid"},
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {"errors": [error]}
+
+
+def test_batch_of_orders_is_placed_and_paid_for_at_once(api: Api) -> None:
+    api.deposit(currency="BTC", amount=Decimal("10"))
+    api.deposit(currency="ETH", amount=Decimal("10"))
+
+    order_ids = api.place_orders(
+        [
+            {"volume": "1", "price": "1", "side": "bid"},
+            {"volume": "1", "price": "2", "side": "bid"},
+            {"volume": "2", "price": "3", "side": "ask"},
+        ]
+    )
+
+    assert len(set(order_ids)) == 3
+    assert api.balance(currency="BTC") == Decimal("7")
+    assert api.balance(currency="ETH") == Decimal("8")
+    assert api.order_book(market="ETH-BTC") == {
+        "asks": [{"price": "3", "volume": "2"}],
+        "bids": [{"price": "2", "volume": "1"}, {"price": "1", "volume": "1"}],
+    }
+
+
+def test_batch_the_user_cant_afford_is_rejected_whole(
+    api: Api, client: TestClient
+) -> None:
+    api.deposit(currency="BTC", amount=Decimal("2"))
+    api.deposit(currency="ETH", amount=Decimal("1"))
+
+    response = client.post(
+        "trading/ETH-BTC/orders/batch",
+        headers={"Authorization": api._token},
+        json={
+            "orders": [
+                {"volume": "1", "price": "1", "side": "bid"},
+                {"volume": "1", "price": "1", "side": "ask"},
+                {"volume": "1", "price": "2", "side": "bid"},
+            ]
+        },
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {"errors": ["Not enough funds"]}
+
+    assert api.balance(currency="BTC") == Decimal("2")
+    assert api.balance(currency="ETH") == Decimal("1")
+    assert api.order_book(market="ETH-BTC") == {"asks": [], "bids": []}
+
+
+def test_batch_with_invalid_order_is_rejected(api: Api, client: TestClient) -> None:
+    api.deposit(currency="BTC", amount=Decimal("10"))
+
+    response = client.post(
+        "/trading/ETH-BTC/orders/batch",
+        headers={"Authorization": api._token},
+        json={
+            "orders": [
+                {"volume": "1", "price": "1", "side": "bid"},
+                {"volume": "1", "price": "1.00001", "side": "bid"},
+            ]
+        },
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {
+        "errors": ["orders[1]: Price must be a multiple of tick size 0.0001"]
+    }
+    assert api.balance(currency="BTC") == Decimal("10")
+
+
+def test_cancelling_batch_and_all_orders_returns_funds(
+    api: Api, client: TestClient, other_token: str
+) -> None:
+    other_api = Api(client=client, token=other_token)
+    other_api.deposit(currency="BTC", amount=Decimal("1"))
+    other_order_id = other_api.bid(volume=Decimal("1"), price=Decimal("1"))
+    api.deposit(currency="BTC", amount=Decimal("10"))
+    order_ids = api.place_orders(
+        [{"volume": "1", "price": str(price), "side": "bid"} for price in range(1, 5)]
+    )
+
+    cancelled = api.cancel_orders([order_ids[0], order_ids[1], other_order_id, "x"])
+
+    assert cancelled == order_ids[:2]
+    assert api.balance(currency="BTC") == Decimal("3")
+    assert api.cancel_all_orders() == order_ids[2:]
+    assert api.balance(currency="BTC") == Decimal("10")
+    assert api.order_book(market="ETH-BTC") == {
+        "asks": [],
+        "bids": [{"price": "1", "volume": "1"}],
+    }
+
+
+def test_cancelling_all_orders_skips_those_that_were_filled(
+    api: Api, client: TestClient, other_token: str
+) -> None:
+    api.deposit(currency="ETH", amount=Decimal("3"))
+    order_ids = api.place_orders(
+        [{"volume": "1", "price": str(price), "side": "ask"} for price in range(1, 4)]
+    )
+    buyer = Api(client=client, token=other_token)
+    buyer.deposit(currency="BTC", amount=Decimal("3"))
+    # fills the first ask and half of the second one
+    buyer.bid(volume=Decimal("1.5"), price=Decimal("2"))
+
+    assert api.cancel_all_orders() == order_ids[1:]
+    assert api.cancel_all_orders() == []
+    assert api.balance(currency="ETH") == Decimal("1.5")
+
+
+def test_orders_for_unknown_markets_are_rejected_before_touching_wallets(
+    api: Api, client: TestClient
+) -> None:
+    api.deposit(currency="BTC", amount=Decimal("1"))
+
+    with patch.object(wallets, "hold") as hold:
+        response = client.post(
+            "trading/ETHBTC/orders",
+            headers={"Authorization": api._token},
+            json={"volume": "1", "price": "1", "side": "bid"},
+        )
+
+    assert response.status_code == 404
+    assert response.json() == {"errors": ["Unknown market ETHBTC"]}
+    hold.assert_not_called()
+
+
+def test_markets_not_listed_are_known_only_if_opened(
+    api: Api, client: TestClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(markets, "_markets", {"ETH-BTC": Market("ETH", "BTC")})
+
+    assert client.get("trading/ETH-BTC/order_book").status_code == 200
+    assert client.get("trading/LTC-BTC/order_book").status_code == 404
+    assert markets._markets.keys() == {"ETH-BTC"}
+
+    monkeypatch.setattr(config, "OPEN_MARKETS", True)
+    assert client.get("trading/LTC-BTC/order_book").status_code == 200
+
+
+def test_order_with_numbers_instead_of_strings_is_placed(
+    api: Api, client: TestClient
+) -> None:
+    api.deposit(currency="BTC", amount=Decimal("1"))
+
+    response = client.post(
+        "trading/ETH-BTC/orders",
+        headers={"Authorization": api._token},
+        json={"volume": 1, "price": 0.25, "side": "bid"},
+    )
+
+    assert response.status_code == 202
+    assert api.balance(currency="BTC") == Decimal("0.75")
+
+
+@pytest.mark.parametrize(
+    "body, location",
+    [
+        ({"volume": "1", "price": "1", "side": "buy"}, ["body", "side"]),
+        ({"volume": "1", "side": "bid"}, ["body", "price"]),
+        ({"volume": "1", "price": "NaN", "side": "bid"}, ["body", "price"]),
+    ],
+)
+def test_malformed_order_is_rejected(
+    api: Api, client: TestClient, body: dict, location: list[str]
+) -> None:
+    response = client.post(
+        "trading/ETH-BTC/orders", headers={"Authorization": api._token}, json=body
+    )
+
+    assert response.status_code == 422
+    assert [error["loc"] for error in response.json()["detail"]] == [location]
+
+
+@pytest.mark.parametrize("caller", ["cancelled", "timed out"])
+def test_order_is_settled_even_if_its_caller_goes_away(
+    monkeypatch: pytest.MonkeyPatch, start_sweep: StartSweep, caller: str
+) -> None:
+    market = market_from_str("ETH-BTC")
+    # the event loop is free to time the caller out while the book is matched
+    engine = LocalEngine({}, Feed(max_pending=10), executor="thread")
+    monkeypatch.setattr(trading, "engine", engine)
+    monkeypatch.setattr(wallets, "ledger", MemoryLedger(MemoryStorage()))
+    monkeypatch.setattr(config, "ENGINE_REPLY_TIMEOUT", 0.05)
+
+    async def leave_sweep() -> list[int]:
+        sweep = await start_sweep(market)
+        if caller == "cancelled":
+            await asyncio.sleep(0.02)
+            sweep.cancel()
+            with suppress(asyncio.CancelledError):
+                await sweep
+        else:
+            with pytest.raises(trading.EngineTimeout):
+                await sweep
+
+        async def settled() -> None:
+            while not await wallets.balance("buyer", "ETH"):
+                await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(settled(), timeout=5)
+        balances = [
+            await wallets.balance("buyer", "BTC"),
+            await wallets.balance("seller", "BTC"),
+        ]
+        await trading.engine.close()
+        return balances
+
+    assert asyncio.run(leave_sweep()) == [0, market.quote_units(1, 200)]
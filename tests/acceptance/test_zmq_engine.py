@@ -0,0 +1,96 @@
+import asyncio
+import json
+from contextlib import suppress
+from pathlib import Path
+
+import pytest
+
+from mbex import trading, wallets
+from mbex.trading import EngineFailed, EngineUnavailable, Side, market_from_str
+from mbex.trading.feed import Feed
+from mbex.trading.zmq_engine import ZmqEngine
+from mbex.wallets.ledger import MemoryLedger
+from mbex.wallets.storage import MemoryStorage
+from tests.conftest import StartSweep
+
+
+def test_request_cancelled_while_matching_still_completes(
+    tmp_path: Path, start_sweep: StartSweep
+) -> None:
+    market = market_from_str("ETH-BTC")
+    engine = ZmqEngine(str(tmp_path), Feed(max_pending=10))
+
+    async def cancel_sweep() -> dict:
+        sweep = await start_sweep(market, engine)
+        await asyncio.sleep(0.05)
+        sweep.cancel()
+        with suppress(asyncio.CancelledError):
+            await sweep
+        depth = json.loads(await engine.depth(market))
+        await engine.close()
+        return depth
+
+    assert asyncio.run(cancel_sweep()) == {"asks": [], "bids": []}
+
+
+def test_market_whose_engine_died_is_out_of_service(
+    tmp_path: Path, start_sweep: StartSweep
+) -> None:
+    market = market_from_str("ETH-BTC")
+    engine = ZmqEngine(str(tmp_path), Feed(max_pending=10))
+
+    async def kill_engine() -> None:
+        sweep = await start_sweep(market, engine, fills=1000)
+        await asyncio.sleep(0.1)
+        engine._processes[market].kill()
+        # what the sweep did is lost with the book
+        with pytest.raises(EngineFailed):
+            await sweep
+        # not started again with an empty book, funds of the asks are still held
+        with pytest.raises(EngineUnavailable):
+            await engine.cancel(market, "seller", 1)
+        await engine.close()
+
+    asyncio.run(kill_engine())
+
+
+def test_order_for_market_whose_engine_died_gets_its_funds_back(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    market = market_from_str("ETH-BTC")
+    engine = ZmqEngine(str(tmp_path), Feed(max_pending=10))
+    monkeypatch.setattr(trading, "engine", engine)
+    monkeypatch.setattr(wallets, "ledger", MemoryLedger(MemoryStorage()))
+
+    async def place_after_kill() -> int:
+        await engine.open(market)
+        engine._processes[market].kill()
+        engine._processes[market].join()
+        await wallets.credit("buyer", "BTC", market.quote_units(1, 1))
+        with pytest.raises(EngineUnavailable):
+            await trading.place_order(market, 1, 1, Side.bid, "buyer", None)
+        await engine.close()
+        return await wallets.balance("buyer", "BTC")
+
+    assert asyncio.run(place_after_kill()) == market.quote_units(1, 1)
+
+
+def test_commands_are_rejected_while_engine_is_overdue(
+    tmp_path: Path, start_sweep: StartSweep
+) -> None:
+    market = market_from_str("ETH-BTC")
+    engine = ZmqEngine(str(tmp_path), Feed(max_pending=10), timeout=0.1)
+
+    async def depth_during_long_sweep() -> dict:
+        sweep = await start_sweep(market, engine, fills=500)
+        await asyncio.sleep(0.2)
+        with pytest.raises(EngineUnavailable):
+            await engine.depth(market)
+        # the sweep itself is waited for, however long it takes
+        _order_id, trades = await sweep
+        assert len(trades) == 500
+        depth = json.loads(await engine.depth(market))
+        await engine.close()
+        return depth
+
+    assert asyncio.run(depth_during_long_sweep()) == {"asks": [], "bids": []}
@@ -1,7 +1,15 @@
+import asyncio
+from typing import Awaitable, Callable
+
 import pytest
 from fastapi.testclient import TestClient
 
+from mbex import trading, wallets
 from mbex.main import initialize
+from mbex.trading import Engine, Market, Side
+from tests.acceptance.api import Api
+
+StartSweep = Callable[..., Awaitable[asyncio.Task]]
 
 
 @pytest.fixture()
@@ -9,6 +17,36 @@ def client() -> TestClient:
     return TestClient(initialize())
 
 
+@pytest.fixture()
+def api(token: str, client: TestClient) -> Api:
+    return Api(client=client, token=token)
+
+
+@pytest.fixture()
+def start_sweep() -> StartSweep:
+    """Starts a bid taking `fills` asks of a single lot, each fill a millisecond long.
+
+    Placed on `engine` directly, or through `trading` - funds of both users
+    deposited and held - if there's none.
+    """
+
+    async def start(
+        market: Market, engine: Engine | None = None, fills: int = 200
+    ) -> asyncio.Task:
+        asks = [(Side.ask, 1, 1)] * fills
+        if engine is None:
+            await wallets.credit("seller", market.base, market.base_units(fills))
+            await wallets.credit("buyer", market.quote, market.quote_units(1, fills))
+            await trading.place_orders(market, asks, "seller", None)
+            bid = trading.place_order(market, 1, fills, Side.bid, "buyer", None)
+        else:
+            await engine.place_many(market, asks, "seller")
+            bid = engine.place(market, Side.bid, 1, fills, "buyer")
+        return asyncio.create_task(bid)
+
+    return start
+
+
 @pytest.fixture()
 def disable_password_hashing() -> None:
     """Use simple implementations to speed up tests."""
@@ -37,6 +75,16 @@ ids = iter(range(100_000))
 
 @pytest.fixture()
 def token(client: TestClient) -> str:
+    return _new_user_token(client)
+
+
+@pytest.fixture()
+def other_token(client: TestClient) -> str:
+    """Token of a second user, e.g. the other side of a trade."""
+    return _new_user_token(client)
+
+
+def _new_user_token(client: TestClient) -> str:
     username = f"test+username+{next(ids)}@enforcer.pl"
     register_response = client.post(
         "/auth/registration",